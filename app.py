@@ -8,29 +8,61 @@ import time
 import re
 import asyncio
 import hashlib
+import base64
+import mimetypes
 from datetime import datetime
 from flask import (
     Flask, render_template, request, jsonify,
-    redirect, url_for, session, send_from_directory, abort, make_response
+    redirect, url_for, session, send_from_directory, send_file, abort, make_response,
+    Response
 )
 from werkzeug.utils import secure_filename
+from markupsafe import Markup, escape
 from telegram import (
     InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, Bot,
-    MenuButtonWebApp, Update, InputFile
+    MenuButtonWebApp, Update, InputFile,
+    InlineQueryResultArticle, InputTextMessageContent
 )
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+from telegram.ext import Updater, CommandHandler, MessageHandler, InlineQueryHandler, Filters
+from telegram.utils.request import Request
 import redis
 import json
 from database import (
-    get_or_create_user, get_user_role,
+    get_db_connection, get_or_create_user, get_user_role,
     add_moment, add_trailer, add_news,
     get_all_moments, get_all_trailers, get_all_news,
-    get_reactions_count, get_comments,
+    get_reactions_count, get_comments, get_comments_page,
     add_reaction, add_comment,
     authenticate_admin, get_stats,
     delete_item, get_access_settings, update_access_settings,
-    init_db, get_item_by_id
+    init_db, get_item_by_id, set_hls_url,
+    set_user_notifications, get_broadcasts, BROADCAST_ENABLED,
+    search_videos, search_content, HIGHLIGHT_START, HIGHLIGHT_STOP,
+    find_similar_content, get_link_metadata, save_link_metadata,
+    add_reactions_bulk, get_reaction_users,
+    toggle_comment_reaction, get_comment_reactions_batch, COMMENT_REACTIONS,
+    add_comments_bulk, get_comments_counts, ITEM_ADDED_HANDLERS, query_profiler, ROW_ERRORS
 )
+import hls
+import media_proxy
+from media_proxy import TELEGRAM_API_URL
+import images
+import link_resolver
+import file_serving
+from webhook_queue import UpdateWorkerPool, UpdateDeduplicator
+from conversation_state import ConversationStore
+from broadcast import Broadcaster
+from authorization import AccessControl
+from cachetools import TTLCache, LRUCache
+from reaction_counters import ReactionStore, REACTIONS
+from comment_writer import CommentWriter, PENDING_KEY as COMMENTS_PENDING_KEY
+from rate_limit import TokenBucket
+from live_events import EventPublisher, ITEM_ADDED, REACTIONS_CHANGED, COMMENT_ADDED
+from static_assets import AssetManifest, STATIC_DIR
+import request_timing
+from request_timing import span, timed
+import metrics
+from query_profiler import SLOW_QUERY_MS
 # --- Logging ---
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -40,6 +72,8 @@ TOKEN = os.environ.get('TELEGRAM_TOKEN')
 # Исправлено: убраны лишние пробелы
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL', 'https://cinema-space-bot.onrender.com').strip().rstrip('/')
 REDIS_URL = os.environ.get('REDIS_URL', None)
+TELEGRAM_BOT_API = f"{TELEGRAM_API_URL}/bot"        # + токен + /метод
+TELEGRAM_FILE_API = f"{TELEGRAM_API_URL}/file/bot"  # + токен + /file_path
 if not TOKEN:
     logger.error("TELEGRAM_TOKEN not set!")
 # --- Redis ---
@@ -60,7 +94,16 @@ else:
         logger.warning(f"Local Redis not available: {e}")
         redis_client = None
 # --- Flask ---
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # /static отдаёт static_files (собранные файлы с хэшем)
+# Server-Timing: время PostgreSQL, Redis, Telegram, шаблонов и ETag в каждом ответе
+request_timing.init_app(app)
+request_timing.instrument_redis(redis_client)
+# /metrics (Prometheus): время запросов по маршрутам; очередь комментариев читается из Redis при опросе
+app_metrics = metrics.Metrics(redis_client, {
+    'comments_pending_depth': (COMMENTS_PENDING_KEY, 'Комментарии в очереди на запись в БД'),
+})
+app_metrics.init_app(app)
+query_profiler.set_redis_client(redis_client)  # статистика запросов общая для воркеров (/admin/queries)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'super-secret-key')
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -80,28 +123,69 @@ except Exception as e:
 # --- Telegram Bot ---
 updater = None
 dp = None
-pending_video_data = {}
+# Состояние диалога /add_video хранится в Redis с TTL, чтобы шаги работали в любом воркере
+pending_video_data = ConversationStore(redis_client, namespace='pending_video')
+# Роли пользователей и правила access_settings кэшируются в процессе (см. authorization.py)
+access_control = AccessControl(get_user_role, get_access_settings, redis_client)
+# Недавно сохранённые пользователи: повторный /start с тем же именем не идёт в БД
+USER_CACHE_TTL = 60
+user_cache = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL)
+user_cache_lock = threading.Lock()
+def register_user(tg_user):
+    """Создаёт/обновляет пользователя Telegram и возвращает его роль"""
+    telegram_id = str(tg_user.id)
+    identity = (tg_user.username, tg_user.first_name, tg_user.last_name)
+    with user_cache_lock:
+        cached = user_cache.get(telegram_id)
+    if cached and cached[0] == identity:
+        return cached[1]
+    user = get_or_create_user(
+        telegram_id=telegram_id,
+        username=tg_user.username,
+        first_name=tg_user.first_name,
+        last_name=tg_user.last_name
+    )
+    role = user[5]
+    with user_cache_lock:
+        user_cache[telegram_id] = (identity, role)
+    access_control.remember_role(telegram_id, role)
+    return role
 # --- НОВОЕ: Конфигурация кэширования ---
 CACHE_CONFIG = {
     'html_expire': 300,       # Было 1800 (30 минут), стало 5 минут
     'api_expire': 120,        # Было 300 (5 минут), стало 2 минуты
     'data_expire': 300,       # Было 600 (10 минут), стало 5 минут
     'static_expire': 2592000, # 30 дней для статики (CSS, JS, изображения)
+    'static_hashed_expire': 31536000, # 1 год для собранной статики (хэш в имени файла)
     'video_url_cache_time': 86400, # Было 21600 (6 часов), стало 24 часа
+    'hls_expire': 31536000,   # 1 год для HLS (пакеты неизменяемые)
+    'image_expire': 604800,   # 7 дней для уменьшенных копий изображений
+    'inline_expire': 60,      # 1 минута для результатов inline-поиска в Redis
+    'inline_cache_time': 300, # 5 минут кэширования inline-ответа на стороне Telegram
+    'search_expire': 300,     # 5 минут для результатов популярных поисковых запросов
+    'link_meta_expire': 86400,    # 24 часа для метаданных по ссылке
+    'link_error_expire': 600,     # 10 минут не повторяем неудачное извлечение
+    'comments_expire': 300,   # 5 минут для первой страницы комментариев (по каждой сортировке)
     'default_expire': 300     # Значение по умолчанию
 }
 # --- НОВОЕ: Декораторы для кэширования ---
 from functools import wraps
-def cache_control(max_age):
+def cache_control(max_age, immutable=False):
     """Декоратор для установки заголовков кэширования."""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             resp = make_response(f(*args, **kwargs))
-            resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+            resp.headers['Cache-Control'] = f'public, max-age={max_age}' + (', immutable' if immutable else '')
             return resp
         return decorated_function
     return decorator
+@timed('etag')
+def content_etag(data):
+    """ETag ответа — md5 содержимого"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.md5(data).hexdigest()
 def etag_cache(key_generator_func):
     """Декоратор для кэширования с использованием ETags."""
     def decorator(f):
@@ -121,7 +205,7 @@ def etag_cache(key_generator_func):
             # Если кэш отсутствует или ETag не совпал, выполняем функцию
             html_content = f(*args, **kwargs)
             # Генерируем ETag на основе содержимого
-            etag = hashlib.md5(html_content.encode('utf-8')).hexdigest() # <-- Используется hashlib
+            etag = content_etag(html_content)
             # Сохраняем в кэш с ETag
             cache_set(cache_key, {'html': html_content, 'etag': etag}, expire=CACHE_CONFIG['html_expire'])
             # Возвращаем ответ с ETag
@@ -154,6 +238,7 @@ def get_cached_direct_video_url_advanced(file_id, cache_time=None):
             if new_url:
                 # Обновляем кэш
                 video_url_cache_advanced[file_id] = (new_url, current_time + cache_time, original_file_id)
+                metrics.FILE_URL_CACHE_ENTRIES.set(len(video_url_cache_advanced))
                 logger.info(f"Ссылка для file_id {file_id} успешно обновлена")
                 return new_url, True # True = была обновлена
             else:
@@ -165,9 +250,18 @@ def get_cached_direct_video_url_advanced(file_id, cache_time=None):
     url = get_direct_video_url(file_id)
     if url:
         video_url_cache_advanced[file_id] = (url, current_time + cache_time, file_id)
+        metrics.FILE_URL_CACHE_ENTRIES.set(len(video_url_cache_advanced))
         logger.debug(f"Ссылка для file_id {file_id} закэширована")
         return url, False # Новая ссылка
     return None, False
+class TelegramRequest(Request):
+    """Запросы бота к Bot API: участок 'telegram' (Server-Timing) и метрики по методу"""
+    def _request_wrapper(self, http_method, url, *args, **kwargs):
+        with span('telegram'), metrics.telegram_call(metrics.telegram_method(url)):
+            return super()._request_wrapper(http_method, url, *args, **kwargs)
+def telegram_bot():
+    """Bot для разовых вызовов (пересылка, загрузка файлов) на адрес TELEGRAM_API_URL"""
+    return Bot(token=TOKEN, base_url=TELEGRAM_BOT_API, base_file_url=TELEGRAM_FILE_API, request=TelegramRequest())
 def get_direct_video_url(file_id):
     """Преобразует file_id в прямую ссылку для веба"""
     bot_token = TOKEN
@@ -176,18 +270,20 @@ def get_direct_video_url(file_id):
         return None
     try:
         # ИСПРАВЛЕНО: Убраны лишние пробелы в URL
-        file_info_url = f"https://api.telegram.org/bot{bot_token}/getFile?file_id={file_id}"
+        file_info_url = f"{TELEGRAM_BOT_API}{bot_token}/getFile?file_id={file_id}"
         logger.debug(f"Запрос к Telegram API: {file_info_url}")
-        response = requests.get(file_info_url, timeout=10)
-        response.raise_for_status()
+        with span('telegram'), metrics.telegram_call('getFile'):
+            response = requests.get(file_info_url, timeout=10)
+            response.raise_for_status()
         json_response = response.json()
         logger.debug(f"Ответ от Telegram API: {json_response}")
         if not json_response.get('ok'):
+            metrics.TELEGRAM_ERRORS.labels('getFile').inc()
             logger.error(f"Ошибка от Telegram API: {json_response}")
             return None
         file_path = json_response['result']['file_path']
         # ИСПРАВЛЕНО: Убраны лишние пробелы в URL
-        direct_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+        direct_url = f"{TELEGRAM_FILE_API}{bot_token}/{file_path}"
         logger.info(f"Сгенерирована прямая ссылка для file_id {file_id}")
         return direct_url
     except requests.exceptions.RequestException as e:
@@ -229,7 +325,7 @@ async def extract_video_url_from_telegram_post(post_url):
             return None, "Неверный формат ссылки на пост Telegram."
         if chat_id_or_username is None or message_id is None:
              return None, "Не удалось распарсить ссылку на пост"
-        bot = Bot(token=TOKEN)
+        bot = telegram_bot()
         # --- ИСПРАВЛЕНИЕ: Всегда пересылаем в тестовую группу ---
         # Это предотвращает дублирование в исходном канале
         YOUR_TEST_CHAT_ID = -1003045387627 # <<<--- ВАШ ID ТЕСТОВОЙ ГРУППЫ
@@ -309,7 +405,7 @@ async def extract_image_url_from_telegram_post(post_url):
             return None, "Неверный формат ссылки на пост Telegram."
         if chat_id_or_username is None or message_id is None:
              return None, "Не удалось распарсить ссылку на пост"
-        bot = Bot(token=TOKEN)
+        bot = telegram_bot()
         # --- ИСПРАВЛЕНИЕ: Всегда пересылаем в тестовую группу ---
         YOUR_TEST_CHAT_ID = -1003045387627 # <<<--- ВАШ ID ТЕСТОВОЙ ГРУППЫ
         try:
@@ -404,7 +500,7 @@ def get_cached_html(key, generate_func, expire=None):
     html = generate_func()
     if html:
         # Генерируем ETag
-        etag = hashlib.md5(html.encode('utf-8')).hexdigest() # <-- Используется hashlib
+        etag = content_etag(html)
         # Сохраняем в кэш с ETag
         cache_set(etag_cache_key, {'html': html, 'etag': etag}, expire=expire)
         logger.info(f"HTML для {key} закэширован на {expire} секунд (с ETag)")
@@ -417,7 +513,7 @@ def set_menu_button():
         return False
     try:
         logger.info("Начало выполнения set_menu_button")
-        bot = Bot(token=TOKEN)
+        bot = telegram_bot()
         logger.info("Объект Bot создан")
         # Установка Menu Button
         app_url = f"{WEBHOOK_URL}/?mode=fullscreen"
@@ -434,7 +530,9 @@ def set_menu_button():
         logger.error(f"❌ ОШИБКА в set_menu_button: {e}", exc_info=True)
         return False
 if TOKEN:
-    updater = Updater(TOKEN, use_context=True)
+    # Пул соединений как у Updater по умолчанию: 4 воркера + диспетчер, опрос, JobQueue и основной поток
+    updater = Updater(bot=Bot(token=TOKEN, base_url=TELEGRAM_BOT_API, base_file_url=TELEGRAM_FILE_API,
+                              request=TelegramRequest(con_pool_size=8)), use_context=True)
     dp = updater.dispatcher
     # --- Обработчик команды /start ---
     def start(update, context):
@@ -445,14 +543,9 @@ if TOKEN:
             logger.info(f"Получен user: {user}")
             telegram_id = str(user.id)
             logger.info(f"Telegram ID: {telegram_id}")
-            logger.info("Вызов get_or_create_user...")
-            get_or_create_user(
-                telegram_id=telegram_id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name
-            )
-            logger.info("get_or_create_user выполнен")
+            logger.info("Вызов register_user...")
+            register_user(user)
+            logger.info("register_user выполнен")
             app_url = f"{WEBHOOK_URL}/?mode=fullscreen"
             logger.info(f"Сформированный URL кнопки: {app_url}")
             keyboard = [[
@@ -501,6 +594,10 @@ def cache_get(key):
         return None
     try:
         raw = redis_client.get(key)
+    except Exception:
+        return None
+    metrics.record_cache(metrics.cache_namespace(key), hits=int(bool(raw)), misses=int(not raw))
+    try:
         return json.loads(raw) if raw else None
     except Exception:
         return None
@@ -518,30 +615,106 @@ def cache_delete(key):
             redis_client.delete(key)
         except Exception:
             pass
+def get_cached_item(item_type_plural, item_id):
+    """Элемент из кэша Redis или из БД (с сохранением в кэш)"""
+    item_cache_key = f"item_{item_type_plural}_{item_id}"
+    item = cache_get(item_cache_key)
+    if not item:
+        item = get_item_by_id(item_type_plural, item_id)
+        if item:
+            cache_set(item_cache_key, item, expire=CACHE_CONFIG['data_expire'])
+    return item
+# --- НОВОЕ: Живые обновления для клиентов: события уходят в Redis, поток /events отдаёт events_server.py ---
+# Пустой EVENTS_URL — потока нет, клиенты опрашивают вкладку (так же они поступают, если /events не отвечает 200)
+EVENTS_URL = os.environ.get('EVENTS_URL', '/events')
+live_events = EventPublisher(redis_client)
+def on_item_added(item_type_plural, item_id, title):
+    # Ключ кэша HTML списка — etag_cache_<тип>_page (удаление '<тип>_page' его не задевает)
+    drop_list_caches(item_type_plural)
+    live_events.publish(ITEM_ADDED, item_type=item_type_plural, item_id=item_id, title=title)
+ITEM_ADDED_HANDLERS.append(on_item_added)
+# --- НОВОЕ: Реакции считаются в Redis и пачками пишутся в БД (reaction_counters.py) ---
+reaction_store = ReactionStore(redis_client, get_reaction_users, add_reactions_bulk, get_reactions_count,
+                               ROW_ERRORS) if redis_client else None
+# Детальные страницы шлют тип в единственном числе, списки и БД — во множественном
+REACTION_ITEM_TYPES = {'moment': 'moments', 'moments': 'moments', 'trailer': 'trailers',
+                       'trailers': 'trailers', 'news': 'news'}
+PG_INT_MAX = 2**31 - 1  # item_id в БД — INTEGER
+REACTION_USER_ID_MAX_LENGTH = 128  # user_id входит в уникальный индекс reactions
+def valid_item_id(item_id):
+    return 0 < item_id <= PG_INT_MAX
+def has_nul(*values):
+    """PostgreSQL не хранит NUL в TEXT: такая строка сломала бы пакетную запись из очереди"""
+    return any('\x00' in value for value in values)
+def get_item_reactions(item_type_plural, item_id):
+    """Счётчики реакций элемента: из Redis, а без него — из БД с кэшированием"""
+    if reaction_store:
+        try:
+            return reaction_store.counts(item_type_plural, item_id)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения реакций из Redis: {e}")
+    reactions_cache_key = f"reactions_{item_type_plural}_{item_id}"
+    reactions = cache_get(reactions_cache_key)
+    if reactions is None:
+        reactions = get_reactions_count(item_type_plural, item_id) or {r: 0 for r in REACTIONS}
+        cache_set(reactions_cache_key, reactions, expire=CACHE_CONFIG['data_expire'])
+    return reactions
+# --- НОВОЕ: Фоновая упаковка видео в HLS ---
+def _on_hls_ready(item_type_plural, item_id, hls_url):
+    """Сохраняет плейлист в БД и сбрасывает кэш страниц элемента"""
+    set_hls_url(item_type_plural, item_id, hls_url)
+    cache_delete(f"item_{item_type_plural}_{item_id}")
+    cache_delete(f"etag_cache_{item_type_plural}_page")
+def schedule_hls_packaging(item_type_plural, item_id, video_url):
+    """Ставит видео в очередь транскодирования, если HLS включён (HLS_ENABLED=1)"""
+    if item_id is None:
+        return False
+    return hls.submit(item_type_plural, item_id, video_url,
+                      upload_folder=app.config['UPLOAD_FOLDER'], on_done=_on_hls_ready)
+# --- КОНЕЦ НОВОГО ---
 def build_extra_map(data, item_type_plural):
     """Добавляет реакции и комментарии к каждому элементу данных."""
     extra = {}
+    reactions_map = {}
+    if reaction_store:
+        try:
+            reactions_map = reaction_store.counts_many(item_type_plural, [row[0] for row in data])
+        except Exception as e:
+            logger.warning(f"Ошибка чтения реакций из Redis: {e}")
+    comments_counts = get_comments_counts_cached(item_type_plural, [row[0] for row in data])
     for row in data:
         item_id = row[0]
-        # Попробуем получить реакции из кэша
-        reactions_cache_key = f"reactions_{item_type_plural}_{item_id}"
-        reactions = cache_get(reactions_cache_key)
-        if reactions is None: # Может быть {}, что тоже валидно
-            reactions = get_reactions_count(item_type_plural, item_id) or {'like': 0, 'dislike': 0, 'star': 0, 'fire': 0}
-            cache_set(reactions_cache_key, reactions, expire=CACHE_CONFIG['data_expire'])
-        # Попробуем получить комментарии из кэша
-        comments_cache_key = f"comments_{item_type_plural}_{item_id}"
-        comments = cache_get(comments_cache_key)
-        if comments is None:
-            comments = get_comments(item_type_plural, item_id) or []
-            cache_set(comments_cache_key, comments, expire=CACHE_CONFIG['data_expire'])
-        extra[item_id] = {'reactions': reactions, 'comments_count': len(comments)}
+        reactions = reactions_map.get(item_id) or get_item_reactions(item_type_plural, item_id)
+        extra[item_id] = {'reactions': reactions, 'comments_count': comments_counts.get(item_id, 0)}
     return extra
+def get_comments_counts_cached(item_type_plural, item_ids):
+    """Число комментариев: счётчики в Redis (увеличиваются при записи), промахи — одним запросом к БД"""
+    counts = {}
+    if redis_client and item_ids:
+        try:
+            raw = redis_client.mget([f"comments_count_{item_type_plural}_{i}" for i in item_ids])
+            counts = {i: int(v) for i, v in zip(item_ids, raw) if v is not None}
+            metrics.record_cache('comments_count', hits=len(counts), misses=len(item_ids) - len(counts))
+        except Exception as e:
+            logger.warning(f"Ошибка чтения счётчиков комментариев из Redis: {e}")
+    missing = [i for i in item_ids if i not in counts]
+    if missing:
+        loaded = get_comments_counts(item_type_plural, missing)
+        counts.update(loaded)
+        if redis_client:
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                for item_id, count in loaded.items():
+                    pipe.set(f"comments_count_{item_type_plural}_{item_id}", count, ex=CACHE_CONFIG['data_expire'])
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Ошибка сохранения счётчиков комментариев в Redis: {e}")
+    return counts
 # --- Routes (пользовательские) ---
 @app.route('/')
 @cache_control(CACHE_CONFIG['html_expire']) # Кэшируем главную страницу
 def index():
-    return render_template('index.html')
+    return render_template('index.html', events_url=EVENTS_URL)
 # --- НОВЫЙ МАРШРУТ ДЛЯ ПОИСКА ПО ССЫЛКЕ ---
 @app.route('/search_by_link')
 @cache_control(CACHE_CONFIG['html_expire']) # Кэшируем страницу поиска
@@ -549,6 +722,117 @@ def search_by_link_page():
     """Отображает страницу поиска фильма по ссылке."""
     return render_template('search_by_link.html')
 # --- КОНЕЦ НОВОГО МАРШРУТА ---
+# --- НОВОЕ: Метаданные по ссылке (yt-dlp) с кэшем в Redis и PostgreSQL ---
+def resolve_link_metadata(normalized_url):
+    """Метаданные ссылки: Redis -> PostgreSQL -> yt-dlp. Ошибки кэшируются ненадолго."""
+    key_hash = link_resolver.url_hash(normalized_url)
+    cache_key = f"link_meta_{key_hash}"
+    cached = cache_get(cache_key)
+    if cached is not None:
+        if 'error' in cached:
+            raise link_resolver.ResolverError(cached['error'])
+        return cached
+    metadata = get_link_metadata(key_hash)
+    if metadata is None:
+        try:
+            metadata = link_resolver.extract_metadata(normalized_url)
+        except link_resolver.ResolverBusy:
+            raise
+        except link_resolver.ResolverError as e:
+            cache_set(cache_key, {'error': str(e)}, expire=CACHE_CONFIG['link_error_expire'])
+            raise
+        save_link_metadata(key_hash, normalized_url, metadata)
+    cache_set(cache_key, metadata, expire=CACHE_CONFIG['link_meta_expire'])
+    return metadata
+SIMILAR_CONTENT_ENDPOINTS = {'moments': 'moment_detail', 'trailers': 'trailer_detail', 'news': 'news_detail'}
+@app.route('/api/search_film_by_link', methods=['POST'])
+def api_search_film_by_link():
+    data = request.get_json(silent=True) or {}
+    try:
+        normalized_url = link_resolver.normalize_url(data.get('url'))
+        metadata = resolve_link_metadata(normalized_url)
+    except link_resolver.ResolverBusy as e:
+        return jsonify(success=False, error=str(e)), 503
+    except link_resolver.ResolverError as e:
+        return jsonify(success=False, error=str(e)), 400
+    except Exception as e:
+        logger.error(f"search_film_by_link error: {e}", exc_info=True)
+        return jsonify(success=False, error='Внутренняя ошибка'), 500
+    matches = []
+    if metadata.get('title'):
+        try:
+            for m in find_similar_content(metadata['title']):
+                matches.append({
+                    'type': m['item_type'], 'id': m['id'], 'title': m['title'],
+                    'url': url_for(SIMILAR_CONTENT_ENDPOINTS[m['item_type']], item_id=m['id'])
+                })
+        except Exception as e:
+            logger.warning(f"Не удалось подобрать похожий контент: {e}")
+    return jsonify(success=True, url=normalized_url, film=metadata, matches=matches)
+# --- КОНЕЦ НОВОГО ---
+# --- НОВОЕ: Полнотекстовый поиск ---
+SEARCH_PAGE_SIZE = 20
+SEARCH_POPULAR_THRESHOLD = 3   # Кэшируем запрос, если его искали хотя бы 3 раза за окно
+SEARCH_POPULAR_WINDOW = 3600
+SEARCH_RESULT_TYPES = {
+    'moments': ('moment_detail', '🎬 Момент'),
+    'trailers': ('trailer_detail', '🎥 Трейлер'),
+    'news': ('news_detail', '📰 Новость'),
+}
+def highlight(text):
+    """Экранирует текст и превращает маркеры ts_headline в <mark>"""
+    escaped = str(escape(text or ''))
+    return Markup(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+app.jinja_env.filters['highlight'] = highlight
+def is_popular_query(query_hash):
+    """Считает обращения к запросу в Redis; True, если запрос стоит кэшировать"""
+    if not redis_client:
+        return False
+    try:
+        key = f"search_hits_{query_hash}"
+        hits = redis_client.incr(key)
+        if hits == 1:
+            redis_client.expire(key, SEARCH_POPULAR_WINDOW)
+        return hits >= SEARCH_POPULAR_THRESHOLD
+    except Exception:
+        return False
+def get_search_page(query, page):
+    """Страница результатов поиска; популярные запросы берутся из Redis"""
+    query_hash = hashlib.md5(query.lower().encode('utf-8')).hexdigest()
+    cache_key = f"search_{query_hash}_{page}"
+    data = cache_get(cache_key)
+    if data is not None:
+        return data
+    rows, total = search_content(query, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
+    data = {
+        'total': total,
+        'results': [{'type': r['item_type'], 'id': r['id'], 'title': r['title_hl'], 'snippet': r['body_hl']}
+                    for r in rows]
+    }
+    if is_popular_query(query_hash):
+        cache_set(cache_key, data, expire=CACHE_CONFIG['search_expire'])
+    return data
+@app.route('/search')
+@cache_control(CACHE_CONFIG['api_expire'])
+def search():
+    query = ' '.join(request.args.get('q', '').split())[:200]
+    page = max(1, request.args.get('page', 1, type=int))
+    if not query:
+        return render_template('search.html', query='', results=[], total=0, page=1, pages=0)
+    try:
+        data = get_search_page(query, page)
+    except Exception as e:
+        logger.error(f"Ошибка поиска '{query}': {e}", exc_info=True)
+        return render_template('search.html', query=query, results=[], total=0, page=1, pages=0,
+                               error='Поиск временно недоступен'), 500
+    results = []
+    for r in data['results']:
+        endpoint, label = SEARCH_RESULT_TYPES[r['type']]
+        results.append(dict(r, endpoint=endpoint, label=label))
+    pages = (data['total'] + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    return render_template('search.html', query=query, results=results,
+                           total=data['total'], page=page, pages=pages)
+# --- КОНЕЦ НОВОГО ---
 # --- ИЗМЕНЕННЫЕ: Кэшированные маршруты для вкладок с ETag ---
 # Функция для генерации ключа ETag для страницы списка
 def moments_page_key():
@@ -684,12 +968,7 @@ def moment_detail(item_id):
     if not item:
         logger.warning(f"Момент с id={item_id} не найден")
         abort(404)
-    # Попробуем получить реакции из кэша
-    reactions_cache_key = f"reactions_moments_{item_id}"
-    reactions = cache_get(reactions_cache_key)
-    if reactions is None: # Может быть {}, что тоже валидно
-        reactions = get_reactions_count('moments', item_id)
-        cache_set(reactions_cache_key, reactions, expire=CACHE_CONFIG['data_expire'])
+    reactions = get_item_reactions('moments', item_id)
     # Попробуем получить комментарии из кэша
     comments_cache_key = f"comments_moments_{item_id}"
     comments = cache_get(comments_cache_key)
@@ -703,7 +982,8 @@ def moment_detail(item_id):
         'description': item[2] if len(item) > 2 else '',
         'video_url': item[3] if len(item) > 3 else '',
         'preview_url': item[4] if len(item) > 4 else '', # Новое поле
-        'created_at': item[5] if len(item) > 5 else None # Обновлен индекс
+        'created_at': item[5] if len(item) > 5 else None, # Обновлен индекс
+        'hls_url': item[6] if len(item) > 6 else None # HLS-плейлист (если видео уже упаковано)
     }
     return render_template('moment_detail.html', item=item_dict, reactions=reactions, comments=comments)
 # Аналогично для трейлеров и новостей
@@ -721,11 +1001,7 @@ def trailer_detail(item_id):
     if not item:
         logger.warning(f"Трейлер с id={item_id} не найден")
         abort(404)
-    reactions_cache_key = f"reactions_trailers_{item_id}"
-    reactions = cache_get(reactions_cache_key)
-    if reactions is None:
-        reactions = get_reactions_count('trailers', item_id)
-        cache_set(reactions_cache_key, reactions, expire=CACHE_CONFIG['data_expire'])
+    reactions = get_item_reactions('trailers', item_id)
     comments_cache_key = f"comments_trailers_{item_id}"
     comments = cache_get(comments_cache_key)
     if comments is None:
@@ -738,7 +1014,8 @@ def trailer_detail(item_id):
         'description': item[2] if len(item) > 2 else '',
         'video_url': item[3] if len(item) > 3 else '',
         'preview_url': item[4] if len(item) > 4 else '', # Новое поле
-        'created_at': item[5] if len(item) > 5 else None # Обновлен индекс
+        'created_at': item[5] if len(item) > 5 else None, # Обновлен индекс
+        'hls_url': item[6] if len(item) > 6 else None # HLS-плейлист (если видео уже упаковано)
     }
     return render_template('trailer_detail.html', item=item_dict, reactions=reactions, comments=comments)
 @app.route('/news/<int:item_id>')
@@ -755,11 +1032,7 @@ def news_detail(item_id):
     if not item:
         logger.warning(f"Новость с id={item_id} не найдена")
         abort(404)
-    reactions_cache_key = f"reactions_news_{item_id}"
-    reactions = cache_get(reactions_cache_key)
-    if reactions is None:
-        reactions = get_reactions_count('news', item_id)
-        cache_set(reactions_cache_key, reactions, expire=CACHE_CONFIG['data_expire'])
+    reactions = get_item_reactions('news', item_id)
     comments_cache_key = f"comments_news_{item_id}"
     comments = cache_get(comments_cache_key)
     if comments is None:
@@ -774,6 +1047,89 @@ def news_detail(item_id):
         'created_at': item[4] if len(item) > 4 else None
     }
     return render_template('news_detail.html', item=item_dict, reactions=reactions, comments=comments)
+# --- НОВОЕ: Компактный JSON для вкладок и карточек (их рисует main.js, HTML-маршруты остаются запасными) ---
+# Ключи: i — id, t — заголовок, x — текст, p — превью/картинка, s — есть копии /img, v — видео,
+# h — HLS-плейлист, c — создано (unix), r — реакции в порядке REACTIONS, n — число комментариев
+JSON_CARD_MEDIA = {'moments': ('moment-preview', 'moment'), 'trailers': ('trailer-preview', 'trailer'),
+                   'news': ('news-image', None)}
+JSON_LIST_LOADERS = {'moments': get_all_moments, 'trailers': get_all_trailers, 'news': get_all_news}
+def _unix_time(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return int(value.timestamp()) if isinstance(value, datetime) else None
+def _compact_card(item_type_plural, row, detail=False):
+    """Карточка без счётчиков: они меняются часто и добавляются при каждом ответе"""
+    image_type, video_type = JSON_CARD_MEDIA[item_type_plural]
+    is_news = item_type_plural == 'news'
+    image = row[3] if is_news else (row[4] if len(row) > 4 else None)
+    created = row[4] if is_news else (row[5] if len(row) > 5 else None)
+    card = {'i': row[0], 't': row[1] or ''}
+    if (is_news or detail) and row[2]:
+        card['x'] = row[2]
+    if image:
+        card['p'] = media_url(image_type, row[0], image)
+        if image_srcset(image_type, row[0], image):
+            card['s'] = 1
+    if created:
+        card['c'] = _unix_time(created)
+    if detail and video_type:
+        card['v'] = media_url(video_type, row[0], row[3])
+        if len(row) > 6 and row[6]:
+            card['h'] = row[6]
+    return card
+def get_list_cards(item_type_plural):
+    cache_key = f"api_items_{item_type_plural}"
+    cards = cache_get(cache_key)
+    if cards is None:
+        cards = [_compact_card(item_type_plural, row) for row in JSON_LIST_LOADERS[item_type_plural]() or []]
+        cache_set(cache_key, cards, expire=CACHE_CONFIG['data_expire'])
+    return cards
+def _with_counts(item_type_plural, cards):
+    extra = build_extra_map([(card['i'],) for card in cards], item_type_plural)
+    result = []
+    for card in cards:
+        info = extra.get(card['i'], {})
+        reactions = info.get('reactions') or {}
+        result.append(dict(card, r=[reactions.get(r, 0) for r in REACTIONS], n=info.get('comments_count', 0)))
+    return result
+def compact_json(payload):
+    """JSON без пробелов с ETag: повторный запрос без изменений получает 304"""
+    resp = Response(json.dumps(payload, ensure_ascii=False, separators=(',', ':')), mimetype='application/json')
+    resp.set_etag(content_etag(resp.get_data()))
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
+@app.route('/api/v1/<item_type>')
+def api_list_cards(item_type):
+    item_type_plural = REACTION_ITEM_TYPES.get(item_type)
+    if not item_type_plural:
+        abort(404)
+    payload = {
+        'k': item_type_plural,
+        'w': list(images.IMAGE_WIDTHS),
+        'f': [fmt for fmt in ('avif', 'webp') if fmt in images.supported_formats()],
+        'items': _with_counts(item_type_plural, get_list_cards(item_type_plural)),
+    }
+    if 'admin' in session:
+        payload['a'] = 1  # Админу нужны кнопки и формы из HTML-версии вкладки
+    return compact_json(payload)
+@app.route('/api/v1/<item_type>/<int:item_id>')
+def api_card_detail(item_type, item_id):
+    item_type_plural = REACTION_ITEM_TYPES.get(item_type)
+    item = get_cached_item(item_type_plural, item_id) if item_type_plural else None
+    if not item:
+        abort(404)
+    card = _compact_card(item_type_plural, item, detail=True)
+    return compact_json(_with_counts(item_type_plural, [card])[0])
+def drop_list_caches(item_type_plural, item_id=None):
+    """Сбрасывает кэши списка (HTML и JSON) после добавления или удаления элемента"""
+    cache_delete(f"etag_cache_{item_type_plural}_page")
+    cache_delete(f"api_items_{item_type_plural}")
+    if item_id is not None:
+        cache_delete(f"item_{item_type_plural}_{item_id}")
+# --- КОНЕЦ НОВОГО ---
 # --- ИЗМЕНЕННЫЕ: API-эндпоинты с кэшированием ---
 @app.route('/api/comments', methods=['GET'])
 def api_get_comments():
@@ -795,34 +1151,274 @@ def api_get_comments():
     except Exception as e:
         logger.error(f"API get_comments error: {e}", exc_info=True)
         return jsonify(comments=[], error=str(e)), 500
+# --- НОВОЕ: Комментарии с сортировкой и keyset-пагинацией ---
+COMMENTS_MAX_LIMIT = 50
+COMMENTS_FIRST_PAGE = COMMENTS_MAX_LIMIT  # Столько кэшируем для первой страницы каждой сортировки
+COMMENT_SORT_ALIASES = {'new': 'new', 'latest': 'new', 'popular': 'popular'}
+def _serialize_comment(row):
+    row = dict(row)
+    for key in ('created_at', 'sort_key'):
+        if isinstance(row.get(key), datetime):
+            row[key] = row[key].isoformat()
+    return row
+def encode_comment_cursor(row):
+    raw = json.dumps([row['sort_key'], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+def decode_comment_cursor(cursor, sort):
+    """(ключ, id) из курсора; ValueError, если курсор испорчен или от другой сортировки"""
+    try:
+        key, comment_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('bad cursor')
+    expected = str if sort == 'new' else int
+    if not isinstance(key, expected) or not isinstance(comment_id, int):
+        raise ValueError('bad cursor')
+    return key, comment_id
+def get_comments_first_page(item_type_plural, item_id, sort):
+    """Первая страница (на одну строку больше, чтобы знать, есть ли продолжение) из кэша"""
+    cache_key = f"comments_first_{item_type_plural}_{item_id}_{sort}"
+    rows = cache_get(cache_key)
+    if rows is None:
+        rows = [_serialize_comment(r) for r in get_comments_page(item_type_plural, item_id, sort, COMMENTS_FIRST_PAGE + 1)]
+        cache_set(cache_key, rows, expire=CACHE_CONFIG['comments_expire'])
+    return rows
+def invalidate_comment_pages(item_type_plural, item_id):
+    for sort in ('new', 'popular'):
+        cache_delete(f"comments_first_{item_type_plural}_{item_id}_{sort}")
+@app.route('/api/comments/<item_type>/<int:item_id>', methods=['GET'])
+def api_comments_page(item_type, item_id):
+    """?sort=new|popular (latest — синоним new), limit, cursor из next_cursor предыдущего ответа"""
+    item_type_plural = REACTION_ITEM_TYPES.get(item_type)
+    sort = COMMENT_SORT_ALIASES.get(request.args.get('sort', 'new'))
+    if not item_type_plural or not sort:
+        return jsonify(comments=[], error="Неверный тип контента или сортировка"), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), COMMENTS_MAX_LIMIT))
+        cursor = request.args.get('cursor')
+        after = decode_comment_cursor(cursor, sort) if cursor else None
+    except ValueError:
+        return jsonify(comments=[], error="Неверный limit или cursor"), 400
+    try:
+        if after is None:
+            rows = get_comments_first_page(item_type_plural, item_id, sort)[:limit + 1]
+        else:
+            rows = [_serialize_comment(r) for r in get_comments_page(item_type_plural, item_id, sort, limit + 1, after)]
+        next_cursor = encode_comment_cursor(rows[limit - 1]) if len(rows) > limit else None
+        comments = [{k: v for k, v in row.items() if k != 'sort_key'} for row in rows[:limit]]
+        return jsonify(comments=comments, next_cursor=next_cursor)
+    except Exception as e:
+        logger.error(f"API comments page error: {e}", exc_info=True)
+        return jsonify(comments=[], error=str(e)), 500
+# --- КОНЕЦ НОВОГО ---
 # Добавим GET для получения реакций по типу и ID
 @app.route('/api/reactions/<item_type>/<int:item_id>', methods=['GET'])
 def api_get_reactions(item_type, item_id):
     try:
-        cache_key = f"api_reactions_{item_type}_{item_id}"
-        # Проверяем кэш
-        cached_reactions = cache_get(cache_key)
-        if cached_reactions is not None:
-            logger.debug(f"Реакции для {item_type}/{item_id} получены из кэша")
-            return jsonify(reactions=cached_reactions)
-        # Если нет в кэше, получаем из БД
-        reactions = get_reactions_count(item_type, item_id)
-        # Сохраняем в кэш
-        cache_set(cache_key, reactions, expire=CACHE_CONFIG['api_expire'])
-        logger.debug(f"Реакции для {item_type}/{item_id} получены из БД и закэшированы")
-        return jsonify(reactions=reactions)
+        item_type_plural = REACTION_ITEM_TYPES.get(item_type)
+        if not item_type_plural:
+            return jsonify(reactions={}, error="Неизвестный тип контента"), 400
+        return jsonify(reactions=get_item_reactions(item_type_plural, item_id))
     except Exception as e:
         logger.error(f"API get_reactions error: {e}", exc_info=True)
         return jsonify(reactions={}, error=str(e)), 500
-# --- ИЗМЕНЕННЫЙ: Маршрут для отдачи статических файлов с кэшированием ---
+# --- ИЗМЕНЕННЫЙ: Загрузки: Range, 304, отдача через прокси (X-Accel-Redirect) или os.sendfile ---
 @app.route('/uploads/<filename>')
-@cache_control(CACHE_CONFIG['static_expire']) # Кэшируем загруженные файлы надолго
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if secure_filename(filename) != filename:
+        abort(404)
+    return file_serving.serve_file(app.config['UPLOAD_FOLDER'], filename, max_age=CACHE_CONFIG['static_expire'])
+# --- НОВОЕ: HLS-плейлисты и сегменты ---
+# Каталог пакета зависит от исходного видео, поэтому содержимое по одному URL никогда не меняется
+HLS_MIMETYPES = {'.m3u8': 'application/vnd.apple.mpegurl', '.ts': 'video/mp2t'}
+@app.route('/hls/<path:filename>')
+@cache_control(CACHE_CONFIG['hls_expire'], immutable=True)
+def hls_file(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in HLS_MIMETYPES:
+        abort(404)
+    resp = send_from_directory(hls.HLS_FOLDER, filename, mimetype=HLS_MIMETYPES[ext])
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+# --- КОНЕЦ НОВОГО ---
+# --- НОВОЕ: Прокси для файлов Telegram (Range, LRU-кэш на диске, без токена бота у клиента) ---
+# тип в URL -> (таблица, индекс колонки с ссылкой)
+MEDIA_SOURCES = {
+    'moment': ('moments', 3),
+    'trailer': ('trailers', 3),
+    'moment-preview': ('moments', 4),
+    'trailer-preview': ('trailers', 4),
+    'news-image': ('news', 3),
+}
+def media_url(media_type, item_id, url):
+    """URL для шаблонов: файлы Telegram отдаём через /media, остальные ссылки как есть"""
+    if media_proxy.telegram_file_path(url):
+        return url_for('media_file', media_type=media_type, item_id=item_id)
+    return url
+app.jinja_env.globals['media_url'] = media_url
+def _media_source_url(media_type, item_id):
+    """Исходная ссылка на файл элемента (из кэша или БД)"""
+    table, column = MEDIA_SOURCES[media_type]
+    item = get_cached_item(table, item_id)
+    return item[column] if item and len(item) > column else None
+@app.route('/media/<media_type>/<int:item_id>')
+def media_file(media_type, item_id):
+    """Отдаёт файл Telegram элемента с поддержкой Range-запросов"""
+    if media_type not in MEDIA_SOURCES:
+        abort(404)
+    source_url = _media_source_url(media_type, item_id)
+    if not source_url:
+        abort(404)
+    file_path = media_proxy.telegram_file_path(source_url)
+    if not file_path:
+        # Локальные загрузки и внешние ссылки проксировать не нужно
+        return redirect(source_url)
+    if not TOKEN:
+        abort(503)
+    key = media_proxy.cache_key(file_path)
+    mimetype = media_proxy.guess_mimetype(file_path)
+    max_age = CACHE_CONFIG['video_url_cache_time']
+    # 1. Горячий файл уже на диске: send_file сам обработает Range/ETag и отдаст через sendfile
+    cached = media_proxy.cached_path(key)
+    if cached:
+        resp = send_file(cached, mimetype=mimetype, conditional=True, max_age=max_age)
+        resp.headers['Accept-Ranges'] = 'bytes'
+        return resp
+    # 2. Файла нет: одна загрузка из Telegram на всех, отдаём по мере скачивания
+    fill = media_proxy.get_fill(key, media_proxy.upstream_url(file_path, TOKEN))
+    if not fill.wait_started():
+        logger.error(f"[MEDIA] Не удалось получить {media_type}/{item_id} из Telegram: {fill.error}")
+        abort(502)
+    if fill.total is None:
+        # Telegram не прислал размер: дожидаемся загрузки целиком
+        if not fill.wait_done():
+            abort(502)
+        return send_file(fill.final_path, mimetype=mimetype, conditional=True, max_age=max_age)
+    total = fill.total
+    start, stop = 0, total
+    status = 200
+    if request.range and request.range.units == 'bytes':
+        byte_range = request.range.range_for_length(total)
+        if byte_range is None:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = f"bytes */{total}"
+            return resp
+        start, stop = byte_range
+        status = 206
+    resp = Response(fill.stream(start, stop), status=status, mimetype=mimetype, direct_passthrough=True)
+    resp.headers['Content-Length'] = str(stop - start)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    if status == 206:
+        resp.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{total}"
+    return resp
+# --- КОНЕЦ НОВОГО ---
+# --- НОВОЕ: Уменьшенные копии превью и картинок новостей (srcset) ---
+IMAGE_SOURCES = ('moment-preview', 'trailer-preview', 'news-image')
+def _original_image_path(source_url):
+    """Путь к оригиналу на диске: загрузка или файл Telegram из кэша /media"""
+    if source_url.startswith('/uploads/'):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(source_url))
+        return path if os.path.exists(path) else None
+    file_path = media_proxy.telegram_file_path(source_url)
+    if not file_path or not TOKEN:
+        return None
+    key = media_proxy.cache_key(file_path)
+    cached = media_proxy.cached_path(key)
+    if cached:
+        return cached
+    fill = media_proxy.get_fill(key, media_proxy.upstream_url(file_path, TOKEN))
+    return fill.final_path if fill.wait_done() else None
+def image_srcset(media_type, item_id, url, fmt='webp'):
+    """Значение srcset для шаблонов или '' если для ссылки копии не делаются"""
+    if not url or fmt not in images.supported_formats():
+        return ''
+    if not (url.startswith('/uploads/') or media_proxy.telegram_file_path(url)):
+        return ''
+    return ', '.join(
+        f"{url_for('image_variant', media_type=media_type, item_id=item_id, width=width, fmt=fmt)} {width}w"
+        for width in images.IMAGE_WIDTHS
+    )
+app.jinja_env.globals['image_srcset'] = image_srcset
+# --- НОВОЕ: Кэш HTML отдельных карточек списков ---
+# Ключ — (тип, id, версия), версия — хэш полей, которые выводит карточка. Изменение одного
+# элемента (реакция, комментарий, новое превью) меняет только его версию: перерисовывается
+# одна карточка, остальные берутся из кэша процесса. Старые версии вытесняет LRU.
+CARD_TEMPLATES = {'moments': 'cards/moment.html', 'trailers': 'cards/trailer.html', 'news': 'cards/news.html'}
+CARD_FIELDS = {
+    'moments': ('id', 'title', 'preview_url'),
+    'trailers': ('id', 'title', 'preview_url'),
+    'news': ('id', 'title', 'text', 'image_url', 'reactions', 'comments_count'),
+}
+CARD_CACHE_SIZE = int(os.environ.get('CARD_CACHE_SIZE', 5000))
+card_fragments = LRUCache(maxsize=CARD_CACHE_SIZE)
+card_fragments_lock = threading.Lock()
+def card_version(item_type_plural, item):
+    fields = [item.get(name) for name in CARD_FIELDS[item_type_plural]]
+    return hashlib.md5(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+def render_card(item_type_plural, item):
+    key = (item_type_plural, item['id'], card_version(item_type_plural, item))
+    with card_fragments_lock:
+        html = card_fragments.get(key)
+    metrics.record_cache('card', hits=int(html is not None), misses=int(html is None))
+    if html is None:
+        html = Markup(app.jinja_env.get_template(CARD_TEMPLATES[item_type_plural]).render(item=item))
+        with card_fragments_lock:
+            card_fragments[key] = html
+    return html
+app.jinja_env.globals['render_card'] = render_card
+@app.route('/img/<media_type>/<int:item_id>/<int:width>.<fmt>')
+def image_variant(media_type, item_id, width, fmt):
+    """Копия изображения заданной ширины; создаётся при первом запросе"""
+    if media_type not in IMAGE_SOURCES or not images.is_supported(fmt, width):
+        abort(404)
+    source_url = _media_source_url(media_type, item_id)
+    if not source_url:
+        abort(404)
+    source_id = media_proxy.telegram_file_path(source_url) or source_url
+    path = images.variant_path(source_id, width, fmt)
+    if not os.path.exists(path):
+        # Копию мог уже сделать другой инстанс: берём её из Redis
+        redis_key = f"img_{os.path.basename(path)}"
+        cached = cache_get(redis_key)
+        if cached:
+            images.store_variant(path, base64.b64decode(cached))
+        else:
+            try:
+                path = images.get_variant(source_id, lambda: _original_image_path(source_url), width, fmt)
+            except Exception as e:
+                logger.error(f"[IMG] Ошибка создания копии {media_type}/{item_id}/{width}.{fmt}: {e}")
+                path = None
+            if not path:
+                abort(404)
+            with open(path, 'rb') as f:
+                cache_set(redis_key, base64.b64encode(f.read()).decode('ascii'), expire=CACHE_CONFIG['image_expire'])
+    return send_file(path, mimetype=images.IMAGE_MIMETYPES[fmt], conditional=True,
+                     max_age=CACHE_CONFIG['image_expire'])
+# --- КОНЕЦ НОВОГО ---
+# --- НОВОЕ: Собранная статика (static_assets.py): хэш в имени, заранее сжатые копии ---
+static_manifest = AssetManifest(STATIC_DIR)
+def asset_url(path):
+    """URL файла статики: собранная версия с хэшем, если статика собрана, иначе исходный файл"""
+    return url_for('static_files', filename=static_manifest.resolve(path))
+app.jinja_env.globals['asset_url'] = asset_url
 @app.route('/static/<path:filename>')
-@cache_control(CACHE_CONFIG['static_expire']) # Кэшируем статические файлы (CSS, JS, изображения из static) надолго
 def static_files(filename):
-    return send_from_directory('static', filename)
+    if not static_manifest.is_hashed(filename):
+        # Исходные файлы (статика не собрана или ссылка без asset_url)
+        resp = send_from_directory(STATIC_DIR, filename)
+        resp.headers['Cache-Control'] = f"public, max-age={CACHE_CONFIG['static_expire']}"
+        return resp
+    # Содержимое по этому URL не меняется: отдаём .br/.gz, если клиент их принимает
+    path, encoding = static_manifest.precompressed(filename, request.accept_encodings)
+    # Путь взят из манифеста, а не из запроса, поэтому send_file без safe_join
+    resp = send_file(os.path.join(STATIC_DIR, path), mimetype=mimetypes.guess_type(filename)[0], conditional=True)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+        del resp.headers['Content-Disposition']  # иначе в имени файла .br/.gz
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = f"public, max-age={CACHE_CONFIG['static_hashed_expire']}, immutable"
+    return resp
+# --- КОНЕЦ НОВОГО ---
 # --- Маршрут для Webhook от Telegram ---
 @app.route('/<string:token>', methods=['POST'])
 def telegram_webhook(token):
@@ -832,9 +1428,21 @@ def telegram_webhook(token):
     try:
         json_string = request.get_data().decode('utf-8')
         logger.debug(f"Получено обновление webhook: {json_string[:200]}...")
-        update = Update.de_json(json.loads(json_string), updater.bot)
-        updater.dispatcher.process_update(update)
-        logger.info("Обновление из webhook обработано")
+        data = json.loads(json_string)
+        update_id = data.get('update_id')
+        # --- НОВОЕ: Повторная доставка того же update_id (Telegram не дождался ответа) ---
+        if update_id is not None and not update_dedup.first_seen(update_id):
+            logger.info(f"Повторное обновление {update_id} пропущено")
+            return jsonify({'status': 'duplicate'}), 200
+        update = Update.de_json(data, updater.bot)
+        # --- НОВОЕ: Обработка в пуле потоков, Telegram получает ответ сразу ---
+        if not update_pool.submit(update):
+            # Очередь переполнена: пусть Telegram доставит обновление позже
+            if update_id is not None:
+                update_dedup.forget(update_id)
+            logger.warning(f"Очередь обновлений переполнена, {update_id} отклонено")
+            return jsonify({'error': 'Busy'}), 503
+        logger.info(f"Обновление {update_id} поставлено в очередь")
         return jsonify({'status': 'ok'}), 200
     except Exception as e:
         logger.error(f"Ошибка обработки webhook обновления: {e}", exc_info=True)
@@ -845,7 +1453,7 @@ def webhook_info():
     if not TOKEN:
         return jsonify({'error': 'TELEGRAM_TOKEN not set'}), 500
     try:
-        bot = Bot(token=TOKEN)
+        bot = telegram_bot()
         info = bot.get_webhook_info()
         return jsonify(info.to_dict())
     except Exception as e:
@@ -862,8 +1470,40 @@ def _get_payload():
         # но для наших форм подходит.
         # Для файлов request.files будет содержать их.
         return request.form.to_dict()
+# --- НОВОЕ: Проверка прав по access_settings ---
+def current_user_role():
+    """
+    Роль текущего пользователя: вошедший в админку считается владельцем,
+    пользователь WebApp определяется по подписанному initData (заголовок X-Telegram-Init-Data).
+    """
+    if 'admin' in session:
+        return 'owner'
+    return access_control.role_for(current_tg_user_id())
+def current_tg_user_id():
+    """Telegram ID пользователя WebApp из подписанного initData (запоминается в сессии)"""
+    init_data = request.headers.get('X-Telegram-Init-Data')
+    if init_data:
+        user = access_control.user_from_init_data(init_data, TOKEN)
+        if user and session.get('tg_user_id') != str(user['id']):
+            session['tg_user_id'] = str(user['id'])
+    return session.get('tg_user_id')
+def current_viewer_id(fallback=None):
+    """Кто реагирует: проверенный пользователь Telegram, иначе ID, присланный клиентом"""
+    return current_tg_user_id() or str(fallback or 'anonymous')
+def content_access_required(content_type):
+    """Пропускает запрос, только если роль пользователя разрешена для content_type"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not access_control.is_allowed(current_user_role(), content_type):
+                return jsonify(success=False, error="Недостаточно прав"), 403
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+# --- КОНЕЦ НОВОГО ---
 # --- ИЗМЕНЕННЫЕ: Маршруты API добавления контента с инвалидацией кэша ---
 @app.route('/api/add_moment', methods=['POST'])
+@content_access_required('moment')
 def api_add_moment():
     try:
         payload = _get_payload()
@@ -886,7 +1526,8 @@ def api_add_moment():
         if not video_url:
             logger.error("Не указан video_url, не извлечен из поста и не загружен файл")
             return jsonify(success=False, error="Укажите ссылку на видео, пост Telegram или загрузите файл"), 400
-        add_moment(title, desc, video_url)
+        item_id = add_moment(title, desc, video_url)
+        schedule_hls_packaging('moments', item_id, video_url)
         # --- ИНВАЛИДАЦИЯ КЭША ---
         cache_delete('moments_list')
         cache_delete('moments_page')  # Удаляем кэш страницы
@@ -897,6 +1538,7 @@ def api_add_moment():
         logger.error(f"API add_moment error: {e}", exc_info=True)
         return jsonify(success=False, error=str(e)), 500
 @app.route('/api/add_trailer', methods=['POST'])
+@content_access_required('trailer')
 def api_add_trailer():
     try:
         payload = _get_payload()
@@ -919,7 +1561,8 @@ def api_add_trailer():
         if not video_url:
             logger.error("Не указан video_url, не извлечен из поста и не загружен файл")
             return jsonify(success=False, error="Укажите ссылку на видео, пост Telegram или загрузите файл"), 400
-        add_trailer(title, desc, video_url)
+        item_id = add_trailer(title, desc, video_url)
+        schedule_hls_packaging('trailers', item_id, video_url)
         # --- ИНВАЛИДАЦИЯ КЭША ---
         cache_delete('trailers_list')
         cache_delete('trailers_page')  # Удаляем кэш страницы
@@ -930,6 +1573,7 @@ def api_add_trailer():
         logger.error(f"API add_trailer error: {e}", exc_info=True)
         return jsonify(success=False, error=str(e)), 500
 @app.route('/api/add_news', methods=['POST'])
+@content_access_required('news')
 def api_add_news():
     try:
         payload = _get_payload()
@@ -950,25 +1594,95 @@ def api_add_news():
     except Exception as e:
         logger.error(f"API add_news error: {e}", exc_info=True)
         return jsonify(success=False, error=str(e)), 500
-# --- ИЗМЕНЕННЫЙ: Маршрут API добавления комментария с инвалидацией кэша ---
+# --- ИЗМЕНЕННЫЙ: Комментарии пишутся пачками (comment_writer.py), кэши обновляются на месте ---
+COMMENT_MAX_LENGTH = 2000
+COMMENT_NAME_MAX_LENGTH = 64
+COMMENT_RATE_PER_MINUTE = float(os.environ.get('COMMENT_RATE_PER_MINUTE', 6))
+COMMENT_BURST = int(os.environ.get('COMMENT_BURST', 3))
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))  # Сколько обратных прокси перед приложением
+comment_limiter = TokenBucket(redis_client, 'comment', COMMENT_RATE_PER_MINUTE / 60, COMMENT_BURST)
+# Увеличивает счётчик, только если он уже в кэше (иначе его посчитает БД при следующем чтении)
+_incr_if_exists = redis_client.register_script(
+    "if redis.call('exists', KEYS[1]) == 1 then return redis.call('incrby', KEYS[1], ARGV[1]) end return 0"
+) if redis_client else None
+def client_ip():
+    """IP клиента: за прокси берём адрес, дописанный самим прокси (справа в X-Forwarded-For)"""
+    forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+    if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+        return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr or 'unknown'
+def _merge_first_page(cached, new_rows):
+    """Вставляет новые комментарии в закэшированную первую страницу с сохранением порядка"""
+    merged = sorted(cached + new_rows, key=lambda r: (r['sort_key'], r['id']), reverse=True)
+    return merged[:COMMENTS_FIRST_PAGE + 1]
+def on_comments_saved(rows):
+    """Вызывается сборщиком после записи пачки: дописываем комментарии в кэши вместо их удаления"""
+    by_item = {}
+    for row in rows:
+        by_item.setdefault((row['item_type'], row['item_id']), []).append(row)
+    for (item_type, item_id), group in by_item.items():
+        for sort in ('new', 'popular'):
+            cache_key = f"comments_first_{item_type}_{item_id}_{sort}"
+            cached = cache_get(cache_key)
+            if cached is None:
+                continue
+            new_rows = [_serialize_comment(dict(r, sort_key=r['created_at'] if sort == 'new' else r['likes'] - r['dislikes']))
+                        for r in group]
+            new_rows = [{k: v for k, v in r.items() if k not in ('request_id', 'item_type', 'item_id')} for r in new_rows]
+            cache_set(cache_key, _merge_first_page(cached, new_rows), expire=CACHE_CONFIG['comments_expire'])
+        # Старый формат (кортежи get_comments) для /api/comments и детальных страниц
+        legacy = [[r['user_name'], r['text'], r['created_at'].isoformat(), r['likes'], r['dislikes'], r['id']]
+                  for r in sorted(group, key=lambda r: r['id'], reverse=True)]
+        for cache_key in (f"api_comments_{item_type}_{item_id}", f"comments_{item_type}_{item_id}"):
+            cached = cache_get(cache_key)
+            if cached is not None:
+                cache_set(cache_key, (legacy + cached)[:50], expire=CACHE_CONFIG['data_expire'])
+        comments_count = None
+        if _incr_if_exists:
+            comments_count = _incr_if_exists(keys=[f"comments_count_{item_type}_{item_id}"], args=[len(group)]) or None
+        live_events.publish(COMMENT_ADDED, item_type=item_type, item_id=item_id, added=len(group), comments_count=comments_count)
+    # Число комментариев выводится в готовом HTML списка — его пересобираем один раз на пачку
+    for item_type in {item_type for item_type, _ in by_item}:
+        cache_delete(f"etag_cache_{item_type}_page")
+comment_writer = CommentWriter(redis_client, add_comments_bulk, on_comments_saved, ROW_ERRORS) if redis_client else None
 @app.route('/api/comment', methods=['POST'])
 def api_add_comment():
     try:
         data = request.get_json(force=True)
-        item_type = data.get('item_type')
+        item_type = REACTION_ITEM_TYPES.get(data.get('item_type'))
         item_id = int(data.get('item_id'))
-        user_name = data.get('user_name', 'Гость')
-        text = data.get('text')
+        user_name = (data.get('user_name') or '').strip()[:COMMENT_NAME_MAX_LENGTH] or 'Гость'
+        text = (data.get('text') or '').strip()
+        if not item_type or not text:
+            return jsonify(success=False, error="Пустой комментарий или неизвестный тип контента"), 400
+        if not valid_item_id(item_id):
+            return jsonify(success=False, error="Неверный item_id"), 400
+        if has_nul(text, user_name):
+            return jsonify(success=False, error="Недопустимые символы в комментарии"), 400
+        if len(text) > COMMENT_MAX_LENGTH:
+            return jsonify(success=False, error=f"Комментарий длиннее {COMMENT_MAX_LENGTH} символов"), 400
+        tg_user_id = current_tg_user_id()
+        allowed, retry_after = comment_limiter.consume(f"user:{tg_user_id}" if tg_user_id else f"ip:{client_ip()}")
+        if not allowed:
+            response = jsonify(success=False, error=f"Слишком часто. Попробуйте через {retry_after} с", retry_after=retry_after)
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        if comment_writer:
+            try:
+                comment_writer.submit(item_type, item_id, user_name, text)
+                return jsonify(success=True, pending=True), 202
+            except Exception as e:
+                logger.warning(f"Очередь комментариев недоступна, пишем сразу в БД: {e}")
         add_comment(item_type, item_id, user_name, text)
-        # --- ИНВАЛИДАЦИЯ КЭША ---
-        # Удаляем кэш для комментариев этого элемента
+        invalidate_comment_pages(item_type, item_id)
         cache_delete(f"api_comments_{item_type}_{item_id}")
-        cache_delete(f"comments_{item_type}_{item_id}") # Кэш для страницы деталей
-        # Также может потребоваться обновить счетчик комментариев в build_extra_map
-        # Проще всего сбросить кэш страницы списка
-        cache_delete(f"{item_type}s_page")
-        # --- КОНЕЦ ИНВАЛИДАЦИИ ---
+        cache_delete(f"comments_{item_type}_{item_id}")
+        cache_delete(f"comments_count_{item_type}_{item_id}")
+        cache_delete(f"etag_cache_{item_type}_page")
+        live_events.publish(COMMENT_ADDED, item_type=item_type, item_id=item_id, added=1, comments_count=None)
         return jsonify(success=True)
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Неверный item_id"), 400
     except Exception as e:
         logger.error(f"API add_comment error: {e}", exc_info=True)
         return jsonify(success=False, error=str(e)), 500
@@ -988,23 +1702,76 @@ def api_get_reaction():
 def api_add_reaction_post():
     try:
         data = request.get_json(force=True)
-        item_type = data.get('item_type')
+        item_type = REACTION_ITEM_TYPES.get(data.get('item_type'))
         item_id = int(data.get('item_id'))
-        user_id = data.get('user_id', 'anonymous')
+        user_id = str(data.get('user_id', 'anonymous'))
         reaction = data.get('reaction')
+        if not item_type or reaction not in REACTIONS:
+            return jsonify(success=False, error="Неверный тип контента или реакция"), 400
+        if not valid_item_id(item_id) or not user_id or len(user_id) > REACTION_USER_ID_MAX_LENGTH or has_nul(user_id):
+            return jsonify(success=False, error="Неверный item_id или user_id"), 400
+        if reaction_store:
+            # Нажатие учитывается в Redis сразу, в БД реакции попадут пачкой из фонового потока
+            try:
+                added = reaction_store.record(item_type, item_id, user_id, reaction)
+                reactions = reaction_store.counts(item_type, item_id)
+                if added:
+                    live_events.publish(REACTIONS_CHANGED, item_type=item_type, item_id=item_id, reactions=reactions)
+                return jsonify(success=True, added=added, reactions=reactions)
+            except Exception as e:
+                logger.warning(f"Redis недоступен для реакций, пишем сразу в БД: {e}")
         success = add_reaction(item_type, item_id, user_id, reaction)
         if success:
-            # --- ИНВАЛИДАЦИЯ КЭША ---
-            # Удаляем кэш для реакций этого элемента
-            cache_delete(f"api_reactions_{item_type}_{item_id}")
-            cache_delete(f"reactions_{item_type}_{item_id}") # Кэш для страницы деталей
-            # Сбрасываем кэш страницы списка
-            cache_delete(f"{item_type}s_page")
-            # --- КОНЕЦ ИНВАЛИДАЦИИ ---
-        return jsonify(success=success)
+            cache_delete(f"reactions_{item_type}_{item_id}")
+        reactions = get_item_reactions(item_type, item_id)
+        if success:
+            live_events.publish(REACTIONS_CHANGED, item_type=item_type, item_id=item_id, reactions=reactions)
+        return jsonify(success=success, reactions=reactions)
     except Exception as e:
         logger.error(f"API add_reaction error: {e}", exc_info=True)
         return jsonify(success=False, error=str(e)), 500
+# --- НОВОЕ: Реакции на комментарии ---
+COMMENT_REACTIONS_BATCH_LIMIT = 100
+@app.route('/api/comment_reaction', methods=['POST'])
+def api_toggle_comment_reaction():
+    try:
+        data = request.get_json(force=True)
+        comment_id = int(data.get('comment_id'))
+        reaction = data.get('reaction')
+        if reaction not in COMMENT_REACTIONS:
+            return jsonify(success=False, error="Неизвестная реакция"), 400
+        result = toggle_comment_reaction(comment_id, current_viewer_id(data.get('user_id')), reaction)
+        if result is None:
+            return jsonify(success=False, error="Комментарий не найден"), 404
+        # Счётчики лежат в кэше списка комментариев
+        cache_delete(f"api_comments_{result['item_type']}_{result['item_id']}")
+        cache_delete(f"comments_{result['item_type']}_{result['item_id']}")
+        invalidate_comment_pages(result['item_type'], result['item_id'])
+        return jsonify(success=True, added=result['added'], likes=result['likes'], dislikes=result['dislikes'])
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Неверный comment_id"), 400
+    except Exception as e:
+        logger.error(f"API comment_reaction error: {e}", exc_info=True)
+        return jsonify(success=False, error=str(e)), 500
+@app.route('/api/comment_reactions', methods=['GET'])
+def api_comment_reactions_batch():
+    """Счётчики и реакции зрителя для комментариев страницы: ?ids=1,2,3"""
+    try:
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+    except ValueError:
+        return jsonify(reactions={}, error="Неверный список ids"), 400
+    if len(ids) > COMMENT_REACTIONS_BATCH_LIMIT:
+        return jsonify(reactions={}, error=f"Не больше {COMMENT_REACTIONS_BATCH_LIMIT} комментариев за раз"), 400
+    try:
+        reactions = get_comment_reactions_batch(ids, current_viewer_id(request.args.get('user_id')))
+        response = jsonify(reactions={str(k): v for k, v in reactions.items()})
+        # Ответ зависит от пользователя: общим кэшам его хранить нельзя
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+    except Exception as e:
+        logger.error(f"API comment_reactions error: {e}", exc_info=True)
+        return jsonify(reactions={}, error=str(e)), 500
+# --- КОНЕЦ НОВОГО ---
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
@@ -1078,8 +1845,7 @@ def admin_add_content():
                         YOUR_TEST_CHAT_ID = -1003045387627 # <<<--- ВАШ ID тестовой группы
                         # 2. Создаем InputFile из объекта FileStorage Flask
                         # Это позволяет отправить файл напрямую из памяти без сохранения на диск
-                        from telegram import Bot
-                        bot = Bot(token=TOKEN)
+                        bot = telegram_bot()
                         # file.stream - это BytesIO объект
                         # Нужно убедиться, что указатель в начале
                         file.stream.seek(0)
@@ -1141,8 +1907,7 @@ def admin_add_content():
                 if preview_file and preview_file.filename != '':
                     try:
                         YOUR_TEST_CHAT_ID = -1003045387627 # <<<--- ВАШ ID тестовой группы
-                        from telegram import Bot
-                        bot = Bot(token=TOKEN)
+                        bot = telegram_bot()
                         preview_file.stream.seek(0)
                         input_file = InputFile(preview_file.stream, filename=preview_file.filename)
                         logger.info(f"[ADMIN FORM] Отправка превью '{preview_file.filename}' в Telegram (чат {YOUR_TEST_CHAT_ID})...")
@@ -1168,14 +1933,16 @@ def admin_add_content():
             # !!!Теперь content_url всегда содержит прямую ссылку на видео в Telegram!!!
             # !!!А preview_url_for_content содержит прямую ссылку на превью в Telegram!!!
             if content_type == 'moment':
-                add_moment(title, description, content_url, preview_url_for_content) # <-- Добавлен preview_url_for_content
+                item_id = add_moment(title, description, content_url, preview_url_for_content) # <-- Добавлен preview_url_for_content
+                schedule_hls_packaging('moments', item_id, content_url)
                 # --- ИНВАЛИДАЦИЯ КЭША ---
                 cache_delete('moments_list')
                 cache_delete('moments_page')  # Удаляем кэш страницы
                 # --- КОНЕЦ ИНВАЛИДАЦИИ ---
                 logger.info(f"[ADMIN FORM] Добавлен момент: {title}")
             elif content_type == 'trailer':
-                add_trailer(title, description, content_url, preview_url_for_content) # <-- Добавлен preview_url_for_content
+                item_id = add_trailer(title, description, content_url, preview_url_for_content) # <-- Добавлен preview_url_for_content
+                schedule_hls_packaging('trailers', item_id, content_url)
                 # --- ИНВАЛИДАЦИЯ КЭША ---
                 cache_delete('trailers_list')
                 cache_delete('trailers_page')  # Удаляем кэш страницы
@@ -1242,6 +2009,8 @@ def admin_delete(content_type, content_id):
         cache_delete('news_list')
         cache_delete('news_page')  # Удаляем кэш страницы
         # --- КОНЕЦ ИНВАЛИДАЦИИ ---
+    if content_type in REACTION_ITEM_TYPES:
+        drop_list_caches(REACTION_ITEM_TYPES[content_type], content_id)
     return redirect(url_for('admin_content'))
 @app.route('/admin/access')
 @admin_required
@@ -1256,7 +2025,28 @@ def admin_access_settings():
 def admin_update_access(content_type):
     roles = request.form.getlist('roles')
     update_access_settings(content_type, roles)
+    access_control.invalidate()
     return redirect(url_for('admin_access_settings'))
+@app.route('/admin/broadcasts')
+@admin_required
+def admin_broadcasts():
+    return render_template('admin/broadcasts.html', broadcasts=get_broadcasts(), enabled=BROADCAST_ENABLED)
+# --- НОВОЕ: Самые дорогие SQL-запросы (query_profiler.py, QUERY_PROFILER=1) ---
+QUERY_SORTS = {'total': 'total_ms', 'mean': 'mean_ms', 'max': 'max_ms', 'calls': 'calls', 'rows': 'rows'}
+@app.route('/admin/queries')
+@admin_required
+def admin_queries():
+    sort = request.args.get('sort', 'total')
+    if sort not in QUERY_SORTS:
+        sort = 'total'
+    return render_template('admin/queries.html', queries=query_profiler.top(QUERY_SORTS[sort]), sort=sort,
+                           enabled=query_profiler.enabled, slow_ms=SLOW_QUERY_MS)
+@app.route('/admin/queries/reset', methods=['POST'])
+@admin_required
+def admin_queries_reset():
+    query_profiler.reset()
+    return redirect(url_for('admin_queries'))
+# --- КОНЕЦ НОВОГО ---
 @app.route('/admin/add_video_json', methods=['POST'])
 @admin_required
 def admin_add_video_json():
@@ -1284,13 +2074,15 @@ def admin_add_video_json():
                 logger.error(f"[JSON API] Ошибка извлечения видео из поста: {error}")
                 return jsonify(success=False, error=error), 400
         if category == 'moment':
-            add_moment(title, description, video_url)
+            item_id = add_moment(title, description, video_url)
+            schedule_hls_packaging('moments', item_id, video_url)
             # --- ИНВАЛИДАЦИЯ КЭША ---
             cache_delete('moments_list')
             cache_delete('moments_page')  # Удаляем кэш страницы
             # --- КОНЕЦ ИНВАЛИДАЦИИ ---
         elif category == 'trailer':
-            add_trailer(title, description, video_url)
+            item_id = add_trailer(title, description, video_url)
+            schedule_hls_packaging('trailers', item_id, video_url)
             # --- ИНВАЛИДАЦИЯ КЭША ---
             cache_delete('trailers_list')
             cache_delete('trailers_page')  # Удаляем кэш страницы
@@ -1309,16 +2101,15 @@ def admin_add_video_json():
 def add_video_command(update, context):
     user = update.message.from_user
     telegram_id = str(user.id)
-    role = get_user_role(telegram_id)
-    if role not in ['owner', 'admin']:
-        update.message.reply_text("❌ You have no rights!")
-        return
     text = update.message.text.strip()
     parts = text.split(' ', 2)
     if len(parts) < 3 or parts[1].lower() not in ['moment', 'trailer', 'news']:
         update.message.reply_text("❌ Format: /add_video [moment|trailer|news] [title]")
         return
-    pending_video_data[telegram_id] = {'content_type': parts[1].lower(), 'title': parts[2]}
+    if not access_control.is_allowed(access_control.role_for(telegram_id), parts[1].lower()):
+        update.message.reply_text("❌ You have no rights!")
+        return
+    pending_video_data.set(telegram_id, {'content_type': parts[1].lower(), 'title': parts[2]})
     update.message.reply_text(
         f"🎬 Добавление '{parts[1]}' с названием '{parts[2]}'. "
         f"Пришли прямой URL видео (https://...) или отправь видео файлом."
@@ -1326,23 +2117,25 @@ def add_video_command(update, context):
 def handle_pending_video_text(update, context):
     user = update.message.from_user
     telegram_id = str(user.id)
-    if telegram_id not in pending_video_data:
-        return
     data = pending_video_data.pop(telegram_id)
+    if not data:
+        return
     content_type, title = data['content_type'], data['title']
     video_url = update.message.text.strip()
     if not (video_url.startswith('http://') or video_url.startswith('https://')):
         update.message.reply_text("❌ Это не URL. Пришли прямую ссылку на видео или отправь файл.")
-        pending_video_data[telegram_id] = data
+        pending_video_data.set(telegram_id, data)
         return
     if content_type == 'moment':
-        add_moment(title, "Added via Telegram", video_url)
+        item_id = add_moment(title, "Added via Telegram", video_url)
+        schedule_hls_packaging('moments', item_id, video_url)
         # --- ИНВАЛИДАЦИЯ КЭША ---
         cache_delete('moments_list')
         cache_delete('moments_page')
         # --- КОНЕЦ ИНВАЛИДАЦИИ ---
     elif content_type == 'trailer':
-        add_trailer(title, "Added via Telegram", video_url)
+        item_id = add_trailer(title, "Added via Telegram", video_url)
+        schedule_hls_packaging('trailers', item_id, video_url)
         # --- ИНВАЛИДАЦИЯ КЭША ---
         cache_delete('trailers_list')
         cache_delete('trailers_page')
@@ -1361,16 +2154,16 @@ def handle_pending_video_file(update, context):
     user = update.message.from_user
     telegram_id = str(user.id)
     logger.info(f"Получен видеофайл от пользователя {telegram_id}")
-    if telegram_id not in pending_video_data:
+    data = pending_video_data.pop(telegram_id)
+    if not data:
         logger.debug("Нет ожидающих данных для видео")
         return
-    data = pending_video_data.pop(telegram_id)
     content_type, title = data['content_type'], data['title']
     logger.info(f"Обработка {content_type} '{title}'")
     if not update.message.video:
         logger.warning("Полученное сообщение не содержит видео")
         update.message.reply_text("❌ Это не видео. Пришли файл видео или ссылку.")
-        pending_video_data[telegram_id] = data
+        pending_video_data.set(telegram_id, data)
         return
     file_id = update.message.video.file_id
     logger.info(f"Получен file_id: {file_id}")
@@ -1383,13 +2176,15 @@ def handle_pending_video_file(update, context):
     logger.info(f"Сгенерирована прямая ссылка: {video_url[:50]}...")
     try:
         if content_type == 'moment':
-            add_moment(title, "Added via Telegram", video_url)
+            item_id = add_moment(title, "Added via Telegram", video_url)
+            schedule_hls_packaging('moments', item_id, video_url)
             # --- ИНВАЛИДАЦИЯ КЭША ---
             cache_delete('moments_list')
             cache_delete('moments_page')
             # --- КОНЕЦ ИНВАЛИДАЦИИ ---
         elif content_type == 'trailer':
-            add_trailer(title, "Added via Telegram", video_url)
+            item_id = add_trailer(title, "Added via Telegram", video_url)
+            schedule_hls_packaging('trailers', item_id, video_url)
             # --- ИНВАЛИДАЦИЯ КЭША ---
             cache_delete('trailers_list')
             cache_delete('trailers_page')
@@ -1410,12 +2205,107 @@ def handle_pending_video_file(update, context):
         error_msg = f"❌ Ошибка сохранения в БД: {e}"
         logger.error(error_msg, exc_info=True)
         update.message.reply_text(error_msg)
+# --- НОВОЕ: Подписка на уведомления о новом контенте ---
+def _set_notifications(update, enabled):
+    user = update.message.from_user
+    register_user(user)
+    set_user_notifications(str(user.id), enabled)
+def subscribe_command(update, context):
+    try:
+        _set_notifications(update, True)
+        update.message.reply_text("🔔 Подписка оформлена! Пришлём уведомление о новых моментах, трейлерах и новостях.\n"
+                                  "Отписаться: /unsubscribe")
+    except Exception as e:
+        logger.error(f"Ошибка в /subscribe: {e}", exc_info=True)
+        update.message.reply_text("❌ Не удалось оформить подписку")
+def unsubscribe_command(update, context):
+    try:
+        _set_notifications(update, False)
+        update.message.reply_text("🔕 Уведомления отключены. Подписаться снова: /subscribe")
+    except Exception as e:
+        logger.error(f"Ошибка в /unsubscribe: {e}", exc_info=True)
+        update.message.reply_text("❌ Не удалось отключить уведомления")
+BROADCAST_HEADERS = {
+    'moments': '🎬 Новый момент из кино',
+    'trailers': '🎥 Новый трейлер',
+    'news': '📰 Свежая новость',
+}
+def send_broadcast_message(chat_id, broadcast):
+    """Отправляет одно уведомление рассылки с кнопкой открытия WebApp"""
+    app_url = f"{WEBHOOK_URL}/{broadcast['item_type']}/{broadcast['item_id']}"
+    keyboard = [[InlineKeyboardButton("▶ Смотреть", web_app=WebAppInfo(url=app_url))]]
+    header = BROADCAST_HEADERS.get(broadcast['item_type'], '✨ Новое в КиноВселенной')
+    updater.bot.send_message(
+        chat_id=chat_id,
+        text=f"{header}\n{broadcast['title']}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+# --- КОНЕЦ НОВОГО ---
+# --- НОВОЕ: Inline-режим (@bot <запрос>) для отправки моментов и трейлеров в любой чат ---
+INLINE_PAGE_SIZE = 20
+INLINE_TYPE_LABELS = {'moments': '🎬 Момент', 'trailers': '🎥 Трейлер'}
+def get_inline_search_results(query, offset):
+    """Результаты поиска для inline-запроса, кэшируются в Redis на inline_expire секунд"""
+    normalized = ' '.join(query.lower().split())[:64]
+    key = f"inline_{hashlib.md5(normalized.encode('utf-8')).hexdigest()}_{offset}"
+    results = cache_get(key)
+    if results is None:
+        rows = search_videos(normalized, limit=INLINE_PAGE_SIZE, offset=offset)
+        results = [{
+            'type': row['item_type'],
+            'id': row['id'],
+            'title': row['title'],
+            'description': (row['description'] or '')[:200],
+            'has_preview': bool(row['preview_url'])
+        } for row in rows]
+        cache_set(key, results, expire=CACHE_CONFIG['inline_expire'])
+    return results
+def inline_query(update, context):
+    query = update.inline_query
+    try:
+        offset = int(query.offset) if query.offset else 0
+    except ValueError:
+        offset = 0
+    try:
+        results = get_inline_search_results(query.query, offset)
+    except Exception as e:
+        logger.error(f"Ошибка inline-поиска: {e}", exc_info=True)
+        results = []
+    articles = []
+    for r in results:
+        item_url = f"{WEBHOOK_URL}/{r['type']}/{r['id']}"
+        label = INLINE_TYPE_LABELS.get(r['type'], '')
+        thumb_type = 'moment-preview' if r['type'] == 'moments' else 'trailer-preview'
+        articles.append(InlineQueryResultArticle(
+            id=f"{r['type']}_{r['id']}",
+            title=r['title'],
+            description=f"{label} · {r['description']}" if r['description'] else label,
+            input_message_content=InputTextMessageContent(f"{label}: {r['title']}\n{item_url}"),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("▶ Смотреть", url=item_url)]]),
+            thumb_url=f"{WEBHOOK_URL}/media/{thumb_type}/{r['id']}" if r['has_preview'] else None
+        ))
+    next_offset = str(offset + INLINE_PAGE_SIZE) if len(results) == INLINE_PAGE_SIZE else ''
+    try:
+        # cache_time: Telegram сам отвечает на повторные одинаковые запросы, не обращаясь к боту
+        query.answer(articles, cache_time=CACHE_CONFIG['inline_cache_time'], is_personal=False,
+                     next_offset=next_offset)
+    except Exception as e:
+        logger.error(f"Ошибка ответа на inline-запрос: {e}")
+# --- КОНЕЦ НОВОГО ---
 if dp:
     dp.add_handler(CommandHandler('start', start))
     dp.add_handler(CommandHandler('menu', menu_command))
+    dp.add_handler(CommandHandler('subscribe', subscribe_command))
+    dp.add_handler(CommandHandler('unsubscribe', unsubscribe_command))
+    dp.add_handler(InlineQueryHandler(inline_query))
     dp.add_handler(CommandHandler('add_video', add_video_command))
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_pending_video_text))
     dp.add_handler(MessageHandler(Filters.video & ~Filters.command, handle_pending_video_file))
+# --- НОВОЕ: Пул обработчиков обновлений из webhook ---
+update_pool = UpdateWorkerPool(dp.process_update) if dp else None
+update_dedup = UpdateDeduplicator(redis_client)
+# --- НОВОЕ: Фоновая рассылка о новом контенте (очередь в таблице broadcasts) ---
+broadcaster = Broadcaster(send_broadcast_message) if updater else None
 # --- Start Bot ---
 def start_bot():
     if updater:
@@ -1426,8 +2316,42 @@ def start_bot():
             logger.info("Menu Button успешно установлена.")
         except Exception as e:
             logger.error(f"Не удалось установить Menu Button при запуске: {e}")
+        if broadcaster and BROADCAST_ENABLED:
+            broadcaster.start()
         logger.info("Telegram бот готов принимать обновления через Webhook.")
+    # Сборщики очередей Redis -> БД запускаются в каждом воркере сразу, а не с первым запросом
+    if reaction_store:
+        reaction_store.start()
+    if comment_writer:
+        comment_writer.start()
 # --- Health Check Endpoint ---
+# --- НОВОЕ: Метрики Prometheus (metrics.py) ---
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # если задан, /metrics требует Authorization: Bearer <токен>
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(403)
+    body, content_type = app_metrics.render()
+    resp = Response(body, content_type=content_type)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+# --- КОНЕЦ НОВОГО ---
+# Проверка БД не чаще раза в HEALTH_DB_INTERVAL секунд: пробы балансировщика не открывают соединение каждый раз
+HEALTH_DB_INTERVAL = int(os.environ.get('HEALTH_DB_INTERVAL', 30))
+health_db_status = TTLCache(maxsize=1, ttl=HEALTH_DB_INTERVAL)
+health_db_lock = threading.Lock()
+def database_status():
+    with health_db_lock:
+        status = health_db_status.get('db')
+        if status is None:
+            try:
+                conn = get_db_connection()
+                conn.close()
+                status = "OK"
+            except Exception as e:
+                status = f"Connection error: {str(e)}"
+            health_db_status['db'] = status
+    return status
 @app.route('/health')
 def health_check():
     """Проверка состояния приложения"""
@@ -1441,24 +2365,17 @@ def health_check():
                 redis_status = f"Connection error: {str(e)}"
         # Проверяем Telegram бот
         bot_status = "OK" if TOKEN else "Not configured"
-        # Проверяем базу данных
-        db_status = "Unknown"
-        try:
-            from database import get_db_connection
-            conn = get_db_connection()
-            conn.close()
-            db_status = "OK"
-        except Exception as e:
-            db_status = f"Connection error: {str(e)}"
-        return jsonify({
+        resp = jsonify({
             'status': 'healthy',
             'services': {
                 'redis': redis_status,
                 'bot': bot_status,
-                'database': db_status
+                'database': database_status()
             },
             'timestamp': datetime.now().isoformat()
         })
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
     except Exception as e:
         logger.error(f"Health check error: {e}")
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
@@ -0,0 +1,146 @@
+# authorization.py
+# Проверка Telegram WebApp initData, роли пользователей и правила доступа (таблица access_settings).
+# Роли и правила кэшируются в процессе; изменение правил в админке увеличивает версию в Redis,
+# и все воркеры сбрасывают кэш. На горячем пути запросов к БД нет.
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import parse_qsl
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+INIT_DATA_MAX_AGE = int(os.environ.get('INIT_DATA_MAX_AGE', 86400))  # initData старше суток не принимаем
+ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL', 300))
+VERSION_CHECK_INTERVAL = 5   # Как часто (сек) сверять версию правил с Redis
+VERSION_KEY = 'access_rules_version'
+
+
+def validate_init_data(init_data, bot_token, max_age=INIT_DATA_MAX_AGE):
+    """
+    Проверяет подпись initData Telegram WebApp.
+    Возвращает данные пользователя (dict с id, username, ...) или None, если подпись неверна или устарела.
+    """
+    if not init_data or not bot_token:
+        return None
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received_hash = fields.pop('hash', None)
+    if not received_hash:
+        return None
+    data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        return None
+    try:
+        auth_date = int(fields.get('auth_date', 0))
+        user = json.loads(fields.get('user', '{}'))
+    except ValueError:
+        return None
+    if max_age and time.time() - auth_date > max_age:
+        return None
+    if not user.get('id'):
+        return None
+    return user
+
+
+class AccessControl:
+    """
+    Кэш ролей и правил доступа.
+    load_role(telegram_id) и load_rules(content_type) вызываются только при промахе кэша.
+    """
+
+    def __init__(self, load_role, load_rules, redis_client=None):
+        self.load_role = load_role
+        self.load_rules = load_rules
+        self.redis_client = redis_client
+        self._roles = TTLCache(maxsize=10000, ttl=ROLE_CACHE_TTL)
+        self._rules = {}
+        self._init_data = TTLCache(maxsize=10000, ttl=600)  # уже проверенные initData
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+
+    def _sync_version(self):
+        """Сбрасывает кэш, если другой воркер изменил правила (не чаще раза в VERSION_CHECK_INTERVAL)"""
+        now = time.monotonic()
+        if not self.redis_client or now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            version = self.redis_client.get(VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"[AUTH] Не удалось прочитать версию правил: {e}")
+            return
+        if version != self._version:
+            with self._lock:
+                if self._version is not None:
+                    logger.info(f"[AUTH] Правила доступа изменились (версия {version}), сбрасываем кэш")
+                self._version = version
+                self._rules.clear()
+                self._roles.clear()
+
+    def invalidate(self):
+        """Вызывать после изменения ролей или правил: сбрасывает кэш во всех воркерах"""
+        with self._lock:
+            self._rules.clear()
+            self._roles.clear()
+        if self.redis_client:
+            try:
+                self._version = str(self.redis_client.incr(VERSION_KEY))
+            except Exception as e:
+                logger.warning(f"[AUTH] Не удалось увеличить версию правил: {e}")
+
+    def user_from_init_data(self, init_data, bot_token):
+        with self._lock:
+            user = self._init_data.get(init_data)
+        if user is None:
+            user = validate_init_data(init_data, bot_token)
+            if user:
+                with self._lock:
+                    self._init_data[init_data] = user
+        return user
+
+    def role_for(self, telegram_id):
+        if not telegram_id:
+            return 'guest'
+        self._sync_version()
+        telegram_id = str(telegram_id)
+        with self._lock:
+            role = self._roles.get(telegram_id)
+        if role is None:
+            role = self.load_role(telegram_id)
+            with self._lock:
+                self._roles[telegram_id] = role
+        return role
+
+    def remember_role(self, telegram_id, role):
+        """Кладёт в кэш роль, уже полученную из БД (например, после upsert в /start)"""
+        with self._lock:
+            self._roles[str(telegram_id)] = role
+
+    def forget_role(self, telegram_id):
+        with self._lock:
+            self._roles.pop(str(telegram_id), None)
+
+    def allowed_roles(self, content_type):
+        self._sync_version()
+        with self._lock:
+            roles = self._rules.get(content_type)
+        if roles is None:
+            roles = frozenset(self.load_rules(content_type))
+            with self._lock:
+                self._rules[content_type] = roles
+        return roles
+
+    def is_allowed(self, role, content_type):
+        # Владелец может всё, даже если его роль забыли отметить в настройках
+        return role == 'owner' or role in self.allowed_roles(content_type)
@@ -0,0 +1,94 @@
+# benchmarks/card_render_benchmark.py
+# Время рендера страниц списков (moments/trailers/news) с кэшем карточек и без него.
+#
+# Запуск (нужны зависимости приложения; БД и Redis не нужны — данные генерируются):
+#   python benchmarks/card_render_benchmark.py --items 100 1000 --rounds 20
+#
+# Сценарии:
+#   cold    — кэш карточек пуст: каждая карточка рендерится (как до кэширования)
+#   warm    — ничего не изменилось: все карточки из кэша
+#   one     — у одного элемента изменилась реакция: перерисовывается одна карточка
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIST_TEMPLATES = {'moments': 'moments.html', 'trailers': 'trailers.html', 'news': 'news.html'}
+
+
+def make_items(item_type, count):
+    start = datetime(2025, 1, 1)
+    items = []
+    for i in range(1, count + 1):
+        item = {
+            'id': i,
+            'title': f"Элемент {i}: погоня сквозь галактику",
+            'created_at': start + timedelta(hours=i),
+            'reactions': {'like': random.randint(0, 500), 'dislike': random.randint(0, 50),
+                          'star': random.randint(0, 100), 'fire': random.randint(0, 100)},
+            'comments_count': random.randint(0, 40),
+        }
+        if item_type == 'news':
+            item.update(text='Текст новости ' * 20, image_url=f"/uploads/news_{i}.jpg")
+        else:
+            item.update(description='Описание ' * 20, video_url=f"/uploads/video_{i}.mp4",
+                        preview_url=f"/uploads/preview_{i}.jpg" if i % 4 else None)
+        items.append(item)
+    return items
+
+
+def measure(render, rounds, before=None):
+    samples = []
+    for _ in range(rounds):
+        if before:
+            before()
+        start = time.perf_counter()
+        render()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк рендера списков с кэшем карточек')
+    parser.add_argument('--items', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--types', nargs='+', default=list(LIST_TEMPLATES), choices=list(LIST_TEMPLATES))
+    args = parser.parse_args()
+
+    import app as webapp
+    from flask import render_template
+
+    print(f"{'тип':<10} {'элементов':>9} {'cold, мс':>10} {'warm, мс':>10} {'one, мс':>10} {'ускорение':>10}")
+    with webapp.app.test_request_context('/'):
+        for item_type in args.types:
+            var = 'news' if item_type == 'news' else item_type
+            for count in args.items:
+                items = make_items(item_type, count)
+
+                def render():
+                    return render_template(LIST_TEMPLATES[item_type], **{var: items})
+
+                def clear():
+                    webapp.card_fragments.clear()
+
+                def change_one():
+                    item = random.choice(items)
+                    item['reactions'] = dict(item['reactions'], like=item['reactions']['like'] + 1)
+                    if item_type != 'news':
+                        # Реакции не выводятся в карточках видео: меняем то, что выводится
+                        item['title'] = item['title'] + '!'
+
+                cold = measure(render, args.rounds, before=clear)
+                render()
+                warm = measure(render, args.rounds)
+                one = measure(render, args.rounds, before=change_one)
+                print(f"{item_type:<10} {count:>9} {cold:>10.2f} {warm:>10.2f} {one:>10.2f} {cold / one:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# benchmarks/fake_telegram_api.py
+# Заглушка Telegram Bot API для замеров без сети: приложение направляется на неё через
+# TELEGRAM_API_URL (см. media_proxy.py). Поддерживает то, что вызывают загрузка контента,
+# извлечение ссылок из постов и обновление ссылок: getFile, forwardMessage, sendVideo, sendPhoto
+# и скачивание /file/bot<токен>/<file_path>. Остальные методы отвечают {"ok": true, "result": true}.
+#
+# Поведение настраивается:
+#   latency_ms, jitter_ms — задержка каждого ответа (равномерно latency ± jitter)
+#   flood_rate            — доля вызовов методов, получающих 429 с retry_after
+#   rate_limit            — лимит вызовов методов в секунду на токен (сверх него — 429, как у Telegram)
+#   file_ttl              — сколько секунд живёт ссылка из getFile (у Telegram — не меньше часа),
+#                           после этого скачивание отвечает 404
+#   file_size             — размер файла при скачивании, байт
+#
+# Пересылка: чётный message_id — пост с видео, нечётный — с фото. file_id зависит только от
+# чата и сообщения, поэтому повторная пересылка того же поста даёт тот же file_id.
+#
+# Отдельный запуск:
+#   python benchmarks/fake_telegram_api.py --port 8081 --latency-ms 80 --flood-rate 0.05
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_TOKEN=123:fake gunicorn app:app
+# Счётчики вызовов: GET /_stats, сброс — POST /_stats/reset.
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METHOD_RE = re.compile(r'^/bot([^/]+)/(\w+)$')
+FILE_RE = re.compile(r'^/file/bot([^/]+)/(.+)$')
+MULTIPART_NAME_RE = re.compile(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', re.S)
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, flood_rate=0.0,
+                 rate_limit=0, retry_after=1, file_ttl=3600, file_size=64 * 1024):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.flood_rate = flood_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.file_ttl = file_ttl
+        self.file_size = file_size
+        self.stats = Counter()   # метод -> вызовов; 'flood', 'file', 'file_expired', 'upload_bytes'
+        self.files = {}          # file_path -> время, после которого ссылка не работает
+        self._windows = {}       # токен -> (секунда, вызовов в ней)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def is_expired(self, url):
+        """Не работает ли уже прямая ссылка на файл (для проверки ссылок, выданных приложением)"""
+        match = FILE_RE.match(urlparse(url).path)
+        expires = self.files.get(match.group(2)) if match else None
+        return expires is None or time.time() >= expires
+
+    # --- Ответы ---
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _flooded(self, token):
+        if self.flood_rate and random.random() < self.flood_rate:
+            return True
+        if not self.rate_limit:
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            window, calls = self._windows.get(token, (second, 0))
+            if window != second:
+                window, calls = second, 0
+            self._windows[token] = (window, calls + 1)
+            return calls >= self.rate_limit
+
+    def _delay(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    @staticmethod
+    def _file_id(kind, *parts):
+        digest = hashlib.sha1(':'.join(map(str, (kind,) + parts)).encode()).hexdigest()[:24]
+        return f"{kind}_{digest}"
+
+    def _message(self, chat_id, kind, file_id):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else -100, 'type': 'supergroup'},
+        }
+        unique_id = file_id[-12:]
+        if kind == 'video':
+            message['video'] = {'file_id': file_id, 'file_unique_id': unique_id, 'width': 1280, 'height': 720,
+                                'duration': 30, 'mime_type': 'video/mp4', 'file_size': self.file_size}
+        else:
+            message['photo'] = [{'file_id': f"{file_id}_{size}", 'file_unique_id': f"{unique_id}{size}",
+                                 'width': size, 'height': size} for size in (90, 320, 1280)]
+        return message
+
+    def call(self, token, method, params):
+        """JSON-ответ метода Bot API: (HTTP-статус, тело)"""
+        self._count(method)
+        if self._flooded(token):
+            self._count('flood')
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f"Too Many Requests: retry after {self.retry_after}",
+                         'parameters': {'retry_after': self.retry_after}}
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            if not file_id:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: file_id is required'}
+            ext = 'mp4' if file_id.startswith('video') else 'jpg'
+            file_path = f"{'videos' if ext == 'mp4' else 'photos'}/{file_id}_{time.time_ns():x}.{ext}"
+            with self._lock:
+                self.files[file_path] = time.time() + self.file_ttl
+            return 200, {'ok': True, 'result': {'file_id': file_id, 'file_unique_id': file_id[-12:],
+                                                'file_size': self.file_size, 'file_path': file_path}}
+        if method == 'forwardMessage':
+            message_id = int(params.get('message_id', 0))
+            kind = 'photo' if message_id % 2 else 'video'
+            file_id = self._file_id(kind, params.get('from_chat_id'), message_id)
+            return 200, {'ok': True, 'result': self._message(params.get('chat_id'), kind, file_id)}
+        if method in ('sendVideo', 'sendPhoto'):
+            kind = 'video' if method == 'sendVideo' else 'photo'
+            file_id = self._file_id(kind, time.time_ns(), random.random())
+            return 200, {'ok': True, 'result': self._message(params.get('chat_id'), kind, file_id)}
+        return 200, {'ok': True, 'result': True}
+
+    def download(self, file_path):
+        """(HTTP-статус, тело) скачивания файла"""
+        with self._lock:
+            expires = self.files.get(file_path)
+        if expires is None or time.time() >= expires:
+            self._count('file_expired')
+            return 404, json.dumps({'ok': False, 'error_code': 404, 'description': 'Not Found'}).encode()
+        self._count('file')
+        return 200, b'\0' * self.file_size
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _params(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                api._count('upload_bytes', len(body))
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('application/json') and body:
+                    params.update(json.loads(body))
+                elif content_type.startswith('application/x-www-form-urlencoded'):
+                    params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+                elif content_type.startswith('multipart/form-data'):
+                    # Файл не разбираем, нужны только короткие текстовые поля (chat_id и т.п.)
+                    for name, value in MULTIPART_NAME_RE.findall(body):
+                        if len(value) < 256:
+                            params[name.decode()] = value.decode('utf-8', 'replace')
+                return parsed.path, params
+
+            def _send(self, status, body, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _dispatch(self):
+                path, params = self._params()
+                if path == '/_stats':
+                    return self._send(200, json.dumps(api.snapshot()).encode())
+                if path == '/_stats/reset':
+                    api.reset_stats()
+                    return self._send(200, b'{"ok": true}')
+                api._delay()
+                match = FILE_RE.match(path)
+                if match:
+                    status, body = api.download(match.group(2))
+                    return self._send(status, body, 'application/octet-stream' if status == 200 else 'application/json')
+                match = METHOD_RE.match(path)
+                if not match:
+                    return self._send(404, b'{"ok": false, "error_code": 404, "description": "Not Found"}')
+                status, payload = api.call(match.group(1), match.group(2), params)
+                self._send(status, json.dumps(payload).encode())
+
+            do_GET = do_POST = do_HEAD = _dispatch
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--rate-limit', type=int, default=0, help='вызовов в секунду на токен, 0 — без лимита')
+    parser.add_argument('--file-ttl', type=float, default=3600, help='срок жизни ссылки на файл, с')
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+    api = FakeBotAPI(args.host, args.port, args.latency_ms, args.jitter_ms, args.flood_rate,
+                     args.rate_limit, file_ttl=args.file_ttl, file_size=args.file_size)
+    print(f"Заглушка Bot API: {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# benchmarks/search_benchmark.py
+# Замер задержки полнотекстового поиска (database.search_content) на большом объёме данных.
+#
+# Запуск (нужен PostgreSQL 12+ в DATABASE_URL):
+#   DATABASE_URL=postgres://... python benchmarks/search_benchmark.py --items 100000
+#
+# Данные создаются в отдельной схеме (по умолчанию bench_search) и удаляются после замера,
+# рабочие таблицы не затрагиваются.
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS_RU = [
+    'космос', 'звезда', 'галактика', 'погоня', 'любовь', 'война', 'герой', 'тайна', 'город',
+    'ночь', 'огонь', 'море', 'пустыня', 'робот', 'время', 'память', 'дракон', 'корабль',
+    'планета', 'предательство', 'побег', 'битва', 'детектив', 'призрак', 'зима', 'остров',
+]
+WORDS_EN = [
+    'space', 'star', 'galaxy', 'chase', 'love', 'war', 'hero', 'mystery', 'city', 'night',
+    'fire', 'sea', 'desert', 'robot', 'time', 'memory', 'dragon', 'ship', 'planet', 'escape',
+]
+QUERIES = [
+    'космос', 'звёзды галактики', 'погоня ночь', 'дракон', 'робот время', 'тайна острова',
+    'space', 'galaxy star', 'robot', 'love war', '"битва за планету"', 'призрак -зима',
+]
+
+
+def seed(conn, items):
+    """Заполняет moments/trailers/news случайными названиями и описаниями (items строк всего)"""
+    words = WORDS_RU + WORDS_EN
+    per_table = items // 3
+    c = conn.cursor()
+    for table, body in (('moments', 'description'), ('trailers', 'description'), ('news', 'text')):
+        extra = ", video_url" if table != 'news' else ""
+        extra_value = ", 'https://example.com/v.mp4'" if table != 'news' else ""
+        c.execute(f"""
+            INSERT INTO {table} (title, {body}{extra})
+            SELECT
+                (SELECT string_agg(w, ' ') FROM (
+                    SELECT (%(words)s::text[])[1 + floor(random() * %(n)s)::int] AS w
+                    FROM generate_series(1, 3 + (g %% 3))) t),
+                (SELECT string_agg(w, ' ') FROM (
+                    SELECT (%(words)s::text[])[1 + floor(random() * %(n)s)::int] AS w
+                    FROM generate_series(1, 30 + (g %% 40))) t)
+                {extra_value}
+            FROM generate_series(1, %(count)s) g
+        """, {'words': words, 'n': len(words), 'count': per_table})
+    c.execute("ANALYZE moments; ANALYZE trailers; ANALYZE news")
+    conn.commit()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(queries, rounds, page_size, search_content):
+    timings = {}
+    for q in queries:
+        search_content(q, limit=page_size)  # прогрев
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            rows, total = search_content(q, limit=page_size, offset=random.choice((0, 0, 0, page_size)))
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[q] = (samples, total)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк полнотекстового поиска')
+    parser.add_argument('--items', type=int, default=100000, help='всего строк в moments+trailers+news')
+    parser.add_argument('--rounds', type=int, default=50, help='повторов каждого запроса')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--schema', default='bench_search')
+    parser.add_argument('--keep', action='store_true', help='не удалять схему с данными после замера')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('DATABASE_URL не задан')
+    # Все соединения database.py (libpq читает PGOPTIONS) работают в отдельной схеме
+    os.environ['PGOPTIONS'] = f"-c search_path={args.schema},public"
+
+    import psycopg2
+    import database
+
+    admin_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    admin_conn.autocommit = True
+    admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE; CREATE SCHEMA {args.schema}")
+    try:
+        database.init_db()
+        conn = database.get_db_connection()
+        start = time.perf_counter()
+        seed(conn, args.items)
+        conn.close()
+        print(f"Создано {args.items} строк за {time.perf_counter() - start:.1f} с")
+
+        timings = run(QUERIES, args.rounds, args.page_size, database.search_content)
+        print(f"\n{'запрос':<24} {'найдено':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+        all_samples = []
+        for q, (samples, total) in timings.items():
+            all_samples.extend(samples)
+            print(f"{q:<24} {total:>8} {statistics.median(samples):>9.2f} "
+                  f"{percentile(samples, 95):>9.2f} {percentile(samples, 99):>9.2f}")
+        print(f"\n{'всего':<24} {'':>8} {statistics.median(all_samples):>9.2f} "
+              f"{percentile(all_samples, 95):>9.2f} {percentile(all_samples, 99):>9.2f}")
+    finally:
+        if not args.keep:
+            admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        admin_conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# benchmarks/telegram_media_benchmark.py
+# Замер путей, которые ходят в Telegram Bot API: прямые ссылки на файлы
+# (get_cached_direct_video_url_advanced), извлечение видео из поста (extract_video_url_sync)
+# и добавление контента в админке (admin_add_content) — параллельно из нескольких потоков.
+# Вместо api.telegram.org поднимается заглушка benchmarks/fake_telegram_api.py с заданной
+# задержкой, долей ответов 429 и сроком жизни ссылок; приложение направляется на неё
+# через TELEGRAM_API_URL. Сеть не нужна.
+#
+# Запуск:
+#   python benchmarks/telegram_media_benchmark.py --ops 200 --concurrency 8 --latency-ms 80
+#   ... --flood-rate 0.05            # 5% вызовов получают 429
+#   ... --file-ttl 2 --cache-time 60 # ссылки протухают раньше, чем кэш приложения их обновит
+#   DATABASE_URL=postgres://... python benchmarks/telegram_media_benchmark.py   # + сценарии админки
+#
+# Сценарии admin_* пишут в БД; данные создаются в отдельной схеме (bench_telegram) и удаляются.
+# Без DATABASE_URL эти сценарии пропускаются.
+#
+# Колонки: вызовов Bot API на операцию (без скачивания файлов), ответов 429, ошибок
+# (операция не вернула ссылку / админка не сделала редирект) и протухших ссылок среди выданных.
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram_api import FakeBotAPI
+
+TOKEN = '123456:bench-token'
+CHANNEL = 'bench_channel'
+NOT_API_CALLS = ('flood', 'file', 'file_expired', 'upload_bytes')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def post_url(rnd, posts, photo=False):
+    """Ссылка на пост в канале: чётный номер — видео, нечётный — фото (см. заглушку)"""
+    return f"https://t.me/{CHANNEL}/{rnd.randrange(posts) * 2 + (1 if photo else 0)}"
+
+
+class Operations:
+    """Одна операция каждого сценария: возвращает (успех, выданная ссылка или None)"""
+
+    def __init__(self, webapp, args):
+        self.webapp = webapp
+        self.args = args
+        self.local = threading.local()
+        self.upload = os.urandom(args.upload_kb * 1024)
+
+    def file_url(self, rnd):
+        url, _ = self.webapp.get_cached_direct_video_url_advanced(
+            f"video_bench_{rnd.randrange(self.args.files)}", self.args.cache_time)
+        return url is not None, url
+
+    def extract(self, rnd):
+        url, _ = self.webapp.extract_video_url_sync(post_url(rnd, self.args.posts))
+        return url is not None, url
+
+    def _client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.webapp.app.test_client()
+            with client.session_transaction() as session:
+                session['admin'] = 'bench'
+        return client
+
+    def admin_link(self, rnd):
+        resp = self._client().post('/admin/add_content', data={
+            'content_type': 'moment', 'title': 'Момент из поста', 'description': 'Замер',
+            'telegram_url': post_url(rnd, self.args.posts),
+            'preview_telegram_url': post_url(rnd, self.args.posts, photo=True),
+        })
+        return resp.status_code == 302, None
+
+    def admin_upload(self, rnd):
+        from io import BytesIO
+        resp = self._client().post('/admin/add_content', data={
+            'content_type': 'trailer', 'title': 'Загруженный трейлер', 'description': 'Замер',
+            'video_file': (BytesIO(self.upload), 'trailer.mp4'),
+        }, content_type='multipart/form-data')
+        return resp.status_code == 302, None
+
+
+def run(name, operation, api, args):
+    api.reset_stats()
+    rnd_lock = threading.Lock()
+    rnd = random.Random(args.seed)
+
+    def one(_):
+        with rnd_lock:
+            op_rnd = random.Random(rnd.random())
+        start = time.perf_counter()
+        try:
+            ok, url = operation(op_rnd)
+        except Exception as e:
+            logging.getLogger(__name__).debug(f"{name}: {e}")
+            ok, url = False, None
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, ok, url is not None and api.is_expired(url)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(one, range(args.ops)))
+    total = time.perf_counter() - started
+    stats = api.snapshot()
+    latencies = [s[0] for s in samples]
+    api_calls = sum(v for k, v in stats.items() if k not in NOT_API_CALLS)
+    print(f"{name:<13} {len(samples) / total:>8.1f} {statistics.median(latencies):>8.1f} "
+          f"{percentile(latencies, 95):>8.1f} {percentile(latencies, 99):>8.1f} "
+          f"{api_calls / len(samples):>8.2f} {stats.get('flood', 0):>5} "
+          f"{sum(1 for s in samples if not s[1]):>6} {sum(1 for s in samples if s[2]):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер работы с Telegram Bot API на заглушке')
+    parser.add_argument('--ops', type=int, default=200, help='операций на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--files', type=int, default=50, help='разных file_id в сценарии file_url')
+    parser.add_argument('--posts', type=int, default=50, help='разных постов в извлечении и админке')
+    parser.add_argument('--cache-time', type=float, help='срок кэша ссылок в приложении, с (по умолчанию из CACHE_CONFIG)')
+    parser.add_argument('--upload-kb', type=int, default=512, help='размер загружаемого видео в admin_upload')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0, help='вызовов в секунду, 0 — без лимита')
+    parser.add_argument('--file-ttl', type=float, default=3600)
+    parser.add_argument('--scenarios', nargs='+', default=['file_url', 'extract', 'admin_link', 'admin_upload'],
+                        choices=['file_url', 'extract', 'admin_link', 'admin_upload'])
+    parser.add_argument('--schema', default='bench_telegram')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, flood_rate=args.flood_rate,
+                     rate_limit=args.rate_limit, file_ttl=args.file_ttl).start()
+    os.environ.update({
+        'TELEGRAM_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': api.url,
+        'BROADCAST_ENABLED': '0',
+        'REQUEST_TIMING_LOG_MS': '100000',
+    })
+    database_url = os.environ.get('DATABASE_URL')
+    admin_conn = None
+    scenarios = list(args.scenarios)
+    if database_url:
+        import psycopg2
+        os.environ['PGOPTIONS'] = f"-c search_path={args.schema},public"
+        admin_conn = psycopg2.connect(database_url)
+        admin_conn.autocommit = True
+        admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE; CREATE SCHEMA {args.schema}")
+    elif any(s.startswith('admin') for s in scenarios):
+        print('DATABASE_URL не задан — сценарии admin_* пропущены')
+        scenarios = [s for s in scenarios if not s.startswith('admin')]
+
+    # Ошибки операций считаются в таблице, лог приложения их не дублирует
+    logging.disable(logging.ERROR)
+    try:
+        import app as webapp
+        if database_url:
+            import database
+            database.init_db()
+        operations = Operations(webapp, args)
+        print(f"Заглушка Bot API {api.url}: задержка {args.latency_ms:g}±{args.jitter_ms:g} мс, "
+              f"429 — {args.flood_rate:.0%}, лимит {args.rate_limit or 'нет'}, ссылки живут {args.file_ttl:g} с")
+        cache_time = args.cache_time or webapp.CACHE_CONFIG['video_url_cache_time']
+        if cache_time > args.file_ttl:
+            print(f"Кэш ссылок в приложении ({cache_time:g} с) дольше жизни ссылки ({args.file_ttl:g} с)")
+        print(f"\n{'сценарий':<13} {'опер/с':>8} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} "
+              f"{'Bot API':>8} {'429':>5} {'ошибок':>6} {'протухших':>9}")
+        for name in scenarios:
+            webapp.video_url_cache_advanced.clear()
+            run(name, getattr(operations, name), api, args)
+    finally:
+        api.stop()
+        if admin_conn:
+            admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+            admin_conn.close()
+
+
+if __name__ == '__main__':
+    main()
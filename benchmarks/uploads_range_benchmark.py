@@ -0,0 +1,181 @@
+# benchmarks/uploads_range_benchmark.py
+# Проверка и замер отдачи больших загрузок (/uploads): просмотр целиком, перемотка (Range),
+# условные запросы. По умолчанию создаёт файл 500 МБ в uploads/ и поднимает приложение
+# под gunicorn (как в Dockerfile), чтобы ответы шли через os.sendfile.
+#
+# Запуск (нужны зависимости приложения и gunicorn; БД и Redis не нужны):
+#   python benchmarks/uploads_range_benchmark.py --size-mb 500 --seeks 50
+#   python benchmarks/uploads_range_benchmark.py --url http://localhost:10000  # уже запущенный сервер
+#
+# Сценарии:
+#   playback — GET всего файла потоком, сверка sha256 с файлом на диске
+#   seek     — Range "bytes=N-" со случайной позиции, плеер читает 2 МБ и закрывает соединение
+#   slice    — Range "bytes=N-M", сверка байтов с файлом
+#   checks   — 304 по If-None-Match, If-Range с чужим ETag (200), суффикс "bytes=-N", 416
+import os
+import sys
+import time
+import uuid
+import socket
+import random
+import hashlib
+import argparse
+import statistics
+import subprocess
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOCK = 1024 * 1024
+READ_AHEAD = 2 * BLOCK  # сколько читает плеер после перемотки, прежде чем запросить следующий диапазон
+
+
+def make_file(path, size_mb):
+    """Файл из блоков по 1 МБ; в начале каждого блока его номер, чтобы перемотка была проверяемой"""
+    noise = os.urandom(BLOCK)
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for i in range(size_mb):
+            block = i.to_bytes(8, 'big') + noise[8:]
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+def read_slice(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f"127.0.0.1:{port}", '--workers', '1', '--threads', '4',
+         '--timeout', '120', 'app:app'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            requests.get(f"{base}/uploads/missing.bin", timeout=1)
+            return proc, base
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('gunicorn не запустился')
+
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+
+def playback(url, expected_sha, size):
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    with requests.get(url, stream=True, timeout=60) as r:
+        check(r.status_code == 200, f"playback: статус {r.status_code}")
+        check(int(r.headers['Content-Length']) == size, 'playback: неверный Content-Length')
+        ttfb = time.perf_counter() - start
+        received = 0
+        for chunk in r.iter_content(BLOCK):
+            digest.update(chunk)
+            received += len(chunk)
+    elapsed = time.perf_counter() - start
+    check(received == size and digest.hexdigest() == expected_sha, 'playback: содержимое не совпадает')
+    return ttfb * 1000, size / elapsed / BLOCK
+
+
+def seek(url, path, size, rounds):
+    samples = []
+    with requests.Session() as session:
+        for _ in range(rounds):
+            offset = random.randrange(0, size - READ_AHEAD)
+            start = time.perf_counter()
+            with session.get(url, headers={'Range': f"bytes={offset}-"}, stream=True, timeout=30) as r:
+                check(r.status_code == 206, f"seek: статус {r.status_code}")
+                check(r.headers['Content-Range'] == f"bytes {offset}-{size - 1}/{size}", 'seek: Content-Range')
+                data = b''
+                for chunk in r.iter_content(256 * 1024):
+                    data += chunk
+                    if len(data) >= READ_AHEAD:
+                        break
+                samples.append((time.perf_counter() - start) * 1000)
+            check(data[:READ_AHEAD] == read_slice(path, offset, READ_AHEAD), f"seek: байты с {offset} не совпадают")
+    return statistics.median(samples), max(samples)
+
+
+def slices(url, path, size, rounds):
+    samples = []
+    with requests.Session() as session:
+        for _ in range(rounds):
+            offset = random.randrange(0, size - BLOCK)
+            length = random.randint(1, BLOCK)
+            start = time.perf_counter()
+            r = session.get(url, headers={'Range': f"bytes={offset}-{offset + length - 1}"}, timeout=30)
+            samples.append((time.perf_counter() - start) * 1000)
+            check(r.status_code == 206 and r.content == read_slice(path, offset, length),
+                  f"slice: диапазон {offset}+{length} не совпадает")
+    return statistics.median(samples)
+
+
+def conditional_checks(url, path, size):
+    head = requests.head(url, timeout=10)
+    etag = head.headers['ETag']
+    check(head.headers.get('Accept-Ranges') == 'bytes', 'нет Accept-Ranges')
+    check(requests.get(url, headers={'If-None-Match': etag}, timeout=10).status_code == 304, 'If-None-Match: ждали 304')
+    r = requests.get(url, headers={'If-Modified-Since': head.headers['Last-Modified']}, timeout=10, stream=True)
+    check(r.status_code == 304, 'If-Modified-Since: ждали 304')
+    r = requests.get(url, headers={'Range': 'bytes=0-99', 'If-Range': '"other"'}, stream=True, timeout=10)
+    check(r.status_code == 200, 'If-Range с чужим ETag: ждали весь файл')
+    r.close()
+    r = requests.get(url, headers={'Range': 'bytes=0-99', 'If-Range': etag}, timeout=10)
+    check(r.status_code == 206 and len(r.content) == 100, 'If-Range со своим ETag: ждали диапазон')
+    r = requests.get(url, headers={'Range': 'bytes=-1000'}, timeout=10)
+    check(r.status_code == 206 and r.content == read_slice(path, size - 1000, 1000), 'суффиксный диапазон')
+    r = requests.get(url, headers={'Range': f"bytes={size}-"}, timeout=10)
+    check(r.status_code == 416 and r.headers['Content-Range'] == f"bytes */{size}", 'ждали 416')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка и бенчмарк отдачи /uploads')
+    parser.add_argument('--size-mb', type=int, default=500)
+    parser.add_argument('--seeks', type=int, default=50)
+    parser.add_argument('--url', help='Адрес уже запущенного сервера (файл всё равно создаётся в uploads/)')
+    args = parser.parse_args()
+
+    name = f"bench_{uuid.uuid4().hex}.mp4"
+    path = os.path.join(ROOT, 'uploads', name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    proc = None
+    try:
+        print(f"Создаём {args.size_mb} МБ: {path}")
+        expected_sha = make_file(path, args.size_mb)
+        size = os.path.getsize(path)
+        if args.url:
+            base = args.url.rstrip('/')
+        else:
+            proc, base = start_server(free_port())
+        url = f"{base}/uploads/{name}"
+
+        conditional_checks(url, path, size)
+        print('checks   — 304, If-Range, суффиксный диапазон, 416: OK')
+        ttfb, rate = playback(url, expected_sha, size)
+        print(f"playback — первый байт {ttfb:.1f} мс, {rate:.0f} МБ/с, sha256 совпадает")
+        median, worst = seek(url, path, size, args.seeks)
+        print(f"seek     — {args.seeks} перемоток, 2 МБ после каждой: медиана {median:.1f} мс, худшая {worst:.1f} мс")
+        print(f"slice    — {args.seeks} диапазонов до 1 МБ: медиана {slices(url, path, size, args.seeks):.1f} мс")
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(10)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+# benchmarks/web_benchmark.py
+# Нагрузочный замер веб-маршрутов: списки, страницы элементов, API комментариев и реакций.
+# Данные создаются в отдельной схеме PostgreSQL (по умолчанию bench_web) и удаляются после замера.
+# Запросы идут через тестовый клиент Flask (без сети, по одному) и/или через настоящий gunicorn
+# (несколько воркеров, параллельные клиенты). Для каждого сценария: запросов в секунду,
+# p50/p95/p99 и число обращений к БД и Redis на запрос (из заголовка Server-Timing).
+#
+# Зависимости: pip install -r benchmarks/requirements.txt (приложение, gunicorn и fakeredis с Lua —
+# реакции и очереди приложения работают через скрипты Redis, а fakeredis исполняет их только с lupa).
+#
+# Запуск (нужен PostgreSQL в DATABASE_URL; Redis — REDIS_URL или подменный fakeredis по умолчанию):
+#   DATABASE_URL=postgres://... python benchmarks/web_benchmark.py --items 1000 --requests 200
+#   ... --mode client                      # только тестовый клиент
+#   ... --redis-url redis://localhost/15   # настоящий Redis; эта БД Redis очищается перед замером!
+#   ... --save-baseline benchmarks/baselines/web_benchmark.json
+#   ... --baseline benchmarks/baselines/web_benchmark.json   # сравнение, код выхода 1 при регрессии
+#
+# Регрессия: p95 хуже базового больше чем на --tolerance процентов или выросло число
+# обращений к БД/Redis на запрос больше чем на 10% (не зависит от машины, поэтому допуск малый).
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+REACTIONS = ('like', 'dislike', 'star', 'fire')
+ROUND_TRIPS = ('db', 'db-connect', 'redis')
+
+
+# --- Данные ---
+
+def seed(conn, items, comments, reactions):
+    """items строк в moments/trailers/news, на каждый элемент comments комментариев и reactions реакций"""
+    c = conn.cursor()
+    for table in ('moments', 'trailers'):
+        c.execute(f"""
+            INSERT INTO {table} (title, description, video_url, preview_url, created_at)
+            SELECT 'Элемент ' || g || ': погоня сквозь галактику', repeat('Описание сцены ', 20),
+                   '/uploads/bench_' || g || '.mp4',
+                   CASE WHEN g %% 4 = 0 THEN NULL ELSE '/uploads/bench_' || g || '.jpg' END,
+                   now() - g * interval '1 minute'
+            FROM generate_series(1, %(n)s) g
+        """, {'n': items})
+    c.execute("""
+        INSERT INTO news (title, text, image_url, created_at)
+        SELECT 'Новость ' || g, repeat('Текст новости ', 40), '/uploads/bench_news_' || g || '.jpg',
+               now() - g * interval '1 minute'
+        FROM generate_series(1, %(n)s) g
+    """, {'n': items})
+    for table in ('moments', 'trailers', 'news'):
+        c.execute(f"""
+            INSERT INTO comments (item_type, item_id, user_name, text, likes, dislikes, created_at)
+            SELECT %(type)s, i.id, 'Зритель ' || (random() * 1000)::int, 'Комментарий ' || g,
+                   (random() * 50)::int, (random() * 10)::int, now() - random() * interval '30 days'
+            FROM {table} i, generate_series(1, %(n)s) g
+        """, {'type': table, 'n': comments})
+        c.execute(f"""
+            INSERT INTO reactions (item_type, item_id, user_id, reaction)
+            SELECT %(type)s, i.id, 'bench_' || g, (ARRAY['like', 'dislike', 'star', 'fire'])[1 + g %% 4]
+            FROM {table} i, generate_series(1, %(n)s) g
+            ON CONFLICT DO NOTHING
+        """, {'type': table, 'n': reactions})
+    conn.commit()
+    c.execute("ANALYZE")
+    conn.commit()
+
+
+# --- Сценарии: (метод, путь, JSON, заголовки) для случайного элемента ---
+
+def _random_ip(rnd):
+    return f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}"
+
+
+def scenarios(items):
+    def item_id(rnd):
+        return rnd.randint(1, items)
+
+    return {
+        'list_moments': lambda rnd: ('GET', '/moments', None, {}),
+        'list_news': lambda rnd: ('GET', '/news', None, {}),
+        'api_list_moments': lambda rnd: ('GET', '/api/v1/moments', None, {}),
+        'detail_moment': lambda rnd: ('GET', f"/moments/{item_id(rnd)}", None, {}),
+        'detail_news': lambda rnd: ('GET', f"/news/{item_id(rnd)}", None, {}),
+        'comments_api': lambda rnd: ('GET', f"/api/comments/moments/{item_id(rnd)}?sort=popular", None, {}),
+        'reaction_post': lambda rnd: ('POST', '/api/reaction', {
+            'item_type': 'moments', 'item_id': item_id(rnd),
+            'user_id': f"u{rnd.randrange(10 ** 9)}", 'reaction': rnd.choice(REACTIONS)}, {}),
+        # Лимит комментариев считается по IP: каждому запросу свой адрес (TRUSTED_PROXY_HOPS=1)
+        'comment_post': lambda rnd: ('POST', '/api/comment', {
+            'item_type': 'moments', 'item_id': item_id(rnd), 'user_name': 'bench', 'text': 'Отличная сцена'},
+            {'X-Forwarded-For': _random_ip(rnd)}),
+    }
+
+
+def round_trips(server_timing):
+    """{'db': 3, 'redis': 5, ...} из Server-Timing: desc — число вызовов участка"""
+    counts = {}
+    for part in (server_timing or '').split(','):
+        fields = part.strip().split(';')
+        for field in fields[1:]:
+            if field.startswith('desc='):
+                counts[fields[0]] = int(field[5:].strip('"'))
+    return counts
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    latencies = [s[0] for s in samples]
+    result = {
+        'requests': len(samples),
+        'rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'errors': sum(1 for s in samples if s[1] >= 500 or s[1] == 0),
+    }
+    for name in ROUND_TRIPS:
+        result[name] = round(sum(s[2].get(name, 0) for s in samples) / len(samples), 2)
+    return result
+
+
+# --- Тестовый клиент Flask ---
+
+def run_client(names, items, requests_count, warmup, seed_value):
+    import app as webapp
+    client = webapp.app.test_client()
+    results = {}
+    for name in names:
+        make = scenarios(items)[name]
+        rnd = random.Random(seed_value)
+        for _ in range(warmup):
+            _client_request(client, *make(rnd))
+        samples = []
+        started = time.perf_counter()
+        for _ in range(requests_count):
+            samples.append(_client_request(client, *make(rnd)))
+        results[name] = summarize(samples, time.perf_counter() - started)
+        print_row('client', name, results[name])
+    return results
+
+
+def _client_request(client, method, path, body, headers):
+    start = time.perf_counter()
+    resp = client.open(path, method=method, json=body, headers=headers)
+    resp.get_data()
+    return (time.perf_counter() - start) * 1000, resp.status_code, round_trips(resp.headers.get('Server-Timing'))
+
+
+# --- gunicorn ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(env, workers, threads):
+    import requests
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f"127.0.0.1:{port}", '--workers', str(workers),
+         '--threads', str(threads), '--timeout', '120', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        try:
+            requests.get(f"{base}/health", timeout=5)
+            return proc, base
+        except requests.RequestException:  # порт уже слушается, а воркер ещё импортирует приложение
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('gunicorn не запустился')
+
+
+def run_gunicorn(names, items, requests_count, warmup, seed_value, base, concurrency):
+    import requests
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one(request_args):
+        method, path, body, headers = request_args
+        start = time.perf_counter()
+        try:
+            resp = session().request(method, base + path, json=body, headers=headers, timeout=60)
+            status, timing = resp.status_code, resp.headers.get('Server-Timing')
+        except requests.RequestException:
+            status, timing = 0, None
+        return (time.perf_counter() - start) * 1000, status, round_trips(timing)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name in names:
+            make = scenarios(items)[name]
+            rnd = random.Random(seed_value)
+            list(pool.map(one, [make(rnd) for _ in range(warmup)]))
+            batch = [make(rnd) for _ in range(requests_count)]
+            started = time.perf_counter()
+            samples = list(pool.map(one, batch))
+            results[name] = summarize(samples, time.perf_counter() - started)
+            print_row('gunicorn', name, results[name])
+    return results
+
+
+# --- Отчёт и сравнение ---
+
+HEADER = (f"{'режим':<9} {'сценарий':<17} {'запр/с':>8} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} "
+          f"{'БД':>5} {'соед.':>5} {'Redis':>5} {'ошибок':>6}")
+
+
+def print_row(mode, name, r):
+    print(f"{mode:<9} {name:<17} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+          f"{r['db']:>5.1f} {r['db-connect']:>5.1f} {r['redis']:>5.1f} {r['errors']:>6}")
+
+
+def compare(results, baseline, tolerance):
+    """Печатает изменения относительно базового замера, возвращает список регрессий"""
+    regressions = []
+    print(f"\nСравнение с базовым замером ({baseline['meta'].get('created', '?')}):")
+    print(f"{'режим':<9} {'сценарий':<17} {'p50':>8} {'p95':>8} {'запр/с':>8}  обращения к БД/Redis")
+    for mode, scenario_results in results.items():
+        for name, r in scenario_results.items():
+            base = baseline['results'].get(mode, {}).get(name)
+            if not base:
+                continue
+
+            def delta(key):
+                return (r[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+            trips = ', '.join(f"{k} {base[k]:g}->{r[k]:g}" for k in ROUND_TRIPS if r[k] != base[k]) or 'без изменений'
+            print(f"{mode:<9} {name:<17} {delta('p50_ms'):>+7.0f}% {delta('p95_ms'):>+7.0f}% {delta('rps'):>+7.0f}%  {trips}")
+            if delta('p95_ms') > tolerance:
+                regressions.append(f"{mode}/{name}: p95 {base['p95_ms']} -> {r['p95_ms']} мс")
+            for key in ROUND_TRIPS:
+                # Небольшой допуск: часть обращений зависит от того, успел ли истечь кэш
+                if r[key] > base[key] * 1.1 + 0.1:
+                    regressions.append(f"{mode}/{name}: {key} на запрос {base[key]} -> {r[key]}")
+    return regressions
+
+
+def start_fake_redis():
+    """Подменный Redis (fakeredis) на локальном порту — доступен и воркерам gunicorn"""
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        sys.exit('fakeredis не установлен: pip install -r benchmarks/requirements.txt или --redis-url')
+    import redis
+    port = free_port()
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    redis_url = f"redis://127.0.0.1:{port}/0"
+    # Без lupa fakeredis отвечает ошибкой на EVAL — замер упал бы посреди сценариев реакций
+    try:
+        redis.from_url(redis_url).eval('return 1', 0)
+    except redis.RedisError as e:
+        server.shutdown()
+        sys.exit(f"fakeredis без поддержки Lua ({e}): pip install -r benchmarks/requirements.txt или --redis-url")
+    return server, redis_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный замер веб-маршрутов')
+    parser.add_argument('--items', type=int, default=1000, help='элементов каждого типа')
+    parser.add_argument('--comments', type=int, default=20, help='комментариев на элемент')
+    parser.add_argument('--reactions', type=int, default=40, help='реакций на элемент')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--mode', choices=('client', 'gunicorn', 'both'), default='both')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8, help='параллельных клиентов для gunicorn')
+    parser.add_argument('--scenarios', nargs='+', choices=list(scenarios(1)), default=list(scenarios(1)))
+    parser.add_argument('--redis-url', help='настоящий Redis (очищается!); по умолчанию fakeredis')
+    parser.add_argument('--schema', default='bench_web')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='не удалять схему с данными после замера')
+    parser.add_argument('--save-baseline', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='сравнить с сохранёнными результатами')
+    parser.add_argument('--tolerance', type=float, default=20, help='допустимое ухудшение p95, %%')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('DATABASE_URL не задан')
+    random.seed(args.seed)
+    fake_server = None
+    if args.redis_url:
+        redis_url = args.redis_url
+        import redis
+        redis.from_url(redis_url).flushdb()
+    else:
+        fake_server, redis_url = start_fake_redis()
+    # Все соединения приложения (libpq читает PGOPTIONS) работают в отдельной схеме
+    os.environ.update({
+        'PGOPTIONS': f"-c search_path={args.schema},public",
+        'REDIS_URL': redis_url,
+        'TRUSTED_PROXY_HOPS': '1',
+        'REQUEST_TIMING_LOG_MS': '100000',
+    })
+    os.environ.pop('TELEGRAM_TOKEN', None)
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+    import psycopg2
+    import logging
+    logging.disable(logging.WARNING)
+    admin_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    admin_conn.autocommit = True
+    admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE; CREATE SCHEMA {args.schema}")
+    proc = None
+    try:
+        import database
+        database.init_db()
+        conn = database.get_db_connection()
+        started = time.perf_counter()
+        seed(conn, args.items, args.comments, args.reactions)
+        conn.close()
+        print(f"Создано по {args.items} элементов, {args.comments} комментариев и {args.reactions} реакций "
+              f"на элемент за {time.perf_counter() - started:.1f} с\n")
+        print(HEADER)
+
+        results = {}
+        if args.mode in ('client', 'both'):
+            results['client'] = run_client(args.scenarios, args.items, args.requests, args.warmup, args.seed)
+        if args.mode in ('gunicorn', 'both'):
+            proc, base = start_gunicorn(dict(os.environ), args.workers, args.threads)
+            results['gunicorn'] = run_gunicorn(args.scenarios, args.items, args.requests, args.warmup,
+                                               args.seed, base, args.concurrency)
+
+        if args.save_baseline:
+            meta = {
+                'created': time.strftime('%Y-%m-%d %H:%M'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'redis': 'fakeredis' if fake_server else 'redis',
+            }
+            meta.update({k: getattr(args, k) for k in ('items', 'comments', 'reactions', 'requests',
+                                                        'workers', 'threads', 'concurrency', 'seed')})
+            os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+            print(f"\nБазовый замер сохранён: {args.save_baseline}")
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            if regressions:
+                print('\nРегрессии:\n  ' + '\n  '.join(regressions))
+                sys.exit(1)
+            print('\nРегрессий нет')
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(10)
+        if fake_server:
+            fake_server.shutdown()
+        if not args.keep:
+            admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        admin_conn.close()
+
+
+if __name__ == '__main__':
+    main()
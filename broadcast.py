@@ -0,0 +1,160 @@
+# broadcast.py
+# Рассылка уведомлений о новом контенте подписчикам.
+# Работает в фоновом потоке, соблюдает лимиты Telegram и продолжает рассылку после сбоя.
+import os
+import time
+import logging
+import threading
+from telegram.error import RetryAfter, Unauthorized, BadRequest, TimedOut, NetworkError
+from database import (
+    claim_broadcast, get_subscribers_batch, update_broadcast_progress,
+    extend_broadcast_lease, set_user_notifications
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))       # сообщений в секунду на весь бот (лимит Telegram ~30)
+BROADCAST_PER_CHAT_INTERVAL = 1.0                                   # не чаще 1 сообщения в секунду в один чат
+BROADCAST_BATCH = int(os.environ.get('BROADCAST_BATCH', 100))      # подписчиков за один запрос к БД
+BROADCAST_LEASE = 120                                               # секунд владения рассылкой без отметки прогресса
+BROADCAST_POLL_INTERVAL = 10                                        # как часто проверять новые рассылки
+MAX_SEND_ATTEMPTS = 3                                               # попыток при ошибках сети (429 не считается)
+MAX_FLOOD_WAITS = 10                                                # ответов 429 на одно сообщение, потом пропускаем
+
+
+class RateLimiter:
+    """Token bucket на весь бот плюс минимальный интервал между сообщениями в один чат"""
+
+    def __init__(self, rate=BROADCAST_RATE, per_chat_interval=BROADCAST_PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.per_chat_interval = per_chat_interval
+        self.updated = time.monotonic()
+        self.last_chat_send = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, chat_id):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                chat_wait = self.last_chat_send.get(chat_id, 0) + self.per_chat_interval - now
+                if self.tokens >= 1 and chat_wait <= 0:
+                    self.tokens -= 1
+                    self.last_chat_send[chat_id] = now
+                    if len(self.last_chat_send) > 10000:
+                        self._prune(now)
+                    return
+                wait = max(chat_wait, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """После 429 от Telegram останавливаем все отправки на retry_after"""
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic() + seconds
+
+    def _prune(self, now):
+        self.last_chat_send = {
+            chat: ts for chat, ts in self.last_chat_send.items()
+            if now - ts < self.per_chat_interval
+        }
+
+
+class Broadcaster:
+    """
+    Фоновый обработчик очереди рассылок (таблица broadcasts).
+    send_func(chat_id, broadcast) отправляет одно сообщение.
+    """
+
+    def __init__(self, send_func, limiter=None):
+        self.send_func = send_func
+        self.limiter = limiter or RateLimiter()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='broadcaster', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            logger.info("[BROADCAST] Фоновая рассылка запущена")
+
+    def _run(self):
+        while True:
+            try:
+                broadcast = claim_broadcast(BROADCAST_LEASE)
+                if broadcast:
+                    self.process(broadcast)
+                    continue
+            except Exception as e:
+                logger.error(f"[BROADCAST] Ошибка обработки очереди рассылок: {e}", exc_info=True)
+            time.sleep(BROADCAST_POLL_INTERVAL)
+
+    def process(self, broadcast):
+        broadcast_id = broadcast['id']
+        cursor = broadcast['last_user_id']
+        logger.info(f"[BROADCAST] Рассылка {broadcast_id} ({broadcast['item_type']}/{broadcast['item_id']}) с users.id > {cursor}")
+        while True:
+            batch = get_subscribers_batch(cursor, BROADCAST_BATCH)
+            if not batch:
+                update_broadcast_progress(broadcast_id, cursor, 0, 0, 0, BROADCAST_LEASE, done=True)
+                logger.info(f"[BROADCAST] Рассылка {broadcast_id} завершена")
+                return
+            sent = failed = blocked = 0
+            for user_id, chat_id in batch:
+                result = self._send(chat_id, broadcast)
+                if result == 'sent':
+                    sent += 1
+                elif result == 'blocked':
+                    blocked += 1
+                else:
+                    failed += 1
+                cursor = user_id
+            # Прогресс фиксируется после каждой пачки: после сбоя продолжим с этого места
+            update_broadcast_progress(broadcast_id, cursor, sent, failed, blocked, BROADCAST_LEASE)
+
+    def _send(self, chat_id, broadcast):
+        attempt = floods = 0
+        while True:
+            self.limiter.acquire(chat_id)
+            try:
+                self.send_func(chat_id, broadcast)
+                return 'sent'
+            except RetryAfter as e:
+                # Telegram просит подождать: сообщение не потеряно, повторяем после паузы.
+                # Блокировку продлеваем до паузы, иначе за время ожидания рассылку заберёт
+                # другой воркер и повторит текущую пачку
+                floods += 1
+                if floods > MAX_FLOOD_WAITS:
+                    logger.error(f"[BROADCAST] {chat_id}: {floods - 1} ответов 429 подряд, сообщение не отправлено")
+                    return 'failed'
+                logger.warning(f"[BROADCAST] Flood control, пауза {e.retry_after} сек")
+                try:
+                    extend_broadcast_lease(broadcast['id'], BROADCAST_LEASE + e.retry_after)
+                except Exception as lease_error:
+                    logger.warning(f"[BROADCAST] Не удалось продлить блокировку рассылки {broadcast['id']}: {lease_error}")
+                self.limiter.pause(e.retry_after)
+            except Unauthorized:
+                # Пользователь заблокировал бота: больше не пишем ему
+                try:
+                    set_user_notifications(chat_id, False)
+                except Exception as e:
+                    logger.warning(f"[BROADCAST] Не удалось отписать {chat_id}: {e}")
+                return 'blocked'
+            except BadRequest as e:
+                logger.warning(f"[BROADCAST] Сообщение для {chat_id} отклонено: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                attempt += 1
+                logger.warning(f"[BROADCAST] Ошибка сети при отправке {chat_id} (попытка {attempt}): {e}")
+                if attempt >= MAX_SEND_ATTEMPTS:
+                    logger.error(f"[BROADCAST] {chat_id}: сообщение не отправлено после {attempt} попыток")
+                    return 'failed'
+                time.sleep(attempt)
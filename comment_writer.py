@@ -0,0 +1,136 @@
+# comment_writer.py
+# Буферизованная запись комментариев: API кладёт комментарий в очередь Redis и сразу отвечает,
+# фоновый поток пачками вставляет очередь в PostgreSQL (execute_values).
+# У каждого комментария есть request_id: после сбоя необработанная пачка повторяется,
+# а повторная вставка отбрасывается уникальным индексом.
+# Если БД отвергает пачку из-за данных, строки пишутся по одной, а отвергнутые уходят
+# в список comments_dead — иначе одна плохая строка навсегда остановила бы очередь.
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+COMMENT_FLUSH_INTERVAL = float(os.environ.get('COMMENT_FLUSH_INTERVAL', 1))  # сек между сбросами в БД
+COMMENT_FLUSH_BATCH = int(os.environ.get('COMMENT_FLUSH_BATCH', 200))
+FLUSH_LOCK_TTL = 60
+DEAD_LETTER_LIMIT = 1000   # Сколько последних отвергнутых комментариев хранить для разбора
+
+PENDING_KEY = 'comments_pending'        # Комментарии, ещё не записанные в БД
+PROCESSING_KEY = 'comments_processing'  # Пачка, которую сейчас пишет сборщик
+DEAD_KEY = 'comments_dead'              # Комментарии, которые БД не приняла
+LOCK_KEY = 'comments_flush_lock'
+
+# KEYS: pending, processing; ARGV: batch size
+# Если предыдущая пачка не дописана (сборщик упал), сначала возвращаем её
+_CLAIM_SCRIPT = """
+if redis.call('llen', KEYS[2]) > 0 then return redis.call('lrange', KEYS[2], 0, -1) end
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('rpush', KEYS[2], unpack(items))
+    redis.call('ltrim', KEYS[1], #items, -1)
+end
+return items
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+class CommentWriter:
+    """
+    save_batch([(request_id, item_type, item_id, user_name, text), ...]) -> вставленные строки (dict);
+    on_saved(rows) — обновление кэшей после записи пачки;
+    row_errors — ошибки save_batch из-за самих данных (повтор не поможет), а не недоступности БД.
+    """
+
+    def __init__(self, redis_client, save_batch, on_saved=None, row_errors=(ValueError,)):
+        self.redis_client = redis_client
+        self.save_batch = save_batch
+        self.on_saved = on_saved
+        self.row_errors = row_errors
+        self._claim = redis_client.register_script(_CLAIM_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, item_type, item_id, user_name, text):
+        """Ставит комментарий в очередь и возвращает его request_id"""
+        self._ensure_started()
+        request_id = uuid.uuid4().hex
+        self.redis_client.rpush(PENDING_KEY, json.dumps([request_id, item_type, item_id, user_name, text]))
+        return request_id
+
+    def start(self):
+        """Запуск при старте приложения: очередь, оставшаяся с прошлого запуска, не ждёт новых комментариев"""
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # Поток запускаем лениво в процессе, который принимает запросы (после fork gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='comment-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            logger.info("[COMMENTS] Фоновая запись комментариев в БД запущена")
+
+    def _run(self):
+        while True:
+            time.sleep(COMMENT_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[COMMENTS] Ошибка записи комментариев в БД: {e}", exc_info=True)
+
+    def flush(self, max_batches=20):
+        """Переносит очередь в БД. Возвращает число вставленных комментариев."""
+        token = uuid.uuid4().hex
+        if not self.redis_client.set(LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_TTL):
+            return 0  # Сбросом занимается другой воркер
+        written = 0
+        try:
+            for _ in range(max_batches):
+                items = self._claim(keys=[PENDING_KEY, PROCESSING_KEY], args=[COMMENT_FLUSH_BATCH])
+                if not items:
+                    break
+                try:
+                    saved = self.save_batch([tuple(json.loads(item)) for item in items])
+                except self.row_errors as e:
+                    logger.warning(f"[COMMENTS] Пачка из {len(items)} комментариев отвергнута ({e}), пишем по одному")
+                    saved = self._save_one_by_one(items)
+                self.redis_client.delete(PROCESSING_KEY)
+                written += len(saved)
+                if saved and self.on_saved:
+                    try:
+                        self.on_saved(saved)
+                    except Exception as e:
+                        logger.warning(f"[COMMENTS] Не удалось обновить кэш комментариев: {e}")
+        finally:
+            self._release(keys=[LOCK_KEY], args=[token])
+        if written:
+            logger.info(f"[COMMENTS] В БД записано {written} комментариев")
+        return written
+
+    def _save_one_by_one(self, items):
+        """Вставляет строки пачки по одной; отвергнутые БД переносятся в DEAD_KEY"""
+        saved = []
+        for item in items:
+            try:
+                saved.extend(self.save_batch([tuple(json.loads(item))]))
+            except self.row_errors as e:
+                logger.error(f"[COMMENTS] Комментарий не записан и перенесён в {DEAD_KEY}: {e}; {item[:500]!r}")
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.rpush(DEAD_KEY, item)
+                pipe.ltrim(DEAD_KEY, -DEAD_LETTER_LIMIT, -1)
+                pipe.execute()
+        return saved
@@ -0,0 +1,64 @@
+# conversation_state.py
+# Состояние диалогов бота (например, /add_video -> ожидание ссылки или файла).
+# Хранится в Redis с TTL, чтобы шаги диалога работали в любом воркере/инстансе.
+import os
+import json
+import logging
+import threading
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TTL = int(os.environ.get('CONVERSATION_TTL', 900))  # 15 минут на ответ пользователя
+
+
+class ConversationStore:
+    """Словарь user_id -> данные шага диалога с истечением по TTL"""
+
+    def __init__(self, redis_client=None, namespace='conv', ttl=CONVERSATION_TTL):
+        self.redis_client = redis_client
+        self.namespace = namespace
+        self.ttl = ttl
+        # Без Redis работает только в пределах одного процесса
+        self._local = TTLCache(maxsize=10000, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def _key(self, user_id):
+        return f"{self.namespace}_{user_id}"
+
+    def set(self, user_id, data):
+        if self.redis_client:
+            try:
+                self.redis_client.set(self._key(user_id), json.dumps(data), ex=self.ttl)
+                return
+            except Exception as e:
+                logger.warning(f"[CONV] Ошибка записи состояния в Redis: {e}")
+        with self._lock:
+            self._local[user_id] = data
+
+    def get(self, user_id):
+        if self.redis_client:
+            try:
+                raw = self.redis_client.get(self._key(user_id))
+                return json.loads(raw) if raw else None
+            except Exception as e:
+                logger.warning(f"[CONV] Ошибка чтения состояния из Redis: {e}")
+        with self._lock:
+            return self._local.get(user_id)
+
+    def pop(self, user_id):
+        """Атомарно забирает состояние: следующий шаг обработает только один воркер"""
+        if self.redis_client:
+            try:
+                pipe = self.redis_client.pipeline(transaction=True)
+                pipe.get(self._key(user_id))
+                pipe.delete(self._key(user_id))
+                raw, _ = pipe.execute()
+                return json.loads(raw) if raw else None
+            except Exception as e:
+                logger.warning(f"[CONV] Ошибка чтения состояния из Redis: {e}")
+        with self._lock:
+            return self._local.pop(user_id, None)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
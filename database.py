@@ -1,24 +1,92 @@
 # database.py
 import psycopg2
 import os
+import time
 from datetime import datetime
 import bcrypt
 import json
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import logging
+from request_timing import span
+from metrics import DB_CONNECTIONS_OPEN, DB_CONNECT_SECONDS, DB_QUERY_SECONDS
+from query_profiler import QueryProfiler
 
 # --- Logging ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Рассылка уведомлений о новом контенте подписчикам (см. broadcast.py)
+BROADCAST_ENABLED = os.environ.get('BROADCAST_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
 # ---------------- Подключение к БД ----------------
+# Профилировщик запросов (QUERY_PROFILER=1): статистика по отпечаткам, EXPLAIN медленных запросов
+query_profiler = QueryProfiler()
+
+class TimedCursor(RealDictCursor):
+    """Время запросов попадает в участок 'db' текущего HTTP-запроса (request_timing.py), в /metrics
+    и в профилировщик запросов"""
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        with span('db'):
+            result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        DB_QUERY_SECONDS.observe(elapsed)
+        if query_profiler.enabled:
+            query_profiler.record(self, query, vars, elapsed)
+        return result
+
+    def executemany(self, query, vars_list):
+        with span('db'), DB_QUERY_SECONDS.time():
+            return super().executemany(query, vars_list)
+
+class TrackedConnection(psycopg2.extensions.connection):
+    """Считает открытые соединения (db_connections_open в /metrics)"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counted = True
+        DB_CONNECTIONS_OPEN.inc()
+
+    def _uncount(self):
+        if getattr(self, '_counted', False):
+            self._counted = False
+            DB_CONNECTIONS_OPEN.dec()
+
+    def close(self):
+        self._uncount()
+        super().close()
+
+    def __del__(self):
+        # Соединение, которое не закрыли явно, закрывается сборщиком мусора
+        self._uncount()
+
 def get_db_connection():
     database_url = os.environ.get('DATABASE_URL')
     if not database_url:
         raise Exception("DATABASE_URL environment variable is not set")
-    conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    with span('db-connect'), DB_CONNECT_SECONDS.time():
+        conn = psycopg2.connect(database_url, connection_factory=TrackedConnection, cursor_factory=TimedCursor)
     return conn
 
+# ---------------- Полнотекстовый поиск ----------------
+# Таблица -> столбец с основным текстом (название ищется всегда)
+SEARCH_TABLES = {'moments': 'description', 'trailers': 'description', 'news': 'text'}
+# Маркеры подсветки: не встречаются в тексте, в HTML заменяются на <mark> после экранирования
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+def _search_vector_sql(body_column):
+    """Название весит больше текста; русская и английская конфигурации"""
+    return (
+        "setweight(to_tsvector('russian', COALESCE(title, '')), 'A') || "
+        "setweight(to_tsvector('english', COALESCE(title, '')), 'A') || "
+        f"setweight(to_tsvector('russian', COALESCE({body_column}, '')), 'B') || "
+        f"setweight(to_tsvector('english', COALESCE({body_column}, '')), 'B')"
+    )
+
+def _row_values(row):
+    # search_vector нужен только для поиска: не тянем его в кортежи и кэш
+    return tuple(v for k, v in row.items() if k != 'search_vector')
+
 # ---------------- Инициализация БД ----------------
 def init_db():
     conn = get_db_connection()
@@ -128,6 +196,76 @@ def init_db():
             )
         """)
         # --- КОНЕЦ НОВОЙ ТАБЛИЦЫ ---
+        # --- НОВОЕ: HLS-плейлист для видео (заполняется после транскодирования) ---
+        c.execute("ALTER TABLE moments ADD COLUMN IF NOT EXISTS hls_url TEXT")
+        c.execute("ALTER TABLE trailers ADD COLUMN IF NOT EXISTS hls_url TEXT")
+        # --- НОВОЕ: Подписка на уведомления и очередь рассылок ---
+        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS notifications_enabled BOOLEAN DEFAULT FALSE")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_users_notifications ON users (id) WHERE notifications_enabled")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                item_type TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', -- pending / running / done
+                last_user_id INTEGER NOT NULL DEFAULT 0, -- курсор по users.id для продолжения после сбоя
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                locked_until TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status, id)")
+        # --- НОВОЕ: Триграммные индексы для поиска по подстроке (inline-режим бота) ---
+        # Расширение может быть недоступно без прав суперпользователя: тогда поиск работает без индекса
+        c.execute("SAVEPOINT trgm")
+        try:
+            c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for table in ('moments', 'trailers'):
+                c.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{table}_search_trgm ON {table}
+                    USING GIN ((title || ' ' || COALESCE(description, '')) gin_trgm_ops)
+                """)
+            c.execute("RELEASE SAVEPOINT trgm")
+        except psycopg2.Error as e:
+            c.execute("ROLLBACK TO SAVEPOINT trgm")
+            logger.warning(f"pg_trgm недоступен, inline-поиск без индекса: {e}")
+        # --- НОВОЕ: Полнотекстовый поиск (сгенерированный tsvector + GIN, PostgreSQL 12+) ---
+        c.execute("SAVEPOINT fts")
+        try:
+            for table, body in SEARCH_TABLES.items():
+                c.execute(f"""
+                    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+                    GENERATED ALWAYS AS ({_search_vector_sql(body)}) STORED
+                """)
+                c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_search_vector ON {table} USING GIN (search_vector)")
+            c.execute("RELEASE SAVEPOINT fts")
+        except psycopg2.Error as e:
+            c.execute("ROLLBACK TO SAVEPOINT fts")
+            logger.error(f"Не удалось создать столбцы полнотекстового поиска: {e}")
+        # --- НОВОЕ: Кэш метаданных по ссылкам (/api/search_film_by_link) ---
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS link_metadata (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                metadata TEXT NOT NULL, -- JSON от yt-dlp (название, длительность, превью, описание)
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # --- НОВОЕ: Индексы под сортировки комментариев (keyset-пагинация) ---
+        # Раньше комментарии могли сохраняться с типом в единственном числе
+        c.execute("UPDATE comments SET item_type = item_type || 's' WHERE item_type IN ('moment', 'trailer')")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_comments_new ON comments (item_type, item_id, created_at DESC, id DESC)")
+        # --- НОВОЕ: Идентификатор запроса для идемпотентной пакетной вставки (comment_writer.py) ---
+        c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS request_id TEXT")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_comments_request_id ON comments (request_id)")
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_comments_popular
+            ON comments (item_type, item_id, (likes - dislikes) DESC, id DESC)
+        """)
 
         # Админ по умолчанию
         password_hash = bcrypt.hashpw('admin'.encode('utf-8'), bcrypt.gensalt())
@@ -174,7 +312,7 @@ def get_all_items(item_type):
         # --- УЛУЧШЕНИЕ: Добавлены индексы и ограничения ---
         c.execute(f"SELECT * FROM {item_type} ORDER BY created_at DESC LIMIT 100")  # Ограничиваем количество
         items = c.fetchall()
-        return [tuple(i.values()) for i in items]
+        return [_row_values(i) for i in items]
     finally:
         conn.close()
 
@@ -184,7 +322,7 @@ def get_item_by_id(item_type, item_id):
     try:
         c.execute(f"SELECT * FROM {item_type} WHERE id=%s", (item_id,))
         row = c.fetchone()
-        return tuple(row.values()) if row else None
+        return _row_values(row) if row else None
     finally:
         conn.close()
 
@@ -201,6 +339,143 @@ def delete_item(item_type, item_id):
     finally:
         conn.close()
 
+# --- НОВОЕ: Постановка рассылки в той же транзакции, что и добавление контента ---
+def _enqueue_broadcast(c, item_type, item_id, title):
+    if BROADCAST_ENABLED:
+        c.execute("INSERT INTO broadcasts (item_type, item_id, title) VALUES (%s,%s,%s)", (item_type, item_id, title))
+
+# Обработчики, вызываемые после фиксации нового элемента: handler(item_type, item_id, title)
+ITEM_ADDED_HANDLERS = []
+
+def _item_added(item_type, item_id, title):
+    for handler in ITEM_ADDED_HANDLERS:
+        try:
+            handler(item_type, item_id, title)
+        except Exception as e:
+            logger.warning(f"Ошибка обработчика нового элемента {item_type}/{item_id}: {e}")
+# --- КОНЕЦ НОВОГО ---
+
+# --- НОВОЕ: Поиск по названию/описанию для inline-режима бота ---
+def search_videos(query, limit=20, offset=0):
+    """
+    Моменты и трейлеры, где query встречается в названии или описании.
+    Совпадения в названии выше, затем более новые. ILIKE использует триграммный индекс.
+    """
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT * FROM (
+                SELECT 'moments' AS item_type, id, title, description, preview_url, created_at,
+                       title ILIKE %(p)s AS title_match
+                FROM moments WHERE (title || ' ' || COALESCE(description, '')) ILIKE %(p)s
+                UNION ALL
+                SELECT 'trailers' AS item_type, id, title, description, preview_url, created_at,
+                       title ILIKE %(p)s AS title_match
+                FROM trailers WHERE (title || ' ' || COALESCE(description, '')) ILIKE %(p)s
+            ) found
+            ORDER BY title_match DESC, created_at DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {'p': pattern, 'limit': limit, 'offset': offset})
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+# --- КОНЕЦ НОВОГО ---
+
+def search_content(query, limit=20, offset=0):
+    """
+    Полнотекстовый поиск по моментам, трейлерам и новостям.
+    Возвращает (результаты по убыванию релевантности, общее число найденных).
+    Фрагменты (ts_headline) строятся только для строк текущей страницы.
+    """
+    union = " UNION ALL ".join(
+        f"SELECT '{table}' AS item_type, id, title, {body} AS body, created_at, "
+        f"ts_rank_cd(search_vector, q.query) AS rank "
+        f"FROM {table}, q WHERE search_vector @@ q.query"
+        for table, body in SEARCH_TABLES.items()
+    )
+    markers = f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}"'
+    title_options = f"{markers}, HighlightAll=true"
+    body_options = f'{markers}, MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" … "'
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f"""
+            WITH q AS (
+                SELECT websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('english', %(q)s) AS query
+            ),
+            page AS (
+                SELECT *, COUNT(*) OVER () AS total FROM ({union}) found
+                ORDER BY rank DESC, created_at DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            )
+            SELECT page.item_type, page.id, page.total, page.rank,
+                   ts_headline('russian', page.title, q.query, %(title_opts)s) AS title_hl,
+                   ts_headline('russian', COALESCE(page.body, ''), q.query, %(body_opts)s) AS body_hl
+            FROM page, q
+            ORDER BY page.rank DESC, page.created_at DESC
+        """, {'q': query, 'limit': limit, 'offset': offset,
+              'title_opts': title_options, 'body_opts': body_options})
+        rows = [dict(r) for r in c.fetchall()]
+        total = rows[0]['total'] if rows else 0
+        return rows, total
+    finally:
+        conn.close()
+
+def find_similar_content(text, limit=5):
+    """
+    Контент, похожий на произвольный текст (например, название ролика по ссылке).
+    В отличие от search_content достаточно совпадения любого слова; лучшие совпадения первыми.
+    """
+    union = " UNION ALL ".join(
+        f"SELECT '{table}' AS item_type, id, title, ts_rank_cd(search_vector, q.query) AS rank "
+        f"FROM {table}, q WHERE search_vector @@ q.query"
+        for table in SEARCH_TABLES
+    )
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f"""
+            WITH q AS (
+                SELECT replace(plainto_tsquery('russian', %(t)s)::text, '&', '|')::tsquery ||
+                       replace(plainto_tsquery('english', %(t)s)::text, '&', '|')::tsquery AS query
+            )
+            SELECT * FROM ({union}) found
+            ORDER BY rank DESC
+            LIMIT %(limit)s
+        """, {'t': text, 'limit': limit})
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+# ---------------- Кэш метаданных по ссылкам ----------------
+def get_link_metadata(url_hash, max_age_days=30):
+    """Сохранённые метаданные ссылки (dict) или None, если их нет или они устарели"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT metadata FROM link_metadata
+            WHERE url_hash=%s AND updated_at > NOW() - %s * INTERVAL '1 day'
+        """, (url_hash, max_age_days))
+        row = c.fetchone()
+        return json.loads(row['metadata']) if row else None
+    finally:
+        conn.close()
+
+def save_link_metadata(url_hash, url, metadata):
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO link_metadata (url_hash, url, metadata) VALUES (%s, %s, %s)
+            ON CONFLICT (url_hash) DO UPDATE SET metadata=EXCLUDED.metadata, updated_at=NOW()
+        """, (url_hash, url, json.dumps(metadata, ensure_ascii=False)))
+        conn.commit()
+    finally:
+        conn.close()
+
 # ---------------- Моменты ----------------
 # --- ИЗМЕНЕНИЕ: Функция add_moment обновлена для preview_url ---
 def add_moment(title, description, video_url, preview_url=None):
@@ -208,9 +483,13 @@ def add_moment(title, description, video_url, preview_url=None):
     c = conn.cursor()
     try:
         # ВАЖНО: Обновлен SQL-запрос, добавлен preview_url
-        c.execute("INSERT INTO moments (title, description, video_url, preview_url) VALUES (%s,%s,%s,%s)", (title, description, video_url, preview_url))
+        c.execute("INSERT INTO moments (title, description, video_url, preview_url) VALUES (%s,%s,%s,%s) RETURNING id", (title, description, video_url, preview_url))
+        item_id = c.fetchone()['id']
+        _enqueue_broadcast(c, 'moments', item_id, title)
         conn.commit()
+        _item_added('moments', item_id, title)
         logger.info(f"Момент '{title}' добавлен в БД (с превью: {preview_url is not None}).")
+        return item_id
     finally:
         conn.close()
 # --- КОНЕЦ ИЗМЕНЕНИЯ ---
@@ -222,20 +501,42 @@ def add_trailer(title, description, video_url, preview_url=None):
     c = conn.cursor()
     try:
         # ВАЖНО: Обновлен SQL-запрос, добавлен preview_url
-        c.execute("INSERT INTO trailers (title, description, video_url, preview_url) VALUES (%s,%s,%s,%s)", (title, description, video_url, preview_url))
+        c.execute("INSERT INTO trailers (title, description, video_url, preview_url) VALUES (%s,%s,%s,%s) RETURNING id", (title, description, video_url, preview_url))
+        item_id = c.fetchone()['id']
+        _enqueue_broadcast(c, 'trailers', item_id, title)
         conn.commit()
+        _item_added('trailers', item_id, title)
         logger.info(f"Трейлер '{title}' добавлен в БД (с превью: {preview_url is not None}).")
+        return item_id
     finally:
         conn.close()
 # --- КОНЕЦ ИЗМЕНЕНИЯ ---
 
+# --- НОВОЕ: Сохранение HLS-плейлиста после транскодирования ---
+def set_hls_url(item_type, item_id, hls_url):
+    """Записывает URL master-плейлиста HLS для момента или трейлера"""
+    if item_type not in ('moments', 'trailers'):
+        raise ValueError(f"HLS не поддерживается для {item_type}")
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f"UPDATE {item_type} SET hls_url=%s WHERE id=%s", (hls_url, item_id))
+        conn.commit()
+    finally:
+        conn.close()
+# --- КОНЕЦ НОВОГО ---
+
 # ---------------- Новости ----------------
 def add_news(title, text, image_url=None):
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        c.execute("INSERT INTO news (title, text, image_url) VALUES (%s,%s,%s)", (title, text, image_url))
+        c.execute("INSERT INTO news (title, text, image_url) VALUES (%s,%s,%s) RETURNING id", (title, text, image_url))
+        item_id = c.fetchone()['id']
+        _enqueue_broadcast(c, 'news', item_id, title)
         conn.commit()
+        _item_added('news', item_id, title)
+        return item_id
     finally:
         conn.close()
 
@@ -251,6 +552,7 @@ def add_news_with_blocks(title, blocks):
                 (news_id, block['type'], block['content'], block['position'])
             )
         conn.commit()
+        _item_added('news', news_id, title)
         return news_id
     finally:
         conn.close()
@@ -287,6 +589,39 @@ def get_comments(item_type, item_id):
     finally:
         conn.close()
 
+# Сортировки комментариев: выражение ключа должно совпадать с индексами idx_comments_*
+COMMENT_SORTS = {
+    'new': 'created_at',
+    'popular': '(likes - dislikes)',
+}
+
+def get_comments_page(item_type, item_id, sort='new', limit=20, after=None):
+    """
+    Страница комментариев по убыванию ключа сортировки.
+    after — (ключ, id) последнего комментария предыдущей страницы (keyset, без OFFSET).
+    Каждая строка содержит sort_key для построения следующего курсора.
+    """
+    sort_key = COMMENT_SORTS[sort]
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        params = [item_type, item_id]
+        keyset = ""
+        if after is not None:
+            keyset = f"AND ({sort_key}, id) < (%s, %s)"
+            params.extend(after)
+        params.append(limit)
+        c.execute(f"""
+            SELECT id, user_name, text, created_at, likes, dislikes, {sort_key} AS sort_key
+            FROM comments
+            WHERE item_type=%s AND item_id=%s {keyset}
+            ORDER BY {sort_key} DESC, id DESC
+            LIMIT %s
+        """, params)
+        return [dict(row) for row in c.fetchall()]
+    finally:
+        conn.close()
+
 def add_comment(item_type, item_id, user_name, text):
     conn = get_db_connection()
     c = conn.cursor()
@@ -296,66 +631,119 @@ def add_comment(item_type, item_id, user_name, text):
     finally:
         conn.close()
 
+# Ошибки пакетной вставки из-за данных строки (NUL в тексте, число вне диапазона INTEGER,
+# ключ длиннее предела индекса и т. п.): повтор той же пачки не поможет, сборщики пишут такие пачки по одной строке
+ROW_ERRORS = (ValueError, psycopg2.DataError, psycopg2.IntegrityError, psycopg2.errors.ProgramLimitExceeded)
+
+def add_comments_bulk(rows, page_size=500):
+    """
+    Пакетная вставка [(request_id, item_type, item_id, user_name, text), ...].
+    Уже записанные request_id пропускаются; возвращает только вставленные строки.
+    """
+    if not rows:
+        return []
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        inserted = execute_values(c, """
+            INSERT INTO comments (request_id, item_type, item_id, user_name, text)
+            VALUES %s
+            ON CONFLICT (request_id) DO NOTHING
+            RETURNING id, request_id, item_type, item_id, user_name, text, created_at, likes, dislikes
+        """, rows, page_size=page_size, fetch=True)
+        conn.commit()
+        return [dict(row) for row in inserted]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_comments_counts(item_type, item_ids):
+    """Число комментариев для списка элементов одним запросом: {item_id: count}"""
+    if not item_ids:
+        return {}
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT item_id, COUNT(*) AS count FROM comments
+            WHERE item_type=%s AND item_id = ANY(%s)
+            GROUP BY item_id
+        """, (item_type, list(item_ids)))
+        counts = {item_id: 0 for item_id in item_ids}
+        counts.update({row['item_id']: row['count'] for row in c.fetchall()})
+        return counts
+    finally:
+        conn.close()
+
 # --- НОВАЯ ФУНКЦИЯ: Реакции на комментарии ---
-def add_comment_reaction(comment_id, user_id, reaction_type):
-    """Добавляет реакцию (лайк/дизлайк) к комментарию"""
+# Переключение реакции одним запросом: удаляем существующую реакцию, иначе вставляем новую,
+# и сдвигаем счётчик комментария на разницу. Все части выполняются в одном снимке, а строка
+# комментария блокируется UPDATE, поэтому одновременные нажатия не рассинхронизируют счётчики.
+COMMENT_REACTIONS = ('like', 'dislike')
+
+def toggle_comment_reaction(comment_id, user_id, reaction_type):
+    """
+    Ставит или снимает реакцию пользователя на комментарий.
+    Возвращает dict(added, likes, dislikes, item_type, item_id) или None, если комментария нет.
+    """
+    if reaction_type not in COMMENT_REACTIONS:
+        raise ValueError(f"Неизвестная реакция: {reaction_type}")
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        # Проверяем, существует ли уже такая реакция
         c.execute("""
-            SELECT id FROM comment_reactions 
-            WHERE comment_id=%s AND user_id=%s AND reaction_type=%s
-        """, (comment_id, user_id, reaction_type))
-        
-        existing = c.fetchone()
-        
-        if existing:
-            # Если реакция уже есть, удаляем её (отменяем)
-            c.execute("""
-                DELETE FROM comment_reactions 
-                WHERE comment_id=%s AND user_id=%s AND reaction_type=%s
-            """, (comment_id, user_id, reaction_type))
-            
-            # Обновляем счетчики в таблице comments
-            if reaction_type == 'like':
-                c.execute("""
-                    UPDATE comments SET likes = GREATEST(0, likes - 1) 
-                    WHERE id=%s
-                """, (comment_id,))
-            else:  # dislike
-                c.execute("""
-                    UPDATE comments SET dislikes = GREATEST(0, dislikes - 1) 
-                    WHERE id=%s
-                """, (comment_id,))
-                
-            conn.commit()
-            return False  # Реакция удалена
-        else:
-            # Если реакции нет, добавляем её
-            c.execute("""
-                INSERT INTO comment_reactions (comment_id, user_id, reaction_type) 
-                VALUES (%s, %s, %s)
-            """, (comment_id, user_id, reaction_type))
-            
-            # Обновляем счетчики в таблице comments
-            if reaction_type == 'like':
-                c.execute("""
-                    UPDATE comments SET likes = likes + 1 
-                    WHERE id=%s
-                """, (comment_id,))
-            else:  # dislike
-                c.execute("""
-                    UPDATE comments SET dislikes = dislikes + 1 
-                    WHERE id=%s
-                """, (comment_id,))
-                
-            conn.commit()
-            return True  # Реакция добавлена
-    except Exception as e:
+            WITH removed AS (
+                DELETE FROM comment_reactions
+                WHERE comment_id=%(comment_id)s AND user_id=%(user_id)s AND reaction_type=%(reaction)s
+                RETURNING 1
+            ), added AS (
+                INSERT INTO comment_reactions (comment_id, user_id, reaction_type)
+                SELECT %(comment_id)s, %(user_id)s, %(reaction)s
+                WHERE NOT EXISTS (SELECT 1 FROM removed)
+                  AND EXISTS (SELECT 1 FROM comments WHERE id=%(comment_id)s)
+                ON CONFLICT (comment_id, user_id, reaction_type) DO NOTHING
+                RETURNING 1
+            ), delta AS (
+                SELECT (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed) AS d
+            )
+            UPDATE comments SET
+                likes = GREATEST(0, likes + CASE WHEN %(reaction)s = 'like' THEN delta.d ELSE 0 END),
+                dislikes = GREATEST(0, dislikes + CASE WHEN %(reaction)s = 'dislike' THEN delta.d ELSE 0 END)
+            FROM delta
+            WHERE comments.id=%(comment_id)s
+            RETURNING delta.d > 0 AS added, likes, dislikes, item_type, item_id
+        """, {'comment_id': comment_id, 'user_id': user_id, 'reaction': reaction_type})
+        row = c.fetchone()
+        conn.commit()
+        return dict(row) if row else None
+    except Exception:
         conn.rollback()
-        logger.error(f"Ошибка при добавлении реакции к комментарию: {e}")
-        return False
+        raise
+    finally:
+        conn.close()
+
+def get_comment_reactions_batch(comment_ids, user_id=None):
+    """
+    Счётчики и реакции зрителя для страницы комментариев одним запросом:
+    {comment_id: {'likes': N, 'dislikes': N, 'mine': ['like', ...]}}
+    """
+    if not comment_ids:
+        return {}
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            SELECT c.id, c.likes, c.dislikes,
+                   COALESCE(array_agg(r.reaction_type) FILTER (WHERE r.reaction_type IS NOT NULL), '{}') AS mine
+            FROM comments c
+            LEFT JOIN comment_reactions r ON r.comment_id = c.id AND r.user_id = %s
+            WHERE c.id = ANY(%s)
+            GROUP BY c.id
+        """, (user_id, list(comment_ids)))
+        return {row['id']: {'likes': row['likes'], 'dislikes': row['dislikes'], 'mine': list(row['mine'])}
+                for row in c.fetchall()}
     finally:
         conn.close()
 
@@ -407,24 +795,92 @@ def add_reaction(item_type, item_id, user_id, reaction):
     finally:
         conn.close()
 
+# --- НОВОЕ: Пакетная запись реакций из Redis (см. reaction_counters.py) ---
+def add_reactions_bulk(rows):
+    """rows: [(item_type, item_id, user_id, reaction), ...]. Повторная запись тех же реакций безопасна."""
+    if not rows:
+        return
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        execute_values(c, """
+            INSERT INTO reactions (item_type, item_id, user_id, reaction) VALUES %s
+            ON CONFLICT (item_type, item_id, user_id, reaction) DO NOTHING
+        """, rows, page_size=500)
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_reaction_users(item_type, item_id):
+    """Кто и как реагировал на элемент: {reaction: [user_id, ...]}"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT reaction, user_id FROM reactions WHERE item_type=%s AND item_id=%s", (item_type, item_id))
+        users = {}
+        for r in c.fetchall():
+            users.setdefault(r['reaction'], []).append(r['user_id'])
+        return users
+    finally:
+        conn.close()
+# --- КОНЕЦ НОВОГО ---
+
 # ---------------- Пользователи ----------------
 def get_or_create_user(telegram_id, username=None, first_name=None, last_name=None):
+    """
+    Создаёт пользователя или обновляет имя одним запросом.
+    Строка переписывается только если имя действительно изменилось.
+    """
     conn = get_db_connection()
     c = conn.cursor()
     try:
-        c.execute("SELECT * FROM users WHERE telegram_id=%s", (telegram_id,))
+        c.execute("""
+            WITH upsert AS (
+                INSERT INTO users (telegram_id, username, first_name, last_name, role)
+                VALUES (%(tid)s, %(username)s, %(first_name)s, %(last_name)s, 'user')
+                ON CONFLICT (telegram_id) DO UPDATE
+                SET username=EXCLUDED.username, first_name=EXCLUDED.first_name, last_name=EXCLUDED.last_name
+                WHERE (users.username, users.first_name, users.last_name)
+                      IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.first_name, EXCLUDED.last_name)
+                RETURNING *
+            )
+            SELECT * FROM upsert
+            UNION ALL
+            SELECT * FROM users WHERE telegram_id=%(tid)s AND NOT EXISTS (SELECT 1 FROM upsert)
+        """, {'tid': telegram_id, 'username': username, 'first_name': first_name, 'last_name': last_name})
         user = c.fetchone()
-        if user:
-            c.execute("UPDATE users SET username=%s, first_name=%s, last_name=%s WHERE telegram_id=%s", (username, first_name, last_name, telegram_id))
-            conn.commit()
+        if user is None:
+            # Параллельная вставка того же пользователя: наша ждала конфликта, UPDATE пропущен
+            # (имя не изменилось), а SELECT выше видит снимок до чужого COMMIT — читаем заново
             c.execute("SELECT * FROM users WHERE telegram_id=%s", (telegram_id,))
             user = c.fetchone()
-            return tuple(user.values())
-        else:
-            c.execute("INSERT INTO users (telegram_id, username, first_name, last_name, role) VALUES (%s,%s,%s,%s,%s) RETURNING *", (telegram_id, username, first_name, last_name, 'user'))
-            new_user = c.fetchone()
-            conn.commit()
-            return tuple(new_user.values())
+        conn.commit()
+        return tuple(user.values())
+    finally:
+        conn.close()
+
+def upsert_users(users, page_size=1000):
+    """
+    Массовое добавление/обновление пользователей: [(telegram_id, username, first_name, last_name), ...].
+    Для рассылок и импорта. Возвращает число вставленных или изменённых строк.
+    """
+    # В одной команде ON CONFLICT нельзя дважды задеть одну строку: оставляем последнюю запись
+    unique = {str(u[0]): (str(u[0]), u[1], u[2], u[3], 'user') for u in users}
+    if not unique:
+        return 0
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        rows = execute_values(c, """
+            INSERT INTO users (telegram_id, username, first_name, last_name, role) VALUES %s
+            ON CONFLICT (telegram_id) DO UPDATE
+            SET username=EXCLUDED.username, first_name=EXCLUDED.first_name, last_name=EXCLUDED.last_name
+            WHERE (users.username, users.first_name, users.last_name)
+                  IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.first_name, EXCLUDED.last_name)
+            RETURNING id
+        """, list(unique.values()), page_size=page_size, fetch=True)
+        conn.commit()
+        return len(rows)
     finally:
         conn.close()
 
@@ -439,8 +895,104 @@ def get_user_by_telegram_id(telegram_id):
         conn.close()
 
 def get_user_role(telegram_id):
-    user = get_user_by_telegram_id(telegram_id)
-    return user[5] if user else 'guest'
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT role FROM users WHERE telegram_id=%s", (telegram_id,))
+        row = c.fetchone()
+        return row['role'] if row else 'guest'
+    finally:
+        conn.close()
+
+# --- НОВОЕ: Подписка на уведомления ---
+def set_user_notifications(telegram_id, enabled):
+    """Включает/выключает уведомления. Возвращает False, если пользователя нет."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("UPDATE users SET notifications_enabled=%s WHERE telegram_id=%s", (enabled, telegram_id))
+        conn.commit()
+        return c.rowcount > 0
+    finally:
+        conn.close()
+
+def get_subscribers_batch(after_user_id, limit=100):
+    """Следующая пачка подписчиков после users.id = after_user_id: [(id, telegram_id), ...]"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute(
+            "SELECT id, telegram_id FROM users WHERE notifications_enabled AND id > %s ORDER BY id LIMIT %s",
+            (after_user_id, limit)
+        )
+        return [(r['id'], r['telegram_id']) for r in c.fetchall()]
+    finally:
+        conn.close()
+# --- КОНЕЦ НОВОГО ---
+
+# ---------------- Рассылки ----------------
+def claim_broadcast(lease_seconds=120):
+    """
+    Забирает рассылку в работу: новую или брошенную упавшим воркером (истёк locked_until).
+    SKIP LOCKED не даёт двум воркерам взять одну рассылку.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcasts SET status='running', locked_until=NOW() + %s * INTERVAL '1 second'
+            WHERE id = (
+                SELECT id FROM broadcasts
+                WHERE status='pending' OR (status='running' AND locked_until < NOW())
+                ORDER BY id LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        """, (lease_seconds,))
+        row = c.fetchone()
+        conn.commit()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def update_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked, lease_seconds=120, done=False):
+    """Сохраняет курсор и статистику после пачки и продлевает блокировку"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcasts
+            SET last_user_id=%s, sent=sent+%s, failed=failed+%s, blocked=blocked+%s,
+                locked_until=NOW() + %s * INTERVAL '1 second',
+                status=CASE WHEN %s THEN 'done' ELSE status END,
+                finished_at=CASE WHEN %s THEN NOW() ELSE finished_at END
+            WHERE id=%s
+        """, (last_user_id, sent, failed, blocked, lease_seconds, done, done, broadcast_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def extend_broadcast_lease(broadcast_id, lease_seconds=120):
+    """Продлевает блокировку рассылки без изменения прогресса (долгая пауза внутри пачки)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            UPDATE broadcasts SET locked_until=NOW() + %s * INTERVAL '1 second'
+            WHERE id=%s AND status='running'
+        """, (lease_seconds, broadcast_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_broadcasts(limit=50):
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT %s", (limit,))
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
 
 # ---------------- Настройки доступа ----------------
 def get_access_settings(content_type):
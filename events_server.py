@@ -0,0 +1,174 @@
+# events_server.py
+# Поток Server-Sent Events (/events) с живыми изменениями: новый элемент, реакции, комментарии.
+# Отдельный асинхронный процесс на tornado: тысячи простаивающих соединений не занимают
+# потоки gunicorn. События приходят из канала Redis (live_events.py) — одна подписка на процесс,
+# дальше рассылка по очередям соединений. Изменения реакций склеиваются по элементу.
+#
+# Запуск: python events_server.py  (порт EVENTS_PORT, по умолчанию 8081)
+# Обратный прокси направляет /events сюда, либо клиенту задаётся EVENTS_URL на другой адрес.
+import os
+import json
+import asyncio
+import logging
+import tornado.web
+import tornado.ioloop
+from tornado.iostream import StreamClosedError
+import redis.asyncio as aioredis
+from live_events import EVENTS_CHANNEL, REACTIONS_CHANGED
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+EVENTS_PORT = int(os.environ.get('EVENTS_PORT', 8081))
+EVENTS_MAX_CONNECTIONS = int(os.environ.get('EVENTS_MAX_CONNECTIONS', 10000))
+EVENTS_ALLOW_ORIGIN = os.environ.get('EVENTS_ALLOW_ORIGIN', '*')
+EVENTS_HEARTBEAT = 25          # сек: комментарий-пинг, чтобы прокси не рвали тихое соединение
+EVENTS_RETRY_MS = 5000         # через сколько браузер переподключается после обрыва
+EVENTS_COALESCE_INTERVAL = 1   # сек: реакции одного элемента за это время уходят одним событием
+CLIENT_QUEUE_SIZE = 100        # не успевающий читать клиент отключается
+REDIS_RECONNECT_DELAY = 3
+
+
+class EventHub:
+    """Одна подписка на Redis и рассылка по очередям подключённых клиентов"""
+
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self.clients = set()
+        self._pending_reactions = {}
+        self._next_id = 0
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+
+    def close_client(self, queue):
+        """Будит обработчик соединения, чтобы он завершился (None в очереди)"""
+        self.clients.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def broadcast(self, event):
+        self._next_id += 1
+        message = f"id: {self._next_id}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.info("[EVENTS] Клиент не успевает читать поток, отключаем")
+                self.close_client(queue)
+
+    def dispatch(self, raw):
+        try:
+            event = json.loads(raw)
+        except ValueError:
+            logger.warning(f"[EVENTS] Некорректное событие: {raw[:200]}")
+            return
+        if event.get('type') == REACTIONS_CHANGED:
+            # Важны только последние счётчики: промежуточные значения не рассылаем
+            self._pending_reactions[(event.get('item_type'), event.get('item_id'))] = event
+        else:
+            self.broadcast(event)
+
+    async def flush_reactions(self):
+        while True:
+            await asyncio.sleep(EVENTS_COALESCE_INTERVAL)
+            pending, self._pending_reactions = self._pending_reactions, {}
+            for event in pending.values():
+                self.broadcast(event)
+
+    async def listen(self):
+        while True:
+            client = None
+            try:
+                client = aioredis.from_url(self.redis_url, decode_responses=True)
+                pubsub = client.pubsub()
+                await pubsub.subscribe(EVENTS_CHANNEL)
+                logger.info(f"[EVENTS] Подписка на канал {EVENTS_CHANNEL}")
+                async for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.dispatch(message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[EVENTS] Ошибка подписки на Redis: {e}")
+            finally:
+                if client is not None:
+                    await client.close()
+            await asyncio.sleep(REDIS_RECONNECT_DELAY)
+
+
+class EventsHandler(tornado.web.RequestHandler):
+    def initialize(self, hub):
+        self.hub = hub
+        self.queue = None
+
+    def set_default_headers(self):
+        self.set_header('Access-Control-Allow-Origin', EVENTS_ALLOW_ORIGIN)
+
+    async def get(self):
+        if len(self.hub.clients) >= EVENTS_MAX_CONNECTIONS:
+            self.set_status(503)
+            self.set_header('Retry-After', '30')
+            self.finish()
+            return
+        self.set_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')  # nginx не должен буферизовать поток
+        self.queue = self.hub.subscribe()
+        try:
+            self.write(f"retry: {EVENTS_RETRY_MS}\n\n")
+            await self.flush()
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    message = ": ping\n\n"
+                if message is None:
+                    break
+                self.write(message)
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.hub.unsubscribe(self.queue)
+
+    def on_connection_close(self):
+        if self.queue is not None:
+            self.hub.close_client(self.queue)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, hub):
+        self.hub = hub
+
+    def get(self):
+        self.write({'status': 'ok', 'clients': len(self.hub.clients)})
+
+
+def make_app(hub):
+    return tornado.web.Application([
+        (r'/events', EventsHandler, {'hub': hub}),
+        (r'/events/health', HealthHandler, {'hub': hub}),
+    ])
+
+
+def main():
+    redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    hub = EventHub(redis_url)
+    make_app(hub).listen(EVENTS_PORT, xheaders=True)
+    loop = tornado.ioloop.IOLoop.current()
+    loop.spawn_callback(hub.listen)
+    loop.spawn_callback(hub.flush_reactions)
+    logger.info(f"[EVENTS] Поток /events слушает порт {EVENTS_PORT}")
+    loop.start()
+
+
+if __name__ == '__main__':
+    main()
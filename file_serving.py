@@ -0,0 +1,122 @@
+# file_serving.py
+# Отдача больших файлов с диска (загрузки /uploads): Range, ETag/If-Modified-Since, If-Range.
+# Если перед приложением стоит nginx/Apache, передача файла перекладывается на него
+# (X-Accel-Redirect / X-Sendfile), иначе gunicorn отправляет файл через os.sendfile:
+# ответ — wsgi.file_wrapper над файлом, уже спозиционированным на начало диапазона.
+#
+# FILE_OFFLOAD=x-accel  — nginx; нужен internal location с префиксом FILE_OFFLOAD_PREFIX, например
+#     location /internal/uploads/ { internal; alias /app/uploads/; }
+# FILE_OFFLOAD=x-sendfile — Apache mod_xsendfile / lighttpd (в заголовке абсолютный путь)
+import os
+import mimetypes
+from datetime import datetime, timezone
+from flask import request, Response, abort
+from werkzeug.http import is_resource_modified
+
+# --- Конфигурация ---
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD', '').lower()  # '', 'x-accel' или 'x-sendfile'
+FILE_OFFLOAD_PREFIX = os.environ.get('FILE_OFFLOAD_PREFIX', '/internal/uploads/')
+CHUNK_SIZE = 256 * 1024  # Блок чтения, когда sendfile недоступен
+
+
+def _read_range(f, start, length):
+    """Читает length байт с позиции start (сервер без sendfile или диапазон не до конца файла)"""
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _wrapper_sends_range(environ, start, stop, size):
+    """Отправит ли сервер из wsgi.file_wrapper ровно байты [start, stop) файла, спозиционированного на start"""
+    server = environ.get('SERVER_SOFTWARE', '')
+    if server.startswith('gunicorn/'):
+        # gunicorn шлёт через os.sendfile ровно Content-Length байт, но до 21.0 всегда с начала файла
+        try:
+            major = int(server.split('/', 1)[1].split('.', 1)[0])
+        except ValueError:
+            major = 0
+        return start == 0 or major >= 21
+    # Остальные серверы читают wrapper до конца файла
+    return stop == size
+
+
+def _if_range_matches(etag, mtime):
+    """If-Range: диапазон отдаём, только если файл не изменился с момента первого ответа"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(if_range.date.timestamp()) == int(mtime)
+    return True
+
+
+def _offload(path, relative_path, resp):
+    if FILE_OFFLOAD == 'x-accel':
+        resp.headers['X-Accel-Redirect'] = FILE_OFFLOAD_PREFIX + relative_path
+    else:
+        resp.headers['X-Sendfile'] = os.path.abspath(path)
+    return resp
+
+
+def serve_file(directory, relative_path, max_age, mimetype=None):
+    """
+    Отдаёт directory/relative_path. relative_path должен быть уже проверен (secure_filename/safe_join).
+    Ответ: 200, 206 (один диапазон), 304, 404 или 416.
+    """
+    path = os.path.join(directory, relative_path)
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetype or mimetypes.guess_type(relative_path)[0] or 'application/octet-stream'
+    size = st.st_size
+    etag = f"{st.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+
+    resp = Response(mimetype=mimetype, direct_passthrough=True)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Cache-Control'] = f'public, max-age={max_age}'
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+
+    if FILE_OFFLOAD in ('x-accel', 'x-sendfile'):
+        # Range и условные запросы обработает прокси, он же отправит файл
+        return _offload(path, relative_path, resp)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        resp.status_code = 304
+        return resp
+
+    start, stop = 0, size
+    byte_range = request.range
+    if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 and _if_range_matches(etag, st.st_mtime):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            resp.status_code = 416
+            resp.headers['Content-Range'] = f"bytes */{size}"
+            return resp
+        start, stop = bounds
+        resp.status_code = 206
+        resp.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    # Несколько диапазонов сразу плееры не запрашивают: на такой запрос отдаём файл целиком
+
+    resp.content_length = stop - start
+    if request.method == 'HEAD':
+        return resp
+    f = open(path, 'rb')
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper and _wrapper_sends_range(request.environ, start, stop, size):
+        f.seek(start)
+        resp.response = file_wrapper(f, CHUNK_SIZE)
+    else:
+        resp.response = _read_range(f, start, stop - start)
+    return resp
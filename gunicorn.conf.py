@@ -0,0 +1,20 @@
+# gunicorn.conf.py
+# gunicorn читает этот файл из рабочего каталога автоматически.
+# Файлы метрик воркеров (PROMETHEUS_MULTIPROC_DIR, см. metrics.py) живут только до перезапуска.
+import os
+import shutil
+
+
+def on_starting(server):
+    # Значения прошлого запуска не должны попасть в /metrics
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # live-метрики (открытые соединения, очереди) завершившегося воркера больше не учитываются
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
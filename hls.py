@@ -0,0 +1,166 @@
+# hls.py
+# Упаковка загруженных видео в HLS с несколькими качествами (adaptive bitrate).
+# Транскодирование выполняется ffmpeg из образа (см. Dockerfile) в ограниченном пуле процессов.
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+HLS_ENABLED = os.environ.get('HLS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+HLS_FOLDER = os.environ.get('HLS_FOLDER', 'hls')
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', 'ffprobe')
+HLS_WORKERS = int(os.environ.get('HLS_WORKERS', 1))          # Сколько ffmpeg одновременно
+HLS_MAX_PENDING = int(os.environ.get('HLS_MAX_PENDING', 8))  # Сколько задач может ждать в очереди
+HLS_SEGMENT_SECONDS = int(os.environ.get('HLS_SEGMENT_SECONDS', 4))
+HLS_TIMEOUT = int(os.environ.get('HLS_TIMEOUT', 1800))        # Таймаут одного транскодирования
+# Качества: (имя, высота, битрейт видео, максимальный битрейт, битрейт аудио)
+HLS_RENDITIONS = [
+    ('360p', 360, '800k', '856k', '96k'),
+    ('480p', 480, '1400k', '1498k', '128k'),
+    ('720p', 720, '2800k', '2996k', '128k'),
+]
+MASTER_PLAYLIST = 'master.m3u8'
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HLS_MAX_PENDING)
+
+
+def is_available():
+    """HLS включён и ffmpeg найден в системе"""
+    return HLS_ENABLED and shutil.which(FFMPEG_BIN) is not None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=HLS_WORKERS)
+        return _executor
+
+
+def package_dir_name(item_type, item_id, source_url):
+    """Имя каталога пакета. Зависит от источника, поэтому файлы внутри можно кэшировать навсегда."""
+    digest = hashlib.sha1(source_url.encode('utf-8')).hexdigest()[:12]
+    return f"{item_type}_{item_id}_{digest}"
+
+
+def _has_audio(source):
+    try:
+        result = subprocess.run(
+            [FFPROBE_BIN, '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+             '-of', 'csv=p=0', source],
+            capture_output=True, text=True, timeout=60
+        )
+        return bool(result.stdout.strip())
+    except Exception:
+        # Если ffprobe недоступен, считаем что звук есть (как у большинства роликов)
+        return True
+
+
+def build_ffmpeg_command(source, out_dir, with_audio=True):
+    """Команда ffmpeg: один проход декодирования, несколько качеств и master-плейлист"""
+    count = len(HLS_RENDITIONS)
+    split = f"[0:v]split={count}" + ''.join(f"[v{i}]" for i in range(count))
+    scales = ';'.join(
+        f"[v{i}]scale=-2:'min({height},ih)'[v{i}out]"
+        for i, (_, height, _, _, _) in enumerate(HLS_RENDITIONS)
+    )
+    cmd = [FFMPEG_BIN, '-y', '-hide_banner', '-loglevel', 'error', '-i', source,
+           '-filter_complex', f"{split};{scales}"]
+    stream_map = []
+    for i, (name, _, v_bitrate, v_maxrate, a_bitrate) in enumerate(HLS_RENDITIONS):
+        cmd += ['-map', f"[v{i}out]",
+                f"-c:v:{i}", 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+                f"-b:v:{i}", v_bitrate, f"-maxrate:v:{i}", v_maxrate, f"-bufsize:v:{i}", v_maxrate]
+        if with_audio:
+            cmd += ['-map', '0:a:0', f"-c:a:{i}", 'aac', f"-b:a:{i}", a_bitrate, '-ac', '2']
+            stream_map.append(f"v:{i},a:{i},name:{name}")
+        else:
+            stream_map.append(f"v:{i},name:{name}")
+    # Ключевой кадр на границе каждого сегмента, иначе переключение качества рвётся
+    cmd += ['-force_key_frames', f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})", '-sc_threshold', '0',
+            '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_flags', 'independent_segments',
+            '-hls_segment_filename', os.path.join(out_dir, '%v', 'seg_%04d.ts'),
+            '-master_pl_name', MASTER_PLAYLIST,
+            '-var_stream_map', ' '.join(stream_map),
+            os.path.join(out_dir, '%v', 'index.m3u8')]
+    return cmd
+
+
+def _transcode(source, out_dir):
+    """Выполняется в дочернем процессе пула. Пишет во временный каталог и атомарно переименовывает."""
+    if os.path.isdir(out_dir):
+        return out_dir
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for name, _, _, _, _ in HLS_RENDITIONS:
+        os.makedirs(os.path.join(tmp_dir, name), exist_ok=True)
+    try:
+        cmd = build_ffmpeg_command(source, tmp_dir, with_audio=_has_audio(source))
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=HLS_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg завершился с кодом {result.returncode}: {result.stderr[-500:]}")
+        os.replace(tmp_dir, out_dir)
+        return out_dir
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _resolve_source(video_url, upload_folder):
+    """Локальные загрузки читаем с диска, остальное ffmpeg скачает сам"""
+    if video_url.startswith('/uploads/'):
+        return os.path.join(upload_folder, os.path.basename(video_url))
+    return video_url
+
+
+def submit(item_type, item_id, video_url, upload_folder='uploads', on_done=None):
+    """
+    Ставит видео в очередь на упаковку в HLS.
+    on_done(item_type, item_id, hls_url) вызывается после успешного транскодирования.
+    Возвращает False, если HLS выключен или очередь заполнена.
+    """
+    if not video_url or not is_available():
+        return False
+    if not video_url.startswith(('/uploads/', 'http://', 'https://')):
+        return False
+    if not _pending.acquire(blocking=False):
+        logger.warning(f"[HLS] Очередь транскодирования заполнена, {item_type}/{item_id} пропущен")
+        return False
+    dir_name = package_dir_name(item_type, item_id, video_url)
+    out_dir = os.path.join(HLS_FOLDER, dir_name)
+    hls_url = f"/hls/{dir_name}/{MASTER_PLAYLIST}"
+    source = _resolve_source(video_url, upload_folder)
+    os.makedirs(HLS_FOLDER, exist_ok=True)
+    try:
+        future = _get_executor().submit(_transcode, source, out_dir)
+    except Exception as e:
+        _pending.release()
+        logger.error(f"[HLS] Не удалось поставить задачу {item_type}/{item_id}: {e}")
+        return False
+
+    def _callback(fut):
+        _pending.release()
+        try:
+            fut.result()
+        except Exception as e:
+            logger.error(f"[HLS] Ошибка транскодирования {item_type}/{item_id}: {e}")
+            return
+        logger.info(f"[HLS] {item_type}/{item_id} упакован: {hls_url}")
+        if on_done:
+            try:
+                on_done(item_type, item_id, hls_url)
+            except Exception as e:
+                logger.error(f"[HLS] Ошибка обработки результата {item_type}/{item_id}: {e}", exc_info=True)
+
+    future.add_done_callback(_callback)
+    logger.info(f"[HLS] {item_type}/{item_id} поставлен в очередь транскодирования")
+    return True
@@ -0,0 +1,115 @@
+# images.py
+# Уменьшенные копии превью и картинок новостей под ширину карточки (WebP/AVIF).
+# Использует opencv-python-headless из requirements.txt.
+import os
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # Без OpenCV отдаём оригиналы
+    cv2 = None
+    np = None
+
+# --- Конфигурация ---
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'image_cache')
+IMAGE_WIDTHS = (160, 320, 480, 640, 960)   # Допустимые ширины (корзины), произвольные не делаем
+IMAGE_QUALITY = {'webp': 78, 'avif': 55, 'jpg': 82}
+IMAGE_MIMETYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'jpg': 'image/jpeg'}
+
+_locks = {}
+_locks_guard = threading.Lock()
+_supported = None
+
+
+def supported_formats():
+    """Форматы, которые умеет кодировать установленная сборка OpenCV"""
+    global _supported
+    if _supported is None:
+        formats = set()
+        if cv2 is not None:
+            probe = np.zeros((8, 8, 3), dtype=np.uint8)
+            for fmt in IMAGE_MIMETYPES:
+                try:
+                    ok, _ = cv2.imencode(f".{fmt}", probe)
+                    if ok:
+                        formats.add(fmt)
+                except cv2.error:
+                    pass
+        _supported = formats
+    return _supported
+
+
+def is_supported(fmt, width):
+    return width in IMAGE_WIDTHS and fmt in supported_formats()
+
+
+def variant_path(source_id, width, fmt):
+    digest = hashlib.sha1(source_id.encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, f"{digest}_{width}.{fmt}")
+
+
+def _encode_params(fmt):
+    quality = IMAGE_QUALITY[fmt]
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if fmt == 'avif':
+        return [getattr(cv2, 'IMWRITE_AVIF_QUALITY', cv2.IMWRITE_JPEG_QUALITY), quality]
+    return [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+
+def render_variant(original_path, width, fmt):
+    """Уменьшает оригинал до ширины width (без увеличения) и кодирует в fmt. Возвращает байты."""
+    data = np.fromfile(original_path, dtype=np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Не удалось декодировать изображение {original_path}")
+    height, orig_width = img.shape[:2]
+    if orig_width > width:
+        new_height = max(1, round(height * width / orig_width))
+        img = cv2.resize(img, (width, new_height), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(f".{fmt}", img, _encode_params(fmt))
+    if not ok:
+        raise ValueError(f"Не удалось закодировать изображение в {fmt}")
+    return buf.tobytes()
+
+
+def get_variant(source_id, original_loader, width, fmt):
+    """
+    Путь к готовой копии на диске. При первом запросе создаёт её:
+    original_loader() должен вернуть путь к оригиналу (или None).
+    """
+    path = variant_path(source_id, width, fmt)
+    if os.path.exists(path):
+        return path
+    with _locks_guard:
+        lock = _locks.setdefault(path, threading.Lock())
+    try:
+        with lock:
+            # Пока ждали блокировку, копию мог сделать другой поток
+            if os.path.exists(path):
+                return path
+            original_path = original_loader()
+            if not original_path:
+                return None
+            payload = render_variant(original_path, width, fmt)
+            store_variant(path, payload)
+            logger.info(f"[IMG] Создана копия {os.path.basename(path)} ({len(payload)} байт)")
+    finally:
+        # Блокировку убираем и при ошибке (битый оригинал, сбой кодека), иначе _locks растёт
+        with _locks_guard:
+            _locks.pop(path, None)
+    return path
+
+
+def store_variant(path, payload):
+    """Атомарно записывает копию на диск"""
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
@@ -0,0 +1,245 @@
+# link_resolver.py
+# Метаданные видео по ссылке (YouTube, Shorts, TikTok, Instagram Reels и др.) через yt-dlp.
+# Видео не скачивается: только название, длительность, превью и описание.
+# Извлечение идёт в ограниченном пуле процессов с таймаутом, чтобы не блокировать потоки gunicorn.
+#
+# Ссылку присылает любой пользователь, поэтому сервер не должен ходить по ней во внутреннюю сеть
+# (localhost, 169.254.169.254, *.internal): хост проверяется до извлечения, а yt-dlp работает
+# только с экстракторами известных сайтов — generic, который скачивает произвольную страницу, выключен.
+import os
+import re
+import signal
+import socket
+import hashlib
+import logging
+import ipaddress
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+RESOLVER_WORKERS = int(os.environ.get('RESOLVER_WORKERS', 2))          # Сколько yt-dlp одновременно
+RESOLVER_MAX_PENDING = int(os.environ.get('RESOLVER_MAX_PENDING', 8))  # Сколько запросов может ждать
+RESOLVER_TIMEOUT = int(os.environ.get('RESOLVER_TIMEOUT', 25))         # Таймаут одного извлечения, сек
+RESOLVER_SOCKET_TIMEOUT = 10
+RESOLVER_GRACE = 2             # сек сверх таймаута: дочерний процесс сам прерывает извлечение по таймеру
+ALLOWED_EXTRACTORS = ('default', '-generic')
+MAX_DESCRIPTION_LENGTH = 2000
+
+# Параметры ссылок, которые не влияют на содержимое (метки соцсетей и рекламы)
+TRACKING_PARAMS = {'si', 'feature', 'igshid', 'igsh', 'fbclid', 'gclid', 'is_from_webapp',
+                   'sender_device', 'share_app_id', 'pp', 'ab_channel'}
+YOUTUBE_HOSTS = {'youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtu.be'}
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YEAR_RE = re.compile(r'\b(19[0-9]{2}|20[0-9]{2})\b')
+INTERNAL_HOST_SUFFIXES = ('.localhost', '.internal', '.local', '.lan', '.home.arpa')
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(RESOLVER_MAX_PENDING)
+
+
+class ResolverError(Exception):
+    """Ошибка, текст которой можно показать пользователю"""
+
+
+class ResolverBusy(ResolverError):
+    """Все обработчики заняты"""
+
+
+class ResolverTimeout(BaseException):
+    """Извлечение в дочернем процессе превысило лимит времени.
+    BaseException: yt-dlp перехватывает Exception и повторяет запрос, прерывание должно пройти насквозь"""
+
+
+def _is_internal_address(address):
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not ip.is_global
+
+
+def _check_host_name(host):
+    """Без обращения к DNS: localhost, внутренние домены и IP-адреса внутренних сетей"""
+    if host == 'localhost' or host.endswith(INTERNAL_HOST_SUFFIXES) or '.' not in host and ':' not in host:
+        raise ResolverError('Ссылки на внутренние адреса не поддерживаются')
+    try:
+        internal = _is_internal_address(host)
+    except ValueError:
+        return  # не IP-адрес
+    if internal:
+        raise ResolverError('Ссылки на внутренние адреса не поддерживаются')
+
+
+def check_public_host(host, port=None):
+    """ResolverError, если хост (или любой из его адресов в DNS) указывает во внутреннюю сеть"""
+    host = host.lower().rstrip('.')
+    _check_host_name(host)
+    try:
+        infos = socket.getaddrinfo(host, port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ResolverError('Не удалось найти сайт по ссылке')
+    if not infos or any(_is_internal_address(info[4][0]) for info in infos):
+        raise ResolverError('Ссылки на внутренние адреса не поддерживаются')
+
+
+def normalize_url(url):
+    """
+    Каноническая форма ссылки для ключа кэша: хост в нижнем регистре без www,
+    без меток отслеживания и якоря. Ссылки YouTube приводятся к watch?v=ID.
+    """
+    url = (url or '').strip()
+    if not url:
+        raise ResolverError('Пустая ссылка')
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ResolverError('Поддерживаются только ссылки http(s)')
+    host = parts.hostname.lower().rstrip('.')
+    _check_host_name(host)
+    if host.startswith('www.'):
+        host = host[4:]
+    path = re.sub(r'/{2,}', '/', parts.path).rstrip('/') or '/'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=False)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+
+    if host in YOUTUBE_HOSTS:
+        video_id = None
+        if host == 'youtu.be':
+            video_id = path.lstrip('/').split('/')[0]
+        elif path.startswith(('/shorts/', '/embed/', '/live/')):
+            video_id = path.split('/')[2]
+        else:
+            video_id = dict(query).get('v')
+        if video_id and YOUTUBE_ID_RE.match(video_id):
+            return f"https://youtube.com/watch?v={video_id}"
+
+    netloc = host if not parts.port or parts.port in (80, 443) else f"{host}:{parts.port}"
+    return urlunsplit((parts.scheme, netloc, path, urlencode(sorted(query)), ''))
+
+
+def url_hash(normalized_url):
+    return hashlib.sha1(normalized_url.encode('utf-8')).hexdigest()
+
+
+def guess_year(*texts):
+    """Год выпуска фильма, если он упомянут в названии или описании ролика"""
+    for text in texts:
+        match = YEAR_RE.search(text or '')
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _on_time_limit(signum, frame):
+    raise ResolverTimeout()
+
+
+def _extract(url, allowed_extractors=ALLOWED_EXTRACTORS, time_limit=RESOLVER_TIMEOUT):
+    """Выполняется в дочернем процессе пула: только метаданные, без скачивания.
+    Таймер прерывает зависшее извлечение, чтобы процесс пула освободился, а не висел вечно."""
+    import yt_dlp
+    options = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'noplaylist': True,
+        'socket_timeout': RESOLVER_SOCKET_TIMEOUT,
+        'extractor_retries': 1,
+        'extract_flat': 'in_playlist',
+        'allowed_extractors': list(allowed_extractors),
+    }
+    previous = signal.signal(signal.SIGALRM, _on_time_limit) if time_limit else None
+    if time_limit:
+        signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        # Исключения yt-dlp не всегда сериализуются для передачи из дочернего процесса
+        raise RuntimeError(str(e)) from None
+    finally:
+        if time_limit:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    extractor = (info.get('extractor_key') or info.get('extractor') or '').lower()
+    if extractor == 'generic' and 'generic' not in allowed_extractors:
+        raise RuntimeError('Сайт не поддерживается')
+    if info.get('_type') == 'playlist' and info.get('entries'):
+        info = next(iter(info['entries']), None) or info
+    thumbnail = info.get('thumbnail')
+    if not thumbnail and info.get('thumbnails'):
+        thumbnail = info['thumbnails'][-1].get('url')
+    description = (info.get('description') or '')[:MAX_DESCRIPTION_LENGTH]
+    return {
+        'title': info.get('title') or info.get('fulltitle'),
+        'duration': int(info['duration']) if info.get('duration') else None,
+        'thumbnail': thumbnail,
+        'description': description,
+        'uploader': info.get('uploader') or info.get('channel'),
+        'webpage_url': info.get('webpage_url') or url,
+        'extractor': info.get('extractor_key') or info.get('extractor'),
+        'year': guess_year(info.get('title'), description),
+    }
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=RESOLVER_WORKERS)
+        return _executor
+
+
+def _recycle_if_stuck(executor, future, url):
+    """Задача не завершилась даже по своему таймеру (зависла в C-коде): пул заменяется новым,
+    процессы старого завершаются, чтобы не занимать место навсегда"""
+    if future.done():
+        return
+    logger.error(f"[RESOLVER] Извлечение {url} не остановилось по таймеру, пул процессов пересоздаётся")
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_metadata(url, timeout=RESOLVER_TIMEOUT):
+    """
+    Метаданные по ссылке (url уже нормализован). Блокирует вызывающий поток не дольше timeout.
+    ResolverBusy, если очередь заполнена; ResolverError при ошибке, таймауте или внутреннем адресе.
+    """
+    parts = urlsplit(url)
+    check_public_host(parts.hostname or '', parts.port)
+    if not _pending.acquire(blocking=False):
+        raise ResolverBusy('Сервис перегружен, попробуйте через минуту')
+    try:
+        executor = _get_executor()
+        future = executor.submit(_extract, url, ALLOWED_EXTRACTORS, timeout)
+    except Exception as e:
+        _pending.release()
+        logger.error(f"[RESOLVER] Не удалось поставить задачу {url}: {e}")
+        raise ResolverError('Сервис временно недоступен')
+    # Место в очереди освобождается, когда процесс действительно закончит работу
+    future.add_done_callback(lambda fut: _pending.release())
+    try:
+        return future.result(timeout=timeout + RESOLVER_GRACE)
+    except (FutureTimeoutError, ResolverTimeout):
+        if not future.cancel() and not future.done():
+            # Задача уже выполняется (могла начаться позже из-за очереди): к этому сроку
+            # её таймер в дочернем процессе гарантированно должен был сработать
+            watchdog = threading.Timer(timeout + RESOLVER_GRACE, _recycle_if_stuck, (executor, future, url))
+            watchdog.daemon = True
+            watchdog.start()
+        logger.warning(f"[RESOLVER] Таймаут извлечения {url}")
+        raise ResolverError('Не удалось получить данные по ссылке: превышено время ожидания')
+    except ResolverError:
+        raise
+    except Exception as e:
+        logger.warning(f"[RESOLVER] Ошибка извлечения {url}: {e}")
+        raise ResolverError('Не удалось получить данные по ссылке')
@@ -0,0 +1,28 @@
+# live_events.py
+# Публикация изменений контента в канал Redis для потока /events (events_server.py).
+# События маленькие: клиент сам правит карточки, не перезагружая вкладку целиком.
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'live_events'
+
+# Типы событий
+ITEM_ADDED = 'item'          # {item_type, item_id, title}
+REACTIONS_CHANGED = 'reaction'  # {item_type, item_id, reactions: {like: N, ...}}
+COMMENT_ADDED = 'comment'    # {item_type, item_id, comments_count}
+
+
+class EventPublisher:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def publish(self, event_type, **data):
+        """Отправляет событие всем воркерам events_server. Ошибки только логируются."""
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.publish(EVENTS_CHANNEL, json.dumps(dict(data, type=event_type), default=str))
+        except Exception as e:
+            logger.warning(f"[EVENTS] Не удалось опубликовать событие {event_type}: {e}")
@@ -0,0 +1,198 @@
+# media_proxy.py
+# Проксирование файлов Telegram через наш сервер: клиенты не видят токен бота,
+# ссылки не протухают, горячие файлы лежат в локальном LRU-кэше на диске.
+import os
+import re
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR', 'media_cache')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_MB', 2048)) * 1024 * 1024
+CHUNK_SIZE = 256 * 1024          # Размер блока при чтении/записи (ограничивает память на запрос)
+UPSTREAM_TIMEOUT = (5, 30)       # (connect, read) для запросов к Telegram
+WAIT_TIMEOUT = 30                # Сколько ждать очередную порцию данных от загрузки
+# Адрес Bot API: свой сервер telegram-bot-api или заглушка benchmarks/fake_telegram_api.py
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').strip().rstrip('/')
+
+# Ссылки в БД могли быть сохранены до смены TELEGRAM_API_URL — узнаём и адрес по умолчанию
+TELEGRAM_FILE_RE = re.compile(
+    r'^(?:https://api\.telegram\.org|' + re.escape(TELEGRAM_API_URL) + r')/file/bot[^/]+/(.+)$')
+
+
+def telegram_file_path(url):
+    """file_path из прямой ссылки Telegram или None, если это не ссылка на файл Telegram"""
+    if not url:
+        return None
+    match = TELEGRAM_FILE_RE.match(url.strip())
+    return match.group(1) if match else None
+
+
+def upstream_url(file_path, token):
+    """Ссылка для скачивания с актуальным токеном (старый токен в БД мог смениться)"""
+    return f"{TELEGRAM_API_URL}/file/bot{token}/{file_path}"
+
+
+def cache_key(file_path):
+    ext = os.path.splitext(file_path)[1].lower()
+    return hashlib.sha1(file_path.encode('utf-8')).hexdigest() + ext
+
+
+def guess_mimetype(file_path):
+    return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+
+def cached_path(key):
+    """Путь к файлу в кэше (и отметка об использовании для LRU) или None"""
+    path = os.path.join(MEDIA_CACHE_DIR, key)
+    try:
+        os.utime(path, None)
+        return path
+    except OSError:
+        return None
+
+
+def _evict():
+    """Удаляет самые давно использованные файлы, пока кэш не уложится в лимит"""
+    try:
+        entries = []
+        total = 0
+        with os.scandir(MEDIA_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith('.part'):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= MEDIA_CACHE_MAX_BYTES:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= MEDIA_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                logger.info(f"[MEDIA] Вытеснен из кэша: {os.path.basename(path)}")
+            except OSError:
+                pass
+    except OSError as e:
+        logger.warning(f"[MEDIA] Ошибка очистки кэша: {e}")
+
+
+class _Fill:
+    """Одна загрузка файла из Telegram, которую читают все одновременные запросы"""
+
+    def __init__(self, key):
+        self.key = key
+        self.final_path = os.path.join(MEDIA_CACHE_DIR, key)
+        self.part_path = f"{self.final_path}.{os.getpid()}.{threading.get_ident()}.part"
+        self.cond = threading.Condition()
+        self.total = None        # Content-Length от Telegram
+        self.downloaded = 0
+        self.done = False
+        self.error = None
+
+    def wait_started(self, timeout=WAIT_TIMEOUT):
+        """Ждёт, пока станет известен размер файла (или ошибка)"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.total is None and not self.done and self.error is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return self.error is None
+
+    def wait_done(self, timeout=WAIT_TIMEOUT * 4):
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or self.error is not None, timeout)
+        return self.done
+
+    def run(self, url):
+        os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+        try:
+            with requests.get(url, stream=True, timeout=UPSTREAM_TIMEOUT) as resp:
+                resp.raise_for_status()
+                with open(self.part_path, 'wb') as f:
+                    length = resp.headers.get('Content-Length')
+                    with self.cond:
+                        self.total = int(length) if length and length.isdigit() else None
+                        self.cond.notify_all()
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        f.flush()
+                        with self.cond:
+                            self.downloaded += len(chunk)
+                            self.cond.notify_all()
+            os.replace(self.part_path, self.final_path)
+            with self.cond:
+                self.total = self.downloaded
+                self.done = True
+                self.cond.notify_all()
+            logger.info(f"[MEDIA] Файл закэширован: {self.key} ({self.downloaded} байт)")
+            _evict()
+        except Exception as e:
+            logger.error(f"[MEDIA] Ошибка загрузки {self.key}: {e}")
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+        finally:
+            with _fills_lock:
+                _fills.pop(self.key, None)
+
+    def stream(self, start, stop):
+        """Отдаёт байты [start, stop) по мере их скачивания"""
+        try:
+            f = open(self.part_path, 'rb')
+        except FileNotFoundError:
+            # Загрузка успела завершиться и файл уже переименован
+            f = open(self.final_path, 'rb')
+        with f:
+            f.seek(start)
+            pos = start
+            while pos < stop:
+                with self.cond:
+                    if not self.cond.wait_for(
+                            lambda: self.downloaded > pos or self.done or self.error is not None,
+                            WAIT_TIMEOUT):
+                        logger.warning(f"[MEDIA] Таймаут ожидания данных {self.key}")
+                        return
+                    if self.error is not None:
+                        return
+                    available = min(self.downloaded, stop)
+                if available <= pos:
+                    return
+                data = f.read(min(CHUNK_SIZE, available - pos))
+                if not data:
+                    return
+                pos += len(data)
+                yield data
+
+
+_fills = {}
+_fills_lock = threading.Lock()
+
+
+def get_fill(key, url):
+    """Возвращает текущую загрузку файла или запускает новую (одна загрузка на файл)"""
+    with _fills_lock:
+        fill = _fills.get(key)
+        if fill is None:
+            fill = _Fill(key)
+            _fills[key] = fill
+            threading.Thread(target=fill.run, args=(url,), daemon=True).start()
+            logger.info(f"[MEDIA] Загрузка из Telegram: {key}")
+        return fill
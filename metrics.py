@@ -0,0 +1,147 @@
+# metrics.py
+# Метрики Prometheus для /metrics: время запросов по маршрутам, попадания в кэш,
+# соединения с БД, Telegram Bot API, кэш ссылок на файлы, глубина очередей.
+#
+# Под gunicorn воркеров несколько: при заданном PROMETHEUS_MULTIPROC_DIR каждый процесс пишет
+# значения в свои файлы (multiprocess-режим prometheus_client), а /metrics в любом воркере
+# складывает файлы всех процессов. Каталог очищается при старте gunicorn (gunicorn.conf.py).
+# Без переменной (локальный запуск) метрики живут в памяти процесса.
+import os
+import re
+import time
+import logging
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    # prometheus_client создаёт файлы при объявлении метрик, каталог нужен заранее
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+from flask import request
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+)
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса',
+                         ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Обращения к кэшу по пространству ключей',
+                         ['namespace', 'result'])
+DB_CONNECTIONS_OPEN = Gauge('db_connections_open', 'Открытые соединения с PostgreSQL',
+                            multiprocess_mode='livesum')
+DB_CONNECT_SECONDS = Histogram('db_connect_seconds', 'Время установки соединения с PostgreSQL',
+                               buckets=LATENCY_BUCKETS)
+DB_QUERY_SECONDS = Histogram('db_query_seconds', 'Время выполнения запроса к PostgreSQL',
+                             buckets=LATENCY_BUCKETS)
+TELEGRAM_LATENCY = Histogram('telegram_api_request_seconds', 'Время запроса к Telegram Bot API',
+                             ['method'], buckets=LATENCY_BUCKETS)
+TELEGRAM_ERRORS = Counter('telegram_api_errors_total', 'Ошибки запросов к Telegram Bot API', ['method'])
+FILE_URL_CACHE_ENTRIES = Gauge('file_url_cache_entries', 'Ссылки на файлы Telegram в кэше процессов',
+                               multiprocess_mode='livesum')
+WEBHOOK_QUEUE_DEPTH = Gauge('webhook_queue_depth', 'Обновления Telegram в очереди на обработку',
+                            multiprocess_mode='livesum')
+
+_NAMESPACE_PART = re.compile(r'^[a-z]+$')
+_TELEGRAM_METHOD = re.compile(r'/bot[^/]+/(\w+)$')
+
+
+def cache_namespace(key):
+    """item_moments_5 -> item_moments, comments_first_news_7_new -> comments_first_news"""
+    parts = []
+    for part in key.split('_'):
+        if not _NAMESPACE_PART.match(part) or len(parts) == 3:
+            break
+        parts.append(part)
+    return '_'.join(parts) or 'other'
+
+
+def record_cache(namespace, hits, misses=0):
+    if hits:
+        CACHE_REQUESTS.labels(namespace, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(namespace, 'miss').inc(misses)
+
+
+def telegram_method(url):
+    """Имя метода Bot API из URL запроса; скачивание файла — 'file'"""
+    if '/file/bot' in url:
+        return 'file'
+    match = _TELEGRAM_METHOD.search(url)
+    return match.group(1) if match else 'other'
+
+
+class telegram_call:
+    """with telegram_call('getFile'): ... — время запроса и ошибка, если блок завершился исключением"""
+    __slots__ = ('method', 'started')
+
+    def __init__(self, method):
+        self.method = method
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        TELEGRAM_LATENCY.labels(self.method).observe(time.perf_counter() - self.started)
+        if exc_type is not None:
+            TELEGRAM_ERRORS.labels(self.method).inc()
+        return False
+
+
+class RedisQueueCollector:
+    """Длина очередей в Redis на момент запроса /metrics (общие для всех воркеров)"""
+
+    def __init__(self, redis_client, queues):
+        self.redis_client = redis_client
+        self.queues = queues  # имя метрики -> (ключ списка, описание)
+
+    def collect(self):
+        if not self.redis_client:
+            return
+        for name, (key, documentation) in self.queues.items():
+            try:
+                depth = self.redis_client.llen(key)
+            except Exception as e:
+                logger.warning(f"[METRICS] Не удалось получить длину {key}: {e}")
+                continue
+            family = GaugeMetricFamily(name, documentation)
+            family.add_metric([], depth)
+            yield family
+
+
+class Metrics:
+    """Flask-часть: гистограмма времени запросов и ответ /metrics"""
+
+    def __init__(self, redis_client=None, redis_queues=None):
+        self.scrape_registry = CollectorRegistry(auto_describe=False)
+        if redis_queues:
+            self.scrape_registry.register(RedisQueueCollector(redis_client, redis_queues))
+
+    def init_app(self, app):
+        app.before_request(self._begin)
+        app.after_request(self._observe)
+
+    @staticmethod
+    def _begin():
+        request.environ['metrics.start'] = time.perf_counter()
+
+    @staticmethod
+    def _observe(resp):
+        started = request.environ.get('metrics.start')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_LATENCY.labels(request.method, route, str(resp.status_code)).observe(time.perf_counter() - started)
+        return resp
+
+    def render(self):
+        """(тело, Content-Type) для ответа /metrics"""
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry) + generate_latest(self.scrape_registry), CONTENT_TYPE_LATEST
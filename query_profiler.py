@@ -0,0 +1,248 @@
+# query_profiler.py
+# Профилировщик SQL (включается QUERY_PROFILER=1): время, число строк и отпечаток каждого запроса.
+# Отпечаток — текст запроса без значений (литералы и параметры заменены на ?), поэтому
+# get_comments для разных элементов попадает в одну строку статистики с большим числом вызовов.
+# Медленные запросы пишутся в лог; для части из них (выборка) снимается план EXPLAIN.
+# Статистика копится в процессе и раз в несколько секунд складывается в Redis (общая для воркеров),
+# страница /admin/queries показывает самые дорогие запросы по суммарному времени.
+import os
+import re
+import time
+import random
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+QUERY_PROFILER_ENABLED = os.environ.get('QUERY_PROFILER', '0').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))  # доля медленных запросов с EXPLAIN
+EXPLAIN_INTERVAL = 300          # сек: план одного отпечатка снимаем не чаще
+PROFILER_FLUSH_INTERVAL = 10    # сек между сбросами статистики в Redis
+MAX_FINGERPRINTS = 2000         # ограничение статистики в памяти процесса
+STATS_TTL = 7 * 86400
+
+TOP_KEY = 'qprof_top'           # sorted set: отпечаток -> суммарное время, мс
+STATS_KEY_PREFIX = 'qprof_stats_'  # hash на отпечаток: calls, total_ms, max_ms, rows, query
+PLAN_KEY_PREFIX = 'qprof_plan_'
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+
+# KEYS: stats, top; ARGV: fingerprint, calls, total_ms, rows, max_ms, query, ttl
+_ADD_SCRIPT = """
+redis.call('hincrby', KEYS[1], 'calls', ARGV[2])
+redis.call('hincrbyfloat', KEYS[1], 'total_ms', ARGV[3])
+redis.call('hincrby', KEYS[1], 'rows', ARGV[4])
+if tonumber(ARGV[5]) > tonumber(redis.call('hget', KEYS[1], 'max_ms') or '0') then
+    redis.call('hset', KEYS[1], 'max_ms', ARGV[5])
+end
+redis.call('hsetnx', KEYS[1], 'query', ARGV[6])
+redis.call('zincrby', KEYS[2], ARGV[3], ARGV[1])
+redis.call('expire', KEYS[1], ARGV[7])
+redis.call('expire', KEYS[2], ARGV[7])
+return 1
+"""
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PARAMS = re.compile(r'%\(\w+\)s|%s')
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_ARRAYS = re.compile(r'ARRAY\[[^\]]*\]', re.I)
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_ROWS = re.compile(r'\(\?\.\.\.\)(?:\s*,\s*\(\?\.\.\.\))+')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """(отпечаток, нормализованный текст): значения -> ?, списки IN/VALUES -> (?...)"""
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PARAMS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _ARRAYS.sub('ARRAY[?...]', text)
+    text = _LISTS.sub('(?...)', text)
+    text = _ROWS.sub('(?...), ...', text)
+    text = _SPACES.sub(' ', text).strip()
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[:12], text
+
+
+def _sql_text(cursor, query):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if isinstance(query, str):
+        return query
+    return query.as_string(cursor)  # psycopg2.sql.Composed
+
+
+class QueryProfiler:
+    def __init__(self, enabled=QUERY_PROFILER_ENABLED):
+        self.enabled = enabled
+        self.redis_client = None
+        self._add = None
+        self._stats = {}     # отпечаток -> [calls, total_ms, max_ms, rows, query]
+        self._pending = {}   # то же, ещё не сброшенное в Redis
+        self._plans = {}     # отпечаток -> (время, план)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def set_redis_client(self, redis_client):
+        self.redis_client = redis_client
+        self._add = redis_client.register_script(_ADD_SCRIPT) if redis_client else None
+
+    def record(self, cursor, query, vars, seconds):
+        """Вызывается курсором после успешного execute"""
+        if self._add:
+            self._ensure_started()
+        ms = seconds * 1000
+        sql = _sql_text(cursor, query)
+        fp, normalized = fingerprint(sql)
+        rows = max(cursor.rowcount, 0)
+        with self._lock:
+            for stats in (self._stats, self._pending if self._add else None):
+                if stats is None:
+                    continue
+                entry = stats.get(fp)
+                if entry is None:
+                    if len(stats) >= MAX_FINGERPRINTS:
+                        continue
+                    stats[fp] = [1, ms, ms, rows, normalized]
+                else:
+                    entry[0] += 1
+                    entry[1] += ms
+                    entry[2] = max(entry[2], ms)
+                    entry[3] += rows
+        if ms >= SLOW_QUERY_MS:
+            plan = self._maybe_explain(cursor, fp, normalized, sql, vars)
+            logger.warning(f"[SLOWSQL] {ms:.1f} мс, строк {rows}, {fp}: {normalized[:500]}"
+                           + (f"\n{plan}" if plan else ''))
+
+    def _maybe_explain(self, cursor, fp, normalized, sql, vars):
+        if random.random() >= SLOW_QUERY_EXPLAIN_RATE:
+            return None
+        if not normalized.lower().startswith(EXPLAINABLE):
+            return None
+        now = time.time()
+        with self._lock:
+            last = self._plans.get(fp)
+            if last and now - last[0] < EXPLAIN_INTERVAL:
+                return None
+            self._plans[fp] = (now, last[1] if last else None)
+        try:
+            plan = self._explain(cursor, sql, vars)
+        except Exception as e:
+            logger.warning(f"[SLOWSQL] Не удалось получить EXPLAIN для {fp}: {e}")
+            return None
+        with self._lock:
+            self._plans[fp] = (now, plan)
+        if self.redis_client:
+            try:
+                self.redis_client.set(f"{PLAN_KEY_PREFIX}{fp}", plan, ex=STATS_TTL)
+            except Exception as e:
+                logger.warning(f"[SLOWSQL] Не удалось сохранить план {fp} в Redis: {e}")
+        return plan
+
+    @staticmethod
+    def _explain(cursor, sql, vars):
+        """EXPLAIN без ANALYZE (запрос не выполняется повторно) на том же соединении.
+        В открытой транзакции — под SAVEPOINT, чтобы ошибка EXPLAIN не прервала транзакцию вызывающего."""
+        conn = cursor.connection
+        statement = cursor.mogrify(sql, vars).decode('utf-8', 'replace') if vars is not None else sql
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as plain:
+            if conn.autocommit:
+                plain.execute('EXPLAIN ' + statement)
+                return '\n'.join(row[0] for row in plain.fetchall())
+            plain.execute('SAVEPOINT qprof_explain')
+            try:
+                plain.execute('EXPLAIN ' + statement)
+                plan = '\n'.join(row[0] for row in plain.fetchall())
+            except Exception:
+                plain.execute('ROLLBACK TO SAVEPOINT qprof_explain')
+                raise
+            finally:
+                plain.execute('RELEASE SAVEPOINT qprof_explain')
+            return plan
+
+    def _ensure_started(self):
+        # Поток запускаем лениво в процессе, который выполняет запросы (после fork gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pending = {}  # накопленное до fork досталось от родительского процесса
+            threading.Thread(target=self._run, name='query-profiler', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(PROFILER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"[SLOWSQL] Не удалось сбросить статистику запросов в Redis: {e}")
+
+    def flush(self):
+        if not self._add:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for fp, (calls, total_ms, max_ms, rows, query) in pending.items():
+            self._add(keys=[f"{STATS_KEY_PREFIX}{fp}", TOP_KEY],
+                      args=[fp, calls, round(total_ms, 3), rows, round(max_ms, 3), query, STATS_TTL], client=pipe)
+        pipe.execute()
+
+    def top(self, sort='total_ms', limit=50):
+        """Самые дорогие запросы: список dict (fingerprint, query, calls, total_ms, mean_ms, max_ms, rows, plan)"""
+        if self._add:
+            try:
+                return self._top_from_redis(sort, limit)
+            except Exception as e:
+                logger.warning(f"[SLOWSQL] Статистика из Redis недоступна, показываем процесс: {e}")
+        with self._lock:
+            entries = [(fp, *entry) for fp, entry in self._stats.items()]
+            plans = {fp: plan for fp, (_, plan) in self._plans.items() if plan}
+        return self._rows(entries, plans, sort, limit)
+
+    def _top_from_redis(self, sort, limit):
+        fingerprints = self.redis_client.zrevrange(TOP_KEY, 0, MAX_FINGERPRINTS - 1)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for fp in fingerprints:
+            pipe.hgetall(f"{STATS_KEY_PREFIX}{fp}")
+            pipe.get(f"{PLAN_KEY_PREFIX}{fp}")
+        results = pipe.execute()
+        entries, plans = [], {}
+        for fp, stats, plan in zip(fingerprints, results[::2], results[1::2]):
+            if not stats:
+                continue
+            entries.append((fp, int(stats.get('calls', 0)), float(stats.get('total_ms', 0)),
+                            float(stats.get('max_ms', 0)), int(stats.get('rows', 0)), stats.get('query', '')))
+            if plan:
+                plans[fp] = plan
+        return self._rows(entries, plans, sort, limit)
+
+    @staticmethod
+    def _rows(entries, plans, sort, limit):
+        rows = [{
+            'fingerprint': fp, 'query': query, 'calls': calls,
+            'total_ms': total_ms, 'mean_ms': total_ms / calls if calls else 0,
+            'max_ms': max_ms, 'rows': rows, 'plan': plans.get(fp),
+        } for fp, calls, total_ms, max_ms, rows, query in entries]
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._pending.clear()
+            self._plans.clear()
+        if self.redis_client:
+            fingerprints = self.redis_client.zrange(TOP_KEY, 0, -1)
+            keys = [TOP_KEY] + [f"{prefix}{fp}" for fp in fingerprints for prefix in (STATS_KEY_PREFIX, PLAN_KEY_PREFIX)]
+            self.redis_client.delete(*keys)
@@ -0,0 +1,73 @@
+# rate_limit.py
+# Ограничение частоты действий (token bucket) по пользователю или IP.
+# Состояние корзины хранится в Redis и меняется атомарно Lua-скриптом, поэтому лимит общий
+# для всех воркеров. Без Redis корзины живут в памяти процесса.
+import math
+import time
+import logging
+import threading
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# KEYS: bucket; ARGV: rate (токенов в секунду), burst, now, cost
+# Возвращает {1|0, секунд до следующей попытки}
+_CONSUME_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('hset', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class TokenBucket:
+    """
+    rate — сколько действий в секунду восполняется, burst — сколько можно сделать подряд.
+    consume(subject) -> (allowed, retry_after_seconds)
+    """
+
+    def __init__(self, redis_client, name, rate, burst):
+        self.redis_client = redis_client
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._consume = redis_client.register_script(_CONSUME_SCRIPT) if redis_client else None
+        self._local = TTLCache(maxsize=10000, ttl=math.ceil(burst / rate) + 1)
+        self._lock = threading.Lock()
+
+    def consume(self, subject, cost=1):
+        now = time.time()
+        if self._consume:
+            try:
+                allowed, retry_after = self._consume(keys=[f"rl_{self.name}_{subject}"],
+                                                     args=[self.rate, self.burst, now, cost])
+                return bool(allowed), math.ceil(float(retry_after))
+            except Exception as e:
+                # Лимит защищает от спама, но не должен ломать отправку при сбое Redis
+                logger.warning(f"[RATE] Redis недоступен, проверяем лимит {self.name} локально: {e}")
+        return self._consume_local(subject, now, cost)
+
+    def _consume_local(self, subject, now, cost):
+        with self._lock:
+            tokens, ts = self._local.get(subject, (self.burst, now))
+            tokens = min(self.burst, tokens + max(0, now - ts) * self.rate)
+            if tokens >= cost:
+                self._local[subject] = (tokens - cost, now)
+                return True, 0
+            self._local[subject] = (tokens, now)
+            return False, math.ceil((cost - tokens) / self.rate)
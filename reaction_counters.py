@@ -0,0 +1,280 @@
+# reaction_counters.py
+# Реакции (лайк, дизлайк, звезда, огонь) с записью через Redis (write-behind).
+# Нажатие сразу учитывается в Redis: множество пользователей на реакцию + счётчики HINCRBY.
+# Фоновый поток пачками переносит реакции в PostgreSQL; после падения необработанная пачка
+# повторяется (вставка идемпотентна). Периодическая сверка чинит расхождения счётчиков.
+# Пачку, отвергнутую БД из-за данных, сборщик пишет по одной реакции; отвергнутые уходят в rx_dead.
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+REACTIONS = ('like', 'dislike', 'star', 'fire')
+REACTION_FLUSH_INTERVAL = float(os.environ.get('REACTION_FLUSH_INTERVAL', 2))        # сек между сбросами в БД
+REACTION_FLUSH_BATCH = int(os.environ.get('REACTION_FLUSH_BATCH', 500))
+REACTION_RECONCILE_INTERVAL = int(os.environ.get('REACTION_RECONCILE_INTERVAL', 3600))
+REACTION_KEY_TTL = 7 * 86400   # Ключи неактивных элементов истекают и восстанавливаются из БД
+FLUSH_LOCK_TTL = 60
+DEAD_LETTER_LIMIT = 1000   # Сколько последних отвергнутых реакций хранить для разбора
+
+PENDING_KEY = 'rx_pending'        # Реакции, ещё не записанные в БД
+PROCESSING_KEY = 'rx_processing'  # Пачка, которую сейчас пишет сборщик (повторяется после сбоя)
+ITEMS_KEY = 'rx_items'            # Элементы, чьи счётчики живут в Redis (для сверки)
+DEAD_KEY = 'rx_dead'              # Реакции, которые БД не приняла
+LOCK_KEY = 'rx_flush_lock'
+
+# KEYS: counts, set_1..set_n; ARGV: {reaction: [user_id, ...]}, [reaction, ...], ttl
+_HYDRATE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then return 0 end
+local data = cjson.decode(ARGV[1])
+local names = cjson.decode(ARGV[2])
+for i, name in ipairs(names) do
+    local users = data[name] or {}
+    for j = 1, #users, 1000 do
+        redis.call('sadd', KEYS[i + 1], unpack(users, j, math.min(j + 999, #users)))
+    end
+    redis.call('hset', KEYS[1], name, redis.call('scard', KEYS[i + 1]))
+    redis.call('expire', KEYS[i + 1], ARGV[3])
+end
+redis.call('expire', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: counts, set_1..set_n (по REACTIONS), pending, items; ARGV: user_id, reaction, номер реакции, event, item, ttl
+# -1: счётчиков нет (нужно восстановить), 0: реакция уже была, 1: учтена
+# TTL продлевается у всех ключей элемента: если бы истекло множество другой реакции,
+# а счётчики жили дальше, повторное нажатие прошло бы SADD и посчиталось второй раз
+_RECORD_SCRIPT = """
+local sets = #KEYS - 3
+if redis.call('exists', KEYS[1]) == 0 then return -1 end
+if redis.call('sadd', KEYS[tonumber(ARGV[3]) + 1], ARGV[1]) == 0 then return 0 end
+redis.call('hincrby', KEYS[1], ARGV[2], 1)
+redis.call('rpush', KEYS[sets + 2], ARGV[4])
+redis.call('sadd', KEYS[sets + 3], ARGV[5])
+for i = 1, sets + 1 do
+    redis.call('expire', KEYS[i], ARGV[6])
+end
+return 1
+"""
+
+# KEYS: pending, processing; ARGV: batch size
+# Если предыдущая пачка не дописана (сборщик упал), сначала возвращаем её
+_CLAIM_SCRIPT = """
+if redis.call('llen', KEYS[2]) > 0 then return redis.call('lrange', KEYS[2], 0, -1) end
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('rpush', KEYS[2], unpack(items))
+    redis.call('ltrim', KEYS[1], #items, -1)
+end
+return items
+"""
+
+# KEYS: counts, set_1..set_n; ARGV: [reaction, ...]
+_RECOUNT_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then return 0 end
+local names = cjson.decode(ARGV[1])
+for i, name in ipairs(names) do
+    redis.call('hset', KEYS[1], name, redis.call('scard', KEYS[i + 1]))
+end
+return 1
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+def empty_counts():
+    return {r: 0 for r in REACTIONS}
+
+
+class ReactionStore:
+    """
+    load_users(item_type, item_id) -> {reaction: [user_id, ...]} — реакции из БД для восстановления;
+    save_batch([(item_type, item_id, user_id, reaction), ...]) — идемпотентная запись в БД;
+    load_counts(item_type, item_id) -> {reaction: count} — для сверки;
+    row_errors — ошибки save_batch из-за самих данных (повтор не поможет), а не недоступности БД.
+    """
+
+    def __init__(self, redis_client, load_users, save_batch, load_counts, row_errors=(ValueError,)):
+        self.redis_client = redis_client
+        self.load_users = load_users
+        self.save_batch = save_batch
+        self.load_counts = load_counts
+        self.row_errors = row_errors
+        self._hydrate = redis_client.register_script(_HYDRATE_SCRIPT)
+        self._record = redis_client.register_script(_RECORD_SCRIPT)
+        self._claim = redis_client.register_script(_CLAIM_SCRIPT)
+        self._recount = redis_client.register_script(_RECOUNT_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_reconcile = time.monotonic()
+
+    # --- Ключи ---
+    @staticmethod
+    def _counts_key(item_type, item_id):
+        return f"rx_{item_type}_{item_id}"
+
+    @staticmethod
+    def _users_key(item_type, item_id, reaction):
+        return f"rx_users_{item_type}_{item_id}_{reaction}"
+
+    def _item_keys(self, item_type, item_id):
+        return [self._counts_key(item_type, item_id)] + [
+            self._users_key(item_type, item_id, r) for r in REACTIONS
+        ]
+
+    # --- Запись и чтение ---
+    def _ensure_hydrated(self, item_type, item_id):
+        if self.redis_client.exists(self._counts_key(item_type, item_id)):
+            return
+        users = self.load_users(item_type, item_id)
+        self._hydrate(keys=self._item_keys(item_type, item_id),
+                      args=[json.dumps(users), json.dumps(REACTIONS), REACTION_KEY_TTL])
+        self.redis_client.sadd(ITEMS_KEY, f"{item_type}:{item_id}")
+
+    def record(self, item_type, item_id, user_id, reaction):
+        """Учитывает реакцию. True, если она новая (пользователь ещё так не реагировал)."""
+        self._ensure_started()
+        event = json.dumps([item_type, item_id, user_id, reaction])
+        keys = self._item_keys(item_type, item_id) + [PENDING_KEY, ITEMS_KEY]
+        args = [user_id, reaction, REACTIONS.index(reaction) + 1, event, f"{item_type}:{item_id}", REACTION_KEY_TTL]
+        for _ in range(2):
+            result = self._record(keys=keys, args=args)
+            if result != -1:
+                return result == 1
+            self._ensure_hydrated(item_type, item_id)
+        return False
+
+    def counts(self, item_type, item_id):
+        raw = self.redis_client.hgetall(self._counts_key(item_type, item_id))
+        if not raw:
+            self._ensure_hydrated(item_type, item_id)
+            raw = self.redis_client.hgetall(self._counts_key(item_type, item_id))
+        counts = empty_counts()
+        counts.update({k: int(v) for k, v in raw.items() if k in counts})
+        return counts
+
+    def counts_many(self, item_type, item_ids):
+        """Счётчики для списка элементов одним конвейером Redis"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for item_id in item_ids:
+            pipe.hgetall(self._counts_key(item_type, item_id))
+        result = {}
+        for item_id, raw in zip(item_ids, pipe.execute()):
+            if not raw:
+                result[item_id] = self.counts(item_type, item_id)
+                continue
+            counts = empty_counts()
+            counts.update({k: int(v) for k, v in raw.items() if k in counts})
+            result[item_id] = counts
+        return result
+
+    # --- Фоновый перенос в БД ---
+    def start(self):
+        """Запуск при старте приложения: очередь, оставшаяся с прошлого запуска, не ждёт новых нажатий"""
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # Поток запускаем лениво в процессе, который принимает запросы (после fork gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='reaction-flusher', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            logger.info("[REACTIONS] Фоновая запись реакций в БД запущена")
+
+    def _run(self):
+        while True:
+            time.sleep(REACTION_FLUSH_INTERVAL)
+            try:
+                self.flush()
+                if time.monotonic() - self._last_reconcile > REACTION_RECONCILE_INTERVAL:
+                    self._last_reconcile = time.monotonic()
+                    self.reconcile()
+            except Exception as e:
+                logger.error(f"[REACTIONS] Ошибка записи реакций в БД: {e}", exc_info=True)
+
+    def _acquire(self):
+        token = uuid.uuid4().hex
+        if self.redis_client.set(LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_TTL):
+            return token
+        return None
+
+    def flush(self, max_batches=20):
+        """Переносит накопленные реакции в БД. Возвращает число записанных событий."""
+        token = self._acquire()
+        if not token:
+            return 0  # Сбросом занимается другой воркер
+        written = 0
+        try:
+            for _ in range(max_batches):
+                items = self._claim(keys=[PENDING_KEY, PROCESSING_KEY], args=[REACTION_FLUSH_BATCH])
+                if not items:
+                    break
+                rows = [tuple(json.loads(item)) for item in items]
+                try:
+                    self.save_batch(rows)
+                except self.row_errors as e:
+                    logger.warning(f"[REACTIONS] Пачка из {len(rows)} реакций отвергнута ({e}), пишем по одной")
+                    self._save_one_by_one(items)
+                self.redis_client.delete(PROCESSING_KEY)
+                written += len(rows)
+        finally:
+            self._release(keys=[LOCK_KEY], args=[token])
+        if written:
+            logger.info(f"[REACTIONS] В БД записано {written} реакций")
+        return written
+
+    def _save_one_by_one(self, items):
+        """Записывает реакции пачки по одной; отвергнутые БД переносятся в DEAD_KEY"""
+        for item in items:
+            try:
+                self.save_batch([tuple(json.loads(item))])
+            except self.row_errors as e:
+                logger.error(f"[REACTIONS] Реакция не записана и перенесена в {DEAD_KEY}: {e}; {item[:500]!r}")
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.rpush(DEAD_KEY, item)
+                pipe.ltrim(DEAD_KEY, -DEAD_LETTER_LIMIT, -1)
+                pipe.execute()
+
+    def reconcile(self):
+        """
+        Сверка: счётчики пересчитываются по множествам пользователей.
+        Если очередь пуста, а в БД реакций больше, чем в Redis (Redis терял данные),
+        ключи элемента удаляются и при следующем чтении восстанавливаются из БД.
+        """
+        token = self._acquire()
+        if not token:
+            return 0
+        fixed = 0
+        try:
+            for member in self.redis_client.sscan_iter(ITEMS_KEY, count=500):
+                item_type, item_id = member.rsplit(':', 1)
+                keys = self._item_keys(item_type, int(item_id))
+                if not self._recount(keys=keys, args=[json.dumps(REACTIONS)]):
+                    self.redis_client.srem(ITEMS_KEY, member)
+                    continue
+                if self.redis_client.llen(PENDING_KEY) or self.redis_client.llen(PROCESSING_KEY):
+                    continue
+                db_counts = self.load_counts(item_type, int(item_id))
+                redis_counts = self.counts(item_type, int(item_id))
+                if any(db_counts.get(r, 0) > redis_counts[r] for r in REACTIONS):
+                    logger.warning(f"[REACTIONS] Расхождение для {member}: БД {db_counts}, Redis {redis_counts}")
+                    self.redis_client.delete(*keys)
+                    self.redis_client.srem(ITEMS_KEY, member)
+                    fixed += 1
+        finally:
+            self._release(keys=[LOCK_KEY], args=[token])
+        return fixed
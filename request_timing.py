@@ -0,0 +1,150 @@
+# request_timing.py
+# Время запроса по слоям: PostgreSQL, Redis, Telegram API, шаблоны Jinja, ETag.
+# Итог уходит клиенту в заголовке Server-Timing (видно во вкладке Network браузера)
+# и в лог одной JSON-строкой для медленных запросов.
+#
+# Накладные расходы — два вызова perf_counter и словарь на участок, поэтому включено в продакшене.
+# Вне запроса (бот, фоновые потоки) участки ничего не делают.
+# Вложенный участок с тем же именем не считается повторно (рендер карточки внутри страницы).
+import os
+import json
+import time
+import logging
+import threading
+from functools import wraps
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+REQUEST_TIMING_ENABLED = os.environ.get('REQUEST_TIMING', '1').lower() in ('1', 'true', 'yes')
+REQUEST_TIMING_LOG_MS = float(os.environ.get('REQUEST_TIMING_LOG_MS', 500))  # запросы медленнее — в лог INFO
+
+_local = threading.local()
+
+
+class RequestTimer:
+    __slots__ = ('start', 'spans', 'active')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}     # имя -> [мс, число вызовов]
+        self.active = set()
+
+    def add(self, name, ms):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [ms, 1]
+        else:
+            entry[0] += ms
+            entry[1] += 1
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self, total_ms):
+        parts = [f'{name};dur={ms:.1f};desc="{count}"' for name, (ms, count) in self.spans.items()]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ', '.join(parts)
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+class span:
+    """with span('db'): ... — добавляет время блока к участку текущего запроса"""
+    __slots__ = ('name', 'timer', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.timer = None
+
+    def __enter__(self):
+        timer = getattr(_local, 'timer', None)
+        if timer is not None and self.name not in timer.active:
+            timer.active.add(self.name)
+            self.timer = timer
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        timer = self.timer
+        if timer is not None:
+            timer.add(self.name, (time.perf_counter() - self.started) * 1000)
+            timer.active.discard(self.name)
+            self.timer = None
+        return False
+
+
+def timed(name):
+    """Декоратор: весь вызов функции считается участком name"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_redis(client, name='redis'):
+    """Все команды клиента (включая Lua-скрипты) и pipeline.execute() считаются участком name"""
+    if client is None:
+        return
+    client.execute_command = timed(name)(client.execute_command)
+    make_pipeline = client.pipeline
+
+    @wraps(make_pipeline)
+    def pipeline(*args, **kwargs):
+        pipe = make_pipeline(*args, **kwargs)
+        pipe.execute = timed(name)(pipe.execute)
+        return pipe
+    client.pipeline = pipeline
+
+
+def instrument_templates(app, name='render'):
+    """Рендер любого шаблона (render_template, get_template().render) — участок name"""
+    base = app.jinja_env.template_class
+
+    class TimedTemplate(base):
+        def render(self, *args, **kwargs):
+            with span(name):
+                return super().render(*args, **kwargs)
+    app.jinja_env.template_class = TimedTemplate
+
+
+def _begin():
+    _local.timer = RequestTimer()
+
+
+def _finish(resp):
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return resp
+    total_ms = timer.total_ms()
+    resp.headers['Server-Timing'] = timer.server_timing(total_ms)
+    level = logging.INFO if total_ms >= REQUEST_TIMING_LOG_MS else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, "[TIMING] " + json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': resp.status_code,
+            'total_ms': round(total_ms, 1),
+            'spans': {name: {'ms': round(ms, 1), 'n': count} for name, (ms, count) in timer.spans.items()},
+        }, ensure_ascii=False))
+    return resp
+
+
+def _clear(exc=None):
+    _local.timer = None
+
+
+def init_app(app):
+    if not REQUEST_TIMING_ENABLED:
+        return
+    instrument_templates(app)
+    app.before_request(_begin)
+    app.after_request(_finish)
+    app.teardown_request(_clear)
@@ -187,9 +187,7 @@ function initializeApp() {
                 </div>
             `;
 
-            const response = await fetch(`/${tabName}`);
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            const html = await response.text();
+            const html = await fetchTabHtml(tabName);
             
             // Кэшируем HTML для следующих загрузок
             tabCache[tabName] = html;
@@ -221,36 +219,46 @@ function initializeApp() {
     const searchBtn = document.getElementById('search-btn');
     const searchInput = document.getElementById('search-input');
 
+    async function runSearch(query, page = 1) {
+        try {
+            contentArea.innerHTML = `
+                <div style="text-align: center; padding: 50px; color: var(--accent);">
+                    <div class="ultra-modern-spinner" style="margin: 0 auto 20px;"></div>
+                    <div>🌀 Поиск по запросу: "${escapeHtml(query)}"...</div>
+                </div>
+            `;
+            const response = await fetch(`/search?q=${encodeURIComponent(query)}&page=${page}`);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            const html = await response.text();
+            contentArea.innerHTML = html;
+            addDynamicFeatures();
+        } catch (error) {
+            console.error('Ошибка поиска:', error);
+            contentArea.innerHTML = `
+                <div style="text-align: center; padding: 50px; color: var(--warning);">
+                    <h2>❌ Ошибка поиска</h2>
+                    <p>Не удалось выполнить поиск. Попробуйте позже.</p>
+                    <small>${error.message}</small>
+                </div>
+            `;
+        }
+    }
+
     if (searchBtn) {
-        searchBtn.addEventListener('click', async function () {
+        searchBtn.addEventListener('click', function () {
             const query = searchInput ? searchInput.value.trim() : '';
-            if (query) {
-                try {
-                    contentArea.innerHTML = `
-                        <div style="text-align: center; padding: 50px; color: var(--accent);">
-                            <div class="ultra-modern-spinner" style="margin: 0 auto 20px;"></div>
-                            <div>🌀 Поиск по запросу: "${query}"...</div>
-                        </div>
-                    `;
-                    const response = await fetch(`/search?q=${encodeURIComponent(query)}`);
-                    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-                    const html = await response.text();
-                    contentArea.innerHTML = html;
-                    addDynamicFeatures();
-                } catch (error) {
-                    console.error('Ошибка поиска:', error);
-                    contentArea.innerHTML = `
-                        <div style="text-align: center; padding: 50px; color: var(--warning);">
-                            <h2>❌ Ошибка поиска</h2>
-                            <p>Не удалось выполнить поиск. Попробуйте позже.</p>
-                            <small>${error.message}</small>
-                        </div>
-                    `;
-                }
-            }
+            if (query) runSearch(query);
         });
     }
 
+    // Переключение страниц результатов поиска
+    contentArea.addEventListener('click', function (e) {
+        const link = e.target.closest('.search-page-link');
+        if (!link) return;
+        e.preventDefault();
+        runSearch(link.dataset.query, link.dataset.page);
+    });
+
     if (searchInput) {
         searchInput.addEventListener('keypress', function (e) {
             if (e.key === 'Enter') {
@@ -275,8 +283,7 @@ function initializeApp() {
         // Предзагружаем остальные вкладки в фоне
         const otherTabs = ['trailers', 'news'];
         otherTabs.forEach(tabName => {
-            fetch(`/${tabName}`)
-                .then(response => response.text())
+            fetchTabHtml(tabName)
                 .then(html => {
                     tabCache[tabName] = html;
                     console.log(`Вкладка ${tabName} предзагружена и закэширована`);
@@ -300,35 +307,206 @@ function initializeApp() {
 
     console.log("Приложение инициализировано, скролл разрешен");
     
-    // --- НОВОЕ: Автоматическое обновление контента ---
-    // Периодически проверяем, не появились ли новые данные
-    setInterval(async () => {
-        console.log(`Проверка обновлений для вкладки: ${currentTab}`);
+    // --- НОВОЕ: Живые обновления (SSE); без потока событий — опрос вкладки раз в 5 минут ---
+    connectLiveEvents(contentArea);
+    // --- КОНЕЦ НОВОГО ---
+}
+
+// --- НОВОЕ: Вкладки из компактного JSON (/api/v1/<тип>), карточки рисуются на клиенте ---
+// Серверный HTML (/<тип>) остаётся запасным: для админа (кнопки и формы) и при ошибке JSON
+const TAB_TITLES = {moments: '🎬 Моменты из кино', trailers: '🎥 Трейлеры', news: '📰 Новости'};
+const TAB_EMPTY = {
+    moments: 'Пока нет добавленных моментов из фильмов',
+    trailers: 'Пока нет добавленных трейлеров',
+    news: 'Пока нет добавленных новостей'
+};
+const CARD_MEDIA_TYPES = {moments: 'moment-preview', trailers: 'trailer-preview', news: 'news-image'};
+const CARD_REACTIONS = [['like', '👍'], ['dislike', '👎'], ['star', '⭐'], ['fire', '🔥']];
+
+async function fetchTabHtml(tabName) {
+    try {
+        const response = await fetch(`/api/v1/${tabName}`);
+        if (response.ok) {
+            const data = await response.json();
+            if (!data.a) return renderTab(data);
+        }
+    } catch (error) {
+        console.warn(`JSON вкладки ${tabName} недоступен, загружаем HTML:`, error);
+    }
+    const response = await fetch(`/${tabName}`);
+    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+    return response.text();
+}
+
+function escapeAttr(text) {
+    return String(text).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+}
+
+function renderPicture(data, card, imgAttrs) {
+    const mediaType = CARD_MEDIA_TYPES[data.k];
+    const sources = card.s ? data.f.map(fmt => {
+        const srcset = data.w.map(w => `/img/${mediaType}/${card.i}/${w}.${fmt} ${w}w`).join(', ');
+        return `<source type="image/${fmt}" srcset="${srcset}" sizes="(max-width: 768px) 100vw, 400px">`;
+    }).join('') : '';
+    return `<picture>${sources}<img src="${escapeAttr(card.p)}" alt="${escapeAttr(card.t)}" ${imgAttrs} loading="lazy" decoding="async"></picture>`;
+}
+
+function renderVideoCard(data, card) {
+    const singular = data.k === 'moments' ? 'moment' : 'trailer';
+    const href = `/${data.k}/${card.i}`;
+    const preview = card.p
+        ? renderPicture(data, card, 'class="video-preview"')
+        : '<div class="video-placeholder"><div class="play-icon">▶</div></div>';
+    return `
+        <div class="card" data-${singular}-id="${card.i}">
+            <a href="${href}" class="video-preview-link">
+                <div class="video-preview-container">
+                    ${preview}
+                    <div class="play-overlay"><div class="play-button">▶</div></div>
+                </div>
+            </a>
+            <h3 class="card-title"><a href="${href}" class="title-link">${escapeAttr(card.t)}</a></h3>
+        </div>`;
+}
+
+function renderNewsCard(data, card) {
+    const image = card.p
+        ? renderPicture(data, card, 'class="card-media" onerror="this.style.display=\'none\'" style="border-radius: 10px; max-width: 100%;"')
+        : '';
+    const reactions = CARD_REACTIONS.map(([name, icon], index) => `
+        <button class="reaction-btn" data-id="${card.i}" data-type="news" data-reaction="${name}">
+            ${icon} <span class="reaction-count">${card.r[index]}</span>
+        </button>`).join('');
+    return `
+        <div class="card" data-news-id="${card.i}">
+            <h3 class="card-title">${escapeAttr(card.t)}</h3>
+            ${image}
+            <div class="card-text">${escapeAttr(card.x || '')}</div>
+            <div class="reactions">${reactions}</div>
+            <div class="comments-section">
+                <button class="load-comments tab-btn" data-id="${card.i}" data-type="news" style="margin-bottom: 15px; padding: 8px 15px;">
+                    💬 Показать комментарии (${card.n})
+                </button>
+                <div class="comments-list"></div>
+                <form class="comment-form" data-id="${card.i}" data-type="news">
+                    <textarea class="comment-input" placeholder="Написать комментарий..."></textarea>
+                    <button type="submit" class="submit-btn">Отправить</button>
+                </form>
+            </div>
+        </div>`;
+}
+
+function renderTab(data) {
+    const renderCard = data.k === 'news' ? renderNewsCard : renderVideoCard;
+    const cards = data.items.length
+        ? data.items.map(card => renderCard(data, card)).join('')
+        : `<div style="text-align: center; padding: 50px; color: var(--accent);"><h2>${TAB_TITLES[data.k]}</h2><p>${TAB_EMPTY[data.k]}</p></div>`;
+    return `
+        <div class="content-section">
+            <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px;">
+                <h2 style="background: linear-gradient(45deg, #00f3ff, #ff00c8); -webkit-background-clip: text; -webkit-text-fill-color: transparent; font-size: 2em;">${TAB_TITLES[data.k]}</h2>
+            </div>
+            <div class="card-grid">${cards}</div>
+        </div>`;
+}
+
+// --- НОВОЕ: Живые обновления через Server-Sent Events: карточки правятся на месте ---
+const TAB_BY_ITEM_TYPE = {moments: 'moments', moment: 'moments', trailers: 'trailers', trailer: 'trailers', news: 'news'};
+
+const LIVE_POLL_INTERVAL = 300000;          // опрос вкладки раз в 5 минут, пока поток событий недоступен
+const LIVE_RECONNECT_MIN = 30000;            // повторная попытка подключиться к потоку...
+const LIVE_RECONNECT_MAX = 30 * 60 * 1000;   // ...с удвоением паузы до 30 минут
+let livePollTimer = null;
+let liveReconnectDelay = LIVE_RECONNECT_MIN;
+
+function connectLiveEvents(contentArea) {
+    const meta = document.querySelector('meta[name="events-url"]');
+    const eventsUrl = meta ? meta.content : '';
+    if (!window.EventSource || !eventsUrl) {
+        startLivePolling();
+        return;
+    }
+    const source = new EventSource(eventsUrl);
+    let disconnected = false;
+    source.onmessage = (e) => {
         try {
-            // Отправляем HEAD-запрос, чтобы проверить ETag
-            const headResponse = await fetch(`/${currentTab}`, { method: 'HEAD', cache: 'no-cache' });
-            const newEtag = headResponse.headers.get('ETag') || headResponse.headers.get('x-etag');
-            
-            if (newEtag) {
-                // Получаем текущий ETag из кэша браузера (если есть)
-                // Для простоты, просто перезагрузим содержимое вкладки
-                // Это более надежный способ, чем сравнение ETags вручную
-                console.log(`Найден новый ETag для ${currentTab}: ${newEtag}. Перезагрузка содержимого...`);
-                // Очищаем кэш для этой вкладки
-                delete tabCache[currentTab];
-                // Перезагружаем содержимое
-                const activeTabBtn = document.querySelector(`.tab-btn[data-tab="${currentTab}"]`);
-                if (activeTabBtn) {
-                    activeTabBtn.click();
-                }
-            } else {
-                console.log(`Нет нового ETag для ${currentTab}. Контент не изменился.`);
-            }
+            applyLiveEvent(JSON.parse(e.data), contentArea);
         } catch (error) {
-            console.warn(`Ошибка при проверке обновлений для ${currentTab}:`, error);
+            console.warn('Некорректное событие обновления:', error);
         }
-    }, 300000); // Проверяем каждые 5 минут (300 секунд)
-    // --- КОНЕЦ НОВОГО ---
+    };
+    // Обрыв соединения: браузер переподключается сам; пропущенные за это время события делают кэш вкладок устаревшим.
+    // Ответ не 200 (например, /events не проксируется на events_server.py): браузер больше не пытается —
+    // обновляем вкладку опросом и время от времени пробуем поток снова
+    source.onerror = () => {
+        disconnected = true;
+        if (source.readyState !== EventSource.CLOSED) return;
+        startLivePolling();
+        setTimeout(() => connectLiveEvents(contentArea), liveReconnectDelay);
+        liveReconnectDelay = Math.min(liveReconnectDelay * 2, LIVE_RECONNECT_MAX);
+    };
+    source.onopen = () => {
+        stopLivePolling();
+        liveReconnectDelay = LIVE_RECONNECT_MIN;
+        if (disconnected) {
+            tabCache = {};
+            disconnected = false;
+        }
+    };
+}
+
+function startLivePolling() {
+    if (livePollTimer) return;
+    livePollTimer = setInterval(() => {
+        delete tabCache[currentTab];
+        const activeTabBtn = document.querySelector(`.tab-btn[data-tab="${currentTab}"]`);
+        if (activeTabBtn) activeTabBtn.click();
+    }, LIVE_POLL_INTERVAL);
+}
+
+function stopLivePolling() {
+    clearInterval(livePollTimer);
+    livePollTimer = null;
+}
+
+function applyLiveEvent(event, contentArea) {
+    const tab = TAB_BY_ITEM_TYPE[event.item_type];
+    if (!tab) return;
+    if (event.type === 'item') {
+        delete tabCache[tab];
+        if (tab === currentTab) {
+            const activeTabBtn = document.querySelector(`.tab-btn[data-tab="${tab}"]`);
+            if (activeTabBtn) activeTabBtn.click();
+        }
+        return;
+    }
+    if (tab !== currentTab) {
+        // Карточек на экране нет: при открытии вкладка загрузится заново
+        delete tabCache[tab];
+        return;
+    }
+    let changed = false;
+    if (event.type === 'reaction') {
+        Object.entries(event.reactions || {}).forEach(([reaction, count]) => {
+            document.querySelectorAll(`.reaction-btn[data-id="${event.item_id}"][data-reaction="${reaction}"]`).forEach(btn => {
+                const countSpan = btn.querySelector('.reaction-count');
+                if (TAB_BY_ITEM_TYPE[btn.dataset.type] === tab && countSpan) {
+                    countSpan.textContent = count;
+                    changed = true;
+                }
+            });
+        });
+    } else if (event.type === 'comment') {
+        document.querySelectorAll(`.load-comments[data-id="${event.item_id}"]`).forEach(btn => {
+            const match = btn.textContent.match(/\((\d+)\)/);
+            if (TAB_BY_ITEM_TYPE[btn.dataset.type] !== tab || !match) return;
+            const count = event.comments_count != null ? event.comments_count : parseInt(match[1]) + (event.added || 1);
+            btn.textContent = btn.textContent.replace(/\(\d+\)/, `(${count})`);
+            changed = true;
+        });
+    }
+    // Сохранённый HTML вкладки должен совпадать с тем, что на экране
+    if (changed && contentArea) tabCache[tab] = contentArea.innerHTML;
 }
 
 // --- Динамические функции после загрузки контента ---
@@ -564,9 +742,8 @@ function addReactionHandlers() {
                 const result = await response.json();
                 if (result.success) {
                     const countSpan = this.querySelector('.reaction-count');
-                    if (countSpan) {
-                        const currentCount = parseInt(countSpan.textContent) || 0;
-                        countSpan.textContent = currentCount + 1;
+                    if (countSpan && result.reactions) {
+                        countSpan.textContent = result.reactions[reaction] || 0;
                     }
                 }
             } catch (error) {
@@ -614,6 +791,11 @@ function addCommentHandlers() {
                         })
                     });
 
+                    if (response.status === 429) {
+                        const limited = await response.json();
+                        alert(limited.error || 'Слишком много комментариев, попробуйте позже');
+                        return;
+                    }
                     if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
                     const result = await response.json();
                     if (result.success) {
@@ -799,6 +981,12 @@ function setupFormSubmissions() {
     setupContentForm('add-news-form', 'image_type', '/api/add_news', 'add-news-modal', true);
 }
 
+// --- НОВОЕ: Подписанные данные Telegram WebApp для проверки прав на сервере ---
+function telegramAuthHeaders(headers = {}) {
+    const initData = window.Telegram && window.Telegram.WebApp ? window.Telegram.WebApp.initData : '';
+    return initData ? { ...headers, 'X-Telegram-Init-Data': initData } : headers;
+}
+
 function setupContentForm(formId, typeName, apiUrl, modalId, alwaysFormData=false) {
     const form = document.getElementById(formId);
     if (!form) return;
@@ -815,13 +1003,14 @@ function setupContentForm(formId, typeName, apiUrl, modalId, alwaysFormData=fals
         try {
             let response;
             if (!alwaysFormData && typeValue === 'upload' && this.querySelector(`input[name="${typeName}_file"]`)?.files[0]) {
-                response = await fetch(apiUrl, { method: 'POST', body: formData });
+                response = await fetch(apiUrl, { method: 'POST', headers: telegramAuthHeaders(), body: formData });
             } else {
                 const jsonData = {};
                 formData.forEach((v, k) => jsonData[k] = v);
-                response = await fetch(apiUrl, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(jsonData) });
+                response = await fetch(apiUrl, { method: 'POST', headers: telegramAuthHeaders({ 'Content-Type': 'application/json' }), body: JSON.stringify(jsonData) });
             }
 
+            if (response.status === 403) throw new Error('Недостаточно прав для добавления');
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
             const result = await response.json();
             if (result.success) {
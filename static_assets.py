@@ -0,0 +1,142 @@
+# static_assets.py
+# Сборка статики: минификация JS/CSS, имя с хэшем содержимого, заранее сжатые .gz/.br копии
+# и manifest.json (исходный путь -> путь с хэшем). Новый деплой меняет URL изменившихся файлов,
+# поэтому их можно отдавать с Cache-Control: immutable.
+#
+# Сборка: python static_assets.py  (результат в static/dist, выполняется при сборке образа)
+# Минификация — rjsmin/rcssmin, brotli — пакет Brotli (requirements.txt). Без них файлы
+# копируются как есть / без .br, сайт работает и без сборки (ссылки на исходные файлы).
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+try:
+    import brotli
+except ImportError:  # Без Brotli отдаём только gzip
+    brotli = None
+
+# --- Конфигурация ---
+STATIC_DIR = os.environ.get('STATIC_DIR', 'static')
+DIST_DIRNAME = 'dist'  # подкаталог STATIC_DIR, URL вида /static/dist/js/main.<хэш>.js
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.txt', '.map'}
+COMPRESS_MIN_SIZE = 1024  # мелкие файлы сжатие почти не уменьшает
+# Расширение копии -> значение Content-Encoding, в порядке предпочтения
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+
+def minify(path, data):
+    ext = os.path.splitext(path)[1]
+    if ext == '.js' and rjsmin:
+        return rjsmin.jsmin(data.decode('utf-8')).encode('utf-8')
+    if ext == '.css' and rcssmin:
+        return rcssmin.cssmin(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def hashed_name(path, data):
+    """css/style.css -> css/style.<хэш>.css"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build(static_dir=STATIC_DIR):
+    """Собирает static/dist и manifest.json. Возвращает манифест."""
+    dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for name in sorted(f for f in files if not f.startswith('.')):
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                original = f.read()
+            data = minify(path, original)
+            target = f"{DIST_DIRNAME}/{hashed_name(path, data)}"
+            target_path = os.path.join(static_dir, target)
+            _write(target_path, data)
+            variants = []
+            if os.path.splitext(path)[1] in COMPRESSIBLE_EXTENSIONS and len(data) >= COMPRESS_MIN_SIZE:
+                compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli:
+                    compressed['.br'] = brotli.compress(data, quality=11)
+                for suffix, payload in compressed.items():
+                    if len(payload) < len(data):
+                        _write(target_path + suffix, payload)
+                        variants.append(f"{suffix}={len(payload)}")
+            manifest[path] = target
+            logger.info(f"[STATIC] {path} ({len(original)} Б) -> {target} ({len(data)} Б) {' '.join(variants)}")
+    _write(os.path.join(dist_dir, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class AssetManifest:
+    """Соответствие исходных путей статики собранным файлам (manifest.json из build)"""
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.assets = {}
+        self.hashed = set()
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.static_dir, DIST_DIRNAME, MANIFEST_NAME)
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.assets = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"[STATIC] {path} не найден: статика отдаётся без сборки (python static_assets.py)")
+            self.assets = {}
+        except ValueError as e:
+            logger.error(f"[STATIC] Повреждён {path}: {e}")
+            self.assets = {}
+        self.hashed = set(self.assets.values())
+
+    def resolve(self, path):
+        """Путь к собранному файлу, если он есть, иначе исходный путь"""
+        return self.assets.get(path, path)
+
+    def is_hashed(self, path):
+        return path in self.hashed
+
+    def precompressed(self, path, accept_encodings):
+        """
+        Лучшая заранее сжатая копия собранного файла, которую принимает клиент:
+        (путь копии, Content-Encoding) или (path, None).
+        accept_encodings — request.accept_encodings.
+        """
+        for suffix, encoding in ENCODINGS:
+            if accept_encodings.quality(encoding) > 0 and os.path.isfile(os.path.join(self.static_dir, path + suffix)):
+                return path + suffix, encoding
+        return path, None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    assets = build()
+    logger.info(f"[STATIC] Собрано файлов: {len(assets)}")
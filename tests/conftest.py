@@ -0,0 +1,6 @@
+# tests/conftest.py
+# Корень репозитория в sys.path: тесты импортируют модули приложения напрямую.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
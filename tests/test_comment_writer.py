@@ -0,0 +1,85 @@
+# tests/test_comment_writer.py
+# Очередь комментариев (comment_writer.py): строка, которую БД не принимает, не должна
+# останавливать запись остальных. Вместо PostgreSQL — список в памяти, отвергающий NUL
+# как psycopg2.
+import json
+
+import pytest
+
+import comment_writer
+from comment_writer import CommentWriter, PENDING_KEY, PROCESSING_KEY, DEAD_KEY
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = []
+        self.fail = None
+
+    def save_batch(self, rows):
+        if self.fail:
+            raise self.fail
+        for row in rows:
+            if '\x00' in row[4]:
+                raise ValueError('A string literal cannot contain NUL (0x00) characters.')
+        saved = [{'request_id': r[0], 'item_id': r[2], 'text': r[4]} for r in rows
+                 if r[0] not in {s['request_id'] for s in self.rows}]
+        self.rows.extend(saved)
+        return saved
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    table = FakeTable()
+    writer = CommentWriter(redis_client, table.save_batch)
+    monkeypatch.setattr(writer, '_ensure_started', lambda: None)
+    return writer, table
+
+
+def test_flush_writes_queue(writer):
+    writer, table = writer
+    for i in range(3):
+        writer.submit('moments', 1, 'Гость', f"комментарий {i}")
+    assert writer.flush() == 3
+    assert [r['text'] for r in table.rows] == ['комментарий 0', 'комментарий 1', 'комментарий 2']
+    assert not writer.redis_client.exists(PENDING_KEY, PROCESSING_KEY)
+
+
+def test_rejected_row_goes_to_dead_letter(writer):
+    writer, table = writer
+    writer.submit('moments', 1, 'Гость', 'до')
+    writer.submit('moments', 1, 'Гость', 'плохой\x00текст')
+    writer.submit('moments', 1, 'Гость', 'после')
+    assert writer.flush() == 2
+    assert [r['text'] for r in table.rows] == ['до', 'после']
+    dead = [json.loads(item) for item in writer.redis_client.lrange(DEAD_KEY, 0, -1)]
+    assert [row[4] for row in dead] == ['плохой\x00текст']
+    assert not writer.redis_client.exists(PROCESSING_KEY)
+
+    # Очередь продолжает работать
+    writer.submit('moments', 1, 'Гость', 'следующий')
+    assert writer.flush() == 1
+
+
+def test_outage_keeps_batch_for_retry(writer):
+    writer, table = writer
+    writer.submit('moments', 1, 'Гость', 'текст')
+    table.fail = ConnectionError('БД недоступна')
+    with pytest.raises(ConnectionError):
+        writer.flush()
+    assert writer.redis_client.llen(PROCESSING_KEY) == 1
+    assert not writer.redis_client.exists(DEAD_KEY)
+
+    table.fail = None
+    assert writer.flush() == 1
+    assert not writer.redis_client.exists(PROCESSING_KEY)
+
+
+def test_dead_letter_list_is_capped(writer, monkeypatch):
+    writer, table = writer
+    monkeypatch.setattr(comment_writer, 'DEAD_LETTER_LIMIT', 2)
+    for i in range(3):
+        writer.submit('moments', 1, 'Гость', f"{i}\x00")
+    assert writer.flush() == 0
+    assert [json.loads(item)[4] for item in writer.redis_client.lrange(DEAD_KEY, 0, -1)] == ['1\x00', '2\x00']
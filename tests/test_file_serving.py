@@ -0,0 +1,114 @@
+# tests/test_file_serving.py
+# Отдача больших загрузок (file_serving.py): просмотр целиком, перемотка (Range) и условные запросы.
+# Файл 500 МБ разреженный (truncate), с метками случайных байтов в начале, середине и конце,
+# чтобы проверять, что диапазон взят с нужного места.
+import os
+import hashlib
+
+import pytest
+from flask import Flask
+
+import file_serving
+
+SIZE = 500 * 1024 * 1024
+MARK = 64 * 1024
+NAME = 'movie.mp4'
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('uploads')
+    path = directory / NAME
+    with open(path, 'wb') as f:
+        f.truncate(SIZE)
+        for offset in (0, SIZE // 2, SIZE - MARK):
+            f.seek(offset)
+            f.write(os.urandom(MARK))
+    return str(directory), str(path)
+
+
+@pytest.fixture(scope='module')
+def client(video):
+    directory, _ = video
+    app = Flask(__name__)
+
+    @app.route('/uploads/<filename>', methods=['GET', 'HEAD'])
+    def uploaded_file(filename):
+        return file_serving.serve_file(directory, filename, max_age=3600)
+    return app.test_client()
+
+
+def read_bytes(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(stop - start)
+
+
+def sha256_of(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def test_full_read(client, video):
+    _, path = video
+    resp = client.get(f"/uploads/{NAME}", buffered=False)
+    assert resp.status_code == 200
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['Content-Type'] == 'video/mp4'
+    assert int(resp.headers['Content-Length']) == SIZE
+    with open(path, 'rb') as f:
+        expected = sha256_of(iter(lambda: f.read(1024 * 1024), b''))
+    assert sha256_of(resp.response) == expected
+    resp.close()
+
+
+def test_single_range(client, video):
+    _, path = video
+    start, stop = SIZE // 2 - 1000, SIZE // 2 + 1000
+    resp = client.get(f"/uploads/{NAME}", headers={'Range': f"bytes={start}-{stop - 1}"})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f"bytes {start}-{stop - 1}/{SIZE}"
+    assert int(resp.headers['Content-Length']) == stop - start
+    assert resp.data == read_bytes(path, start, stop)
+
+
+def test_suffix_range(client, video):
+    _, path = video
+    resp = client.get(f"/uploads/{NAME}", headers={'Range': 'bytes=-1000'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f"bytes {SIZE - 1000}-{SIZE - 1}/{SIZE}"
+    assert resp.data == read_bytes(path, SIZE - 1000, SIZE)
+
+
+def test_unsatisfiable_range(client):
+    resp = client.get(f"/uploads/{NAME}", headers={'Range': f"bytes={SIZE}-"})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f"bytes */{SIZE}"
+
+
+def test_if_none_match(client):
+    etag = client.head(f"/uploads/{NAME}").headers['ETag']
+    resp = client.get(f"/uploads/{NAME}", headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+
+def test_stale_if_range_returns_full_file(client, video):
+    _, path = video
+    etag = client.head(f"/uploads/{NAME}").headers['ETag']
+    resp = client.get(f"/uploads/{NAME}", headers={'Range': 'bytes=0-99', 'If-Range': etag})
+    assert resp.status_code == 206
+    assert resp.data == read_bytes(path, 0, 100)
+
+    resp = client.get(f"/uploads/{NAME}", headers={'Range': 'bytes=0-99', 'If-Range': '"other"'}, buffered=False)
+    assert resp.status_code == 200
+    assert 'Content-Range' not in resp.headers
+    assert int(resp.headers['Content-Length']) == SIZE
+    assert next(iter(resp.response))[:100] == read_bytes(path, 0, 100)
+    resp.close()
+
+
+def test_missing_file(client):
+    assert client.get('/uploads/missing.mp4').status_code == 404
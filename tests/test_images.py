@@ -0,0 +1,47 @@
+# tests/test_images.py
+# Копии картинок (images.py) и их вывод в карточках: блокировка копии снимается и после ошибки,
+# а формат, который сборка OpenCV не кодирует, не попадает в <picture> пустым srcset.
+import os
+
+import pytest
+from jinja2 import Environment, FileSystemLoader
+
+import images
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+
+def test_failed_render_releases_lock(tmp_path, monkeypatch):
+    pytest.importorskip('cv2')
+    monkeypatch.setattr(images, 'IMAGE_CACHE_DIR', str(tmp_path))
+    original = tmp_path / 'broken.jpg'
+    original.write_bytes(b'not an image')
+    path = images.variant_path('broken', 320, 'jpg')
+
+    with pytest.raises(ValueError):
+        images.get_variant('broken', lambda: str(original), 320, 'jpg')
+    assert path not in images._locks
+    assert not os.path.exists(path)
+
+    assert images.get_variant('missing', lambda: None, 320, 'jpg') is None
+    assert images.variant_path('missing', 320, 'jpg') not in images._locks
+
+
+@pytest.mark.parametrize('template, item', [
+    ('cards/moment.html', {'id': 1, 'title': 'Момент', 'preview_url': '/uploads/p.jpg'}),
+    ('cards/trailer.html', {'id': 2, 'title': 'Трейлер', 'preview_url': '/uploads/p.jpg'}),
+    ('cards/news.html', {'id': 3, 'title': 'Новость', 'text': 'Текст', 'image_url': '/uploads/n.jpg',
+                         'reactions': {'like': 0, 'dislike': 0, 'star': 0, 'fire': 0}, 'comments_count': 0}),
+])
+def test_cards_skip_unsupported_formats(template, item):
+    env = Environment(loader=FileSystemLoader(TEMPLATES))
+    env.globals.update(
+        # Как image_srcset приложения при сборке OpenCV без AVIF
+        image_srcset=lambda media_type, item_id, url, fmt='webp': '' if fmt == 'avif' else f"/img/{item_id}.{fmt} 320w",
+        media_url=lambda media_type, item_id, url: url,
+        url_for=lambda endpoint, **values: f"/{endpoint}/{values.get('item_id', '')}",
+    )
+    html = env.get_template(template).render(item=item)
+    assert 'image/avif' not in html
+    assert 'srcset=""' not in html
+    assert f'<source type="image/webp" srcset="/img/{item["id"]}.webp 320w"' in html
@@ -0,0 +1,173 @@
+# tests/test_link_resolver.py
+# Поиск фильма по ссылке: нормализация, защита от запросов во внутреннюю сеть, извлечение
+# метаданных yt-dlp со страниц-фикстур (tests/fixtures/link_pages, раздаются локальным http.server),
+# кэш Redis -> PostgreSQL и подбор похожего контента.
+#
+# Тесты кэша и подбора нужны PostgreSQL (DATABASE_URL, данные в отдельной схеме) и fakeredis;
+# без них они пропускаются.
+import os
+import time
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+import link_resolver
+from link_resolver import ResolverError, ResolverTimeout
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'link_pages')
+SCHEMA = 'test_link_resolver'
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        FixtureHandler.requested.append(self.path)
+        if self.path.startswith('/slow'):
+            time.sleep(5)
+            self.send_error(504)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def fixture_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(FixtureHandler, directory=FIXTURES))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('youtu.be/dQw4w9WgXcQ?si=abc', 'https://youtube.com/watch?v=dQw4w9WgXcQ'),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', 'https://youtube.com/watch?v=dQw4w9WgXcQ'),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=share&t=10', 'https://youtube.com/watch?v=dQw4w9WgXcQ'),
+    ('https://WWW.TikTok.com/@user/video/123/?utm_source=x&is_from_webapp=1#c', 'https://tiktok.com/@user/video/123'),
+    ('https://example.com:443//film//?b=2&a=1&fbclid=x', 'https://example.com/film?a=1&b=2'),
+])
+def test_normalize_url(url, expected):
+    assert link_resolver.normalize_url(url) == expected
+
+
+@pytest.mark.parametrize('url', [
+    '', 'ftp://example.com/film', 'http://localhost:8080/', 'http://127.0.0.1/', 'http://2130706433/',
+    'http://169.254.169.254/latest/meta-data/', 'http://10.1.2.3/', 'http://[::1]/', 'http://[::ffff:127.0.0.1]/',
+    'http://postgres.railway.internal/', 'http://intranet/',
+])
+def test_normalize_url_rejects_internal_and_unsupported(url):
+    with pytest.raises(ResolverError):
+        link_resolver.normalize_url(url)
+
+
+def test_extract_metadata_does_not_fetch_internal_hosts(fixture_server):
+    FixtureHandler.requested.clear()
+    with pytest.raises(ResolverError):
+        link_resolver.extract_metadata(f"{fixture_server}/film.html")
+    assert FixtureHandler.requested == []
+
+
+def test_extract_fixture_page(fixture_server):
+    metadata = link_resolver._extract(f"{fixture_server}/film.html", allowed_extractors=['generic'], time_limit=10)
+    assert metadata['title'] == 'Дюна: Часть вторая (2024) — трейлер'
+    assert metadata['description'] == 'Официальный трейлер фильма 2024 года'
+    assert metadata['thumbnail'] == '/media/poster.jpg'
+    assert metadata['year'] == 2024
+    assert metadata['webpage_url'] == f"{fixture_server}/film.html"
+
+
+def test_generic_extractor_disabled_by_default(fixture_server):
+    FixtureHandler.requested.clear()
+    with pytest.raises(RuntimeError):
+        link_resolver._extract(f"{fixture_server}/film.html", time_limit=10)
+    assert FixtureHandler.requested == []
+
+
+def test_extract_hard_time_limit(fixture_server):
+    started = time.monotonic()
+    with pytest.raises(ResolverTimeout):
+        link_resolver._extract(f"{fixture_server}/slow", allowed_extractors=['generic'], time_limit=1)
+    assert time.monotonic() - started < 3
+
+
+# --- Кэш и подбор контента (PostgreSQL + Redis) ---
+
+@pytest.fixture(scope='module')
+def webapp():
+    fakeredis = pytest.importorskip('fakeredis')
+    if not os.environ.get('DATABASE_URL'):
+        pytest.skip('DATABASE_URL не задан')
+    import psycopg2
+    admin_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    admin_conn.autocommit = True
+    admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    previous = os.environ.get('PGOPTIONS')
+    os.environ['PGOPTIONS'] = f"-c search_path={SCHEMA},public"
+    try:
+        import app as webapp
+        import database
+        database.init_db()
+        webapp.redis_client = fakeredis.FakeRedis(decode_responses=True)
+        yield webapp
+    finally:
+        if previous is None:
+            os.environ.pop('PGOPTIONS', None)
+        else:
+            os.environ['PGOPTIONS'] = previous
+        admin_conn.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        admin_conn.close()
+
+
+@pytest.fixture
+def fixture_extractor(monkeypatch, fixture_server):
+    """extract_metadata приложения читает страницу-фикстуру вместо внешнего сайта"""
+    calls = []
+
+    def extract(url, timeout=None):
+        calls.append(url)
+        return link_resolver._extract(f"{fixture_server}/film.html", allowed_extractors=['generic'], time_limit=10)
+    monkeypatch.setattr(link_resolver, 'extract_metadata', extract)
+    return calls
+
+
+def test_metadata_cache_round_trip(webapp, fixture_extractor):
+    url = link_resolver.normalize_url('https://example.com/films/dune-2?utm_source=tg')
+    cache_key = f"link_meta_{link_resolver.url_hash(url)}"
+
+    first = webapp.resolve_link_metadata(url)
+    assert first['title'] == 'Дюна: Часть вторая (2024) — трейлер'
+    assert webapp.cache_get(cache_key) == first
+    assert webapp.resolve_link_metadata(url) == first
+    assert len(fixture_extractor) == 1
+
+    # Redis очищен (перезапуск, вытеснение): данные возвращаются из PostgreSQL и снова кэшируются
+    webapp.redis_client.flushdb()
+    assert webapp.resolve_link_metadata(url) == first
+    assert len(fixture_extractor) == 1
+    assert webapp.cache_get(cache_key) == first
+
+
+def test_search_by_link_matches_existing_content(webapp, fixture_extractor):
+    import database
+    moment_id = database.add_moment('Дюна: Часть вторая — битва на Арракисе', 'Сцена', '/uploads/dune.mp4')
+    database.add_moment('Интерстеллар — стыковка', 'Сцена', '/uploads/interstellar.mp4')
+
+    resp = webapp.app.test_client().post('/api/search_film_by_link', json={'url': 'https://example.com/dune'})
+    data = resp.get_json()
+    assert resp.status_code == 200 and data['success']
+    assert data['film']['year'] == 2024
+    assert data['matches'][0]['type'] == 'moments'
+    assert data['matches'][0]['id'] == moment_id
+    assert all(m['title'] != 'Интерстеллар — стыковка' for m in data['matches'])
+
+
+def test_search_by_link_rejects_internal_url(webapp, fixture_extractor):
+    resp = webapp.app.test_client().post('/api/search_film_by_link', json={'url': 'http://169.254.169.254/'})
+    assert resp.status_code == 400
+    assert fixture_extractor == []
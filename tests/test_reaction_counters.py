@@ -0,0 +1,74 @@
+# tests/test_reaction_counters.py
+# Запись реакций из Redis в БД (reaction_counters.py): реакция, которую БД не принимает,
+# не должна останавливать очередь. Вместо PostgreSQL — множество в памяти, отвергающее NUL
+# как psycopg2. Скриптам Redis нужен fakeredis с Lua (lupa).
+import json
+
+import pytest
+
+from reaction_counters import ReactionStore, PROCESSING_KEY, DEAD_KEY
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = set()
+        self.fail = None
+
+    def save_batch(self, rows):
+        if self.fail:
+            raise self.fail
+        for row in rows:
+            if '\x00' in row[2]:
+                raise ValueError('A string literal cannot contain NUL (0x00) characters.')
+        self.rows.update(rows)
+
+    def load_users(self, item_type, item_id):
+        users = {}
+        for t, i, user_id, reaction in self.rows:
+            if (t, i) == (item_type, item_id):
+                users.setdefault(reaction, []).append(user_id)
+        return users
+
+    def load_counts(self, item_type, item_id):
+        return {r: len(u) for r, u in self.load_users(item_type, item_id).items()}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    pytest.importorskip('lupa')
+    fakeredis = pytest.importorskip('fakeredis')
+    table = FakeTable()
+    store = ReactionStore(fakeredis.FakeRedis(decode_responses=True), table.load_users, table.save_batch,
+                          table.load_counts)
+    monkeypatch.setattr(store, '_ensure_started', lambda: None)
+    return store, table
+
+
+def test_rejected_reaction_goes_to_dead_letter(store):
+    store, table = store
+    assert store.record('moments', 1, 'u1', 'like')
+    assert store.record('moments', 1, 'u\x00', 'like')
+    assert store.record('moments', 1, 'u2', 'fire')
+    assert store.flush() == 3
+    assert table.rows == {('moments', 1, 'u1', 'like'), ('moments', 1, 'u2', 'fire')}
+    dead = [json.loads(item) for item in store.redis_client.lrange(DEAD_KEY, 0, -1)]
+    assert dead == [['moments', 1, 'u\x00', 'like']]
+    assert not store.redis_client.exists(PROCESSING_KEY)
+
+    assert store.record('moments', 1, 'u3', 'star')
+    store.flush()
+    assert ('moments', 1, 'u3', 'star') in table.rows
+
+
+def test_outage_keeps_batch_for_retry(store):
+    store, table = store
+    store.record('moments', 1, 'u1', 'like')
+    table.fail = ConnectionError('БД недоступна')
+    with pytest.raises(ConnectionError):
+        store.flush()
+    assert store.redis_client.llen(PROCESSING_KEY) == 1
+    assert not store.redis_client.exists(DEAD_KEY)
+
+    table.fail = None
+    store.flush()
+    assert table.rows == {('moments', 1, 'u1', 'like')}
@@ -0,0 +1,103 @@
+# webhook_queue.py
+# Очередь обновлений Telegram: webhook сразу отвечает 200, а обработка идёт в пуле потоков.
+# Повторно доставленные Telegram обновления (тот же update_id) отбрасываются.
+import os
+import queue
+import logging
+import threading
+from cachetools import TTLCache
+from metrics import WEBHOOK_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# --- Конфигурация ---
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_DEDUP_SECONDS = int(os.environ.get('WEBHOOK_DEDUP_SECONDS', 3600))
+
+
+class UpdateDeduplicator:
+    """Окно дедупликации по update_id: в Redis (общее для всех воркеров) или в памяти процесса"""
+
+    def __init__(self, redis_client=None, window=WEBHOOK_DEDUP_SECONDS):
+        self.redis_client = redis_client
+        self.window = window
+        self._local = TTLCache(maxsize=10000, ttl=window)
+        self._lock = threading.Lock()
+
+    def _key(self, update_id):
+        return f"tg_update_{update_id}"
+
+    def first_seen(self, update_id):
+        """True, если обновление пришло впервые (и отмечает его как полученное)"""
+        if self.redis_client:
+            try:
+                return bool(self.redis_client.set(self._key(update_id), 1, nx=True, ex=self.window))
+            except Exception as e:
+                logger.warning(f"[WEBHOOK] Redis недоступен для дедупликации: {e}")
+        with self._lock:
+            if update_id in self._local:
+                return False
+            self._local[update_id] = True
+            return True
+
+    def forget(self, update_id):
+        """Снимает отметку, чтобы повторная доставка была обработана"""
+        if self.redis_client:
+            try:
+                self.redis_client.delete(self._key(update_id))
+            except Exception:
+                pass
+        with self._lock:
+            self._local.pop(update_id, None)
+
+
+class UpdateWorkerPool:
+    """Ограниченная очередь и пул потоков, вызывающих process_func(update)"""
+
+    def __init__(self, process_func, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE):
+        self.process_func = process_func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Потоки запускаем лениво в том процессе, который принимает запросы (после fork gunicorn)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"tg-update-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+            logger.info(f"[WEBHOOK] Запущено {self.workers} обработчиков обновлений")
+
+    def submit(self, update):
+        """Ставит обновление в очередь. False, если очередь переполнена."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(update)
+            WEBHOOK_QUEUE_DEPTH.inc()
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            update = self.queue.get()
+            WEBHOOK_QUEUE_DEPTH.dec()
+            try:
+                self.process_func(update)
+            except Exception as e:
+                logger.error(f"[WEBHOOK] Ошибка обработки обновления: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()